@@ -4,16 +4,20 @@ Routes FastAPI pour la gestion avancée des documents
 Inclut le versioning, les annotations, les tags et le partage
 """
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Body, Depends, HTTPException, Query
+from pydantic import BaseModel, Field, field_validator
 from sqlalchemy.orm import Session
 from typing import List, Dict, Any, Optional
 from datetime import datetime, timedelta
 import logging
 
-from models import SessionLocal
+from models import SessionLocal, SHARE_PERMISSION_BITS
 from auth import get_current_user
 from document_versioning import DocumentVersioningService
-from document_annotations import DocumentAnnotationService, DocumentTagService
+from document_annotations import (
+    DocumentAnnotationService, DocumentTagService,
+    DEFAULT_PAGE_SIZE, encode_cursor, decode_cursor
+)
 from document_sharing import DocumentSharingService
 
 logger = logging.getLogger(__name__)
@@ -28,6 +32,13 @@ def get_db():
     finally:
         db.close()
 
+def _parse_cursor(cursor: Optional[str]):
+    """Décode le curseur de pagination reçu en paramètre (400 s'il est invalide)"""
+    try:
+        return decode_cursor(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Curseur de pagination invalide")
+
 # ============================================================================
 # ROUTES DE VERSIONING
 # ============================================================================
@@ -59,8 +70,10 @@ async def get_document_versions(
                 for v in versions
             ]
         }
-    except ValueError as e:
+    except PermissionError as e:
         raise HTTPException(status_code=403, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Erreur lors de la récupération des versions: {e}")
         raise HTTPException(status_code=500, detail="Erreur interne du serveur")
@@ -93,8 +106,10 @@ async def get_version(
                 "created_by": version.created_by
             }
         }
-    except ValueError as e:
+    except PermissionError as e:
         raise HTTPException(status_code=403, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Erreur lors de la récupération de la version: {e}")
         raise HTTPException(status_code=500, detail="Erreur interne du serveur")
@@ -115,6 +130,8 @@ async def compare_versions(
             "success": True,
             "comparison": comparison
         }
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -141,6 +158,8 @@ async def restore_version(
                 "created_at": new_version.created_at.isoformat()
             }
         }
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -162,6 +181,8 @@ async def delete_version(
             "success": True,
             "message": "Version supprimée avec succès"
         }
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -183,8 +204,10 @@ async def get_version_statistics(
             "success": True,
             "statistics": stats
         }
-    except ValueError as e:
+    except PermissionError as e:
         raise HTTPException(status_code=403, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Erreur lors de la récupération des statistiques: {e}")
         raise HTTPException(status_code=500, detail="Erreur interne du serveur")
@@ -227,24 +250,69 @@ async def create_annotation(
                 "created_at": annotation.created_at.isoformat()
             }
         }
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Erreur lors de la création de l'annotation: {e}")
         raise HTTPException(status_code=500, detail="Erreur interne du serveur")
 
+class AnnotationItem(BaseModel):
+    """Annotation d'un lot (corps de /{document_id}/annotations/bulk)"""
+    content: str
+    annotation_type: str = "note"
+    position: Optional[Dict[str, Any]] = None
+    tags: Optional[List[str]] = None
+
+@router.post("/{document_id}/annotations/bulk")
+async def bulk_create_annotations(
+    document_id: int,
+    items: List[AnnotationItem] = Body(..., min_length=1),
+    current_user = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Crée plusieurs annotations sur un document en une seule requête
+    
+    Corps : liste non vide de {"content", "annotation_type", "position", "tags"}
+    """
+    try:
+        annotation_service = DocumentAnnotationService(db)
+        annotation_ids = annotation_service.bulk_create_annotations(
+            document_id=document_id,
+            user_id=current_user.id,
+            items=[item.model_dump() for item in items]
+        )
+        
+        return {
+            "success": True,
+            "annotation_ids": annotation_ids,
+            "total_created": len(annotation_ids)
+        }
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Erreur lors de la création des annotations en lot: {e}")
+        raise HTTPException(status_code=500, detail="Erreur interne du serveur")
+
 @router.get("/{document_id}/annotations")
 async def get_document_annotations(
     document_id: int,
     annotation_type: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=1000),
     current_user = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Récupère toutes les annotations d'un document"""
+    """Récupère une page des annotations d'un document (paginée par curseur)"""
+    page_cursor = _parse_cursor(cursor)
     try:
         annotation_service = DocumentAnnotationService(db)
-        annotations = annotation_service.get_document_annotations(
-            document_id, current_user.id, annotation_type
+        annotations, next_cursor = annotation_service.get_document_annotations(
+            document_id, current_user.id, annotation_type, page_cursor, limit
         )
         
         return {
@@ -260,10 +328,13 @@ async def get_document_annotations(
                     "updated_at": a.updated_at.isoformat() if a.updated_at else None
                 }
                 for a in annotations
-            ]
+            ],
+            "next_cursor": encode_cursor(next_cursor)
         }
-    except ValueError as e:
+    except PermissionError as e:
         raise HTTPException(status_code=403, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Erreur lors de la récupération des annotations: {e}")
         raise HTTPException(status_code=500, detail="Erreur interne du serveur")
@@ -295,8 +366,10 @@ async def get_annotation(
                 "updated_at": annotation.updated_at.isoformat() if annotation.updated_at else None
             }
         }
-    except ValueError as e:
+    except PermissionError as e:
         raise HTTPException(status_code=403, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Erreur lors de la récupération de l'annotation: {e}")
         raise HTTPException(status_code=500, detail="Erreur interne du serveur")
@@ -325,6 +398,8 @@ async def update_annotation(
                 "updated_at": annotation.updated_at.isoformat()
             }
         }
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -346,6 +421,8 @@ async def delete_annotation(
             "success": True,
             "message": "Annotation supprimée avec succès"
         }
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -357,29 +434,23 @@ async def search_annotations(
     query: Optional[str] = None,
     annotation_type: Optional[str] = None,
     tags: Optional[List[str]] = Query(None),
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=1000),
     current_user = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Recherche dans les annotations"""
+    """Recherche dans les annotations (paginée par curseur)"""
+    page_cursor = _parse_cursor(cursor)
     try:
         annotation_service = DocumentAnnotationService(db)
-        annotations = annotation_service.search_annotations(
-            current_user.id, query, annotation_type, tags
+        annotations, next_cursor = annotation_service.search_annotations_cached(
+            current_user.id, query, annotation_type, tags, page_cursor, limit
         )
         
         return {
             "success": True,
-            "annotations": [
-                {
-                    "id": a.id,
-                    "document_id": a.document_id,
-                    "annotation_type": a.annotation_type,
-                    "content": a.content,
-                    "tags": a.tags,
-                    "created_at": a.created_at.isoformat()
-                }
-                for a in annotations
-            ]
+            "annotations": annotations,
+            "next_cursor": encode_cursor(next_cursor)
         }
     except Exception as e:
         logger.error(f"Erreur lors de la recherche: {e}")
@@ -441,19 +512,11 @@ async def get_all_tags(
     """Récupère tous les tags"""
     try:
         tag_service = DocumentTagService(db)
-        tags = tag_service.get_all_tags()
+        tags = tag_service.get_all_tags_cached()
         
         return {
             "success": True,
-            "tags": [
-                {
-                    "id": tag.id,
-                    "name": tag.name,
-                    "color": tag.color,
-                    "description": tag.description
-                }
-                for tag in tags
-            ]
+            "tags": tags
         }
     except Exception as e:
         logger.error(f"Erreur lors de la récupération des tags: {e}")
@@ -618,27 +681,103 @@ async def share_document(
                 "created_at": share.created_at.isoformat()
             }
         }
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Erreur lors du partage: {e}")
         raise HTTPException(status_code=500, detail="Erreur interne du serveur")
 
+class BulkShareRequest(BaseModel):
+    """Corps de /{document_id}/share/bulk"""
+    emails: List[str] = Field(..., min_length=1)
+    permissions: List[str] = Field(default_factory=lambda: ["read"], min_length=1)
+    expires_at: Optional[datetime] = None
+    message: Optional[str] = None
+    
+    @field_validator("permissions")
+    @classmethod
+    def check_permissions(cls, v):
+        unknown = [name for name in v if name not in SHARE_PERMISSION_BITS]
+        if unknown:
+            raise ValueError(f"Permissions inconnues: {', '.join(unknown)}")
+        return v
+
+@router.post("/{document_id}/share/bulk")
+async def share_document_bulk(
+    document_id: int,
+    request: BulkShareRequest,
+    current_user = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Partage un document avec plusieurs utilisateurs
+    
+    Corps JSON : {"emails": [...] (au moins un), "permissions": ["read", ...] (défaut
+    ["read"], parmi read, write, comment, share), "expires_at": date ISO optionnelle,
+    "message": texte optionnel}
+    """
+    try:
+        sharing_service = DocumentSharingService(db)
+        shares = sharing_service.share_document_bulk(
+            document_id=document_id,
+            owner_id=current_user.id,
+            shared_with_emails=request.emails,
+            permissions=request.permissions,
+            expires_at=request.expires_at,
+            message=request.message
+        )
+        
+        return {
+            "success": True,
+            "message": f"Document partagé avec {len(shares)} utilisateurs",
+            "shares": [
+                {
+                    "id": share.id,
+                    "document_id": share.document_id,
+                    "shared_with": share.shared_with,
+                    "permissions": share.permissions,
+                    "expires_at": share.expires_at.isoformat() if share.expires_at else None,
+                    "message": share.message,
+                    "created_at": share.created_at.isoformat()
+                }
+                for share in shares
+            ]
+        }
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Erreur lors du partage groupé: {e}")
+        raise HTTPException(status_code=500, detail="Erreur interne du serveur")
+
 @router.get("/shared")
 async def get_shared_documents(
     as_owner: bool = False,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=1000),
     current_user = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Récupère les documents partagés"""
+    """Récupère une page des documents partagés"""
+    page_cursor = _parse_cursor(cursor)
     try:
         sharing_service = DocumentSharingService(db)
-        shared_docs = sharing_service.get_shared_documents(current_user.id, as_owner)
+        shared_docs, next_cursor = sharing_service.get_shared_documents(
+            current_user.id, as_owner, page_cursor, limit
+        )
         
         return {
             "success": True,
-            "shared_documents": shared_docs
+            "shared_documents": shared_docs,
+            "next_cursor": encode_cursor(next_cursor)
         }
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Erreur lors de la récupération des partages: {e}")
         raise HTTPException(status_code=500, detail="Erreur interne du serveur")
@@ -671,8 +810,10 @@ async def get_share(
                 "is_active": share.is_active
             }
         }
-    except ValueError as e:
+    except PermissionError as e:
         raise HTTPException(status_code=403, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except HTTPException:
         raise
     except Exception as e:
@@ -700,6 +841,8 @@ async def update_share_permissions(
                 "updated_at": share.updated_at.isoformat()
             }
         }
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -727,6 +870,8 @@ async def extend_share_expiration(
                 "updated_at": share.updated_at.isoformat()
             }
         }
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -748,6 +893,8 @@ async def revoke_share(
             "success": True,
             "message": "Partage révoqué avec succès"
         }
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
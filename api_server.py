@@ -5,7 +5,6 @@ from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 import logging
 import os
-import base64
 from pathlib import Path
 from sqlalchemy.orm import Session
 
@@ -14,7 +13,7 @@ from document_loader import AdvancedDocumentLoader
 from vector_store import VectorStore
 from rag_chain import ModernRAGChain
 from models import get_db, User, Document, ChatHistory
-from auth import get_current_user, get_current_active_user, get_current_admin_user
+from auth import get_current_user, get_current_active_user, get_current_admin_user, start_bcrypt_calibration
 from auth_routes import router as auth_router
 from analytics_routes import router as analytics_router
 from document_management_routes import router as document_management_router
@@ -137,6 +136,7 @@ def init_services():
 async def startup_event():
     """Événement de démarrage de l'application"""
     logger.info("Démarrage de l'API DocSearch AI")
+    start_bcrypt_calibration()
     init_services()
 
 @app.get("/")
@@ -205,11 +205,8 @@ async def upload_documents(
             # Lire le contenu du fichier
             content = await file.read()
             
-            # Convertir en base64 pour le traitement
-            base64_content = base64.b64encode(content).decode('utf-8')
-            
-            # Traiter le document
-            doc = document_loader.load_from_base64(base64_content, file.filename)
+            # Traiter le document directement depuis les octets reçus
+            doc = document_loader.load_from_bytes(content, file.filename)
             if doc:
                 # Ajouter les métadonnées utilisateur
                 doc["metadata"]["user_id"] = current_user.id
@@ -1,14 +1,26 @@
+from collections import OrderedDict
 from datetime import datetime, timedelta
+from functools import lru_cache
 from typing import Optional, Union
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+import logging
 import os
 import secrets
+import statistics
+import threading
+import time
 
 from models import User, get_db
+from config import settings
+
+logger = logging.getLogger(__name__)
 
 # Configuration JWT
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", secrets.token_urlsafe(32))
@@ -18,9 +30,130 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 # Configuration du hachage des mots de passe
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# Coût bcrypt : valeur par défaut tant que la calibration n'a pas abouti, et plancher
+# de la calibration (qui ne peut que durcir le coût)
+DEFAULT_BCRYPT_ROUNDS = 12
+MAX_BCRYPT_ROUNDS = 14
+BCRYPT_CALIBRATION_SAMPLES = 3
+BCRYPT_ROUNDS = settings.BCRYPT_ROUNDS or DEFAULT_BCRYPT_ROUNDS
+_bcrypt_hasher = pwd_context.handler("bcrypt").using(rounds=BCRYPT_ROUNDS)
+
+def _calibrate_bcrypt_rounds(target_ms: int) -> int:
+    """
+    Cherche, à partir de DEFAULT_BCRYPT_ROUNDS, le plus petit coût bcrypt atteignant
+    la latence cible, puis le fige.
+    
+    Chaque palier est mesuré par la médiane de quelques hachages, pour qu'un pic de
+    charge au démarrage ne fausse pas la mesure.
+    """
+    global BCRYPT_ROUNDS, _bcrypt_hasher
+    
+    handler = pwd_context.handler("bcrypt")
+    rounds = DEFAULT_BCRYPT_ROUNDS
+    while rounds < MAX_BCRYPT_ROUNDS:
+        hasher = handler.using(rounds=rounds)
+        samples = []
+        for _ in range(BCRYPT_CALIBRATION_SAMPLES):
+            start = time.perf_counter()
+            hasher.hash("calibration-bcrypt")
+            samples.append((time.perf_counter() - start) * 1000)
+        if statistics.median(samples) >= target_ms:
+            break
+        rounds += 1
+    
+    BCRYPT_ROUNDS = rounds
+    _bcrypt_hasher = handler.using(rounds=rounds)
+    logger.info("Coût bcrypt calibré: %s rounds (cible %s ms)", rounds, target_ms)
+    return rounds
+
+_calibration_started = False
+_calibration_lock = threading.Lock()
+
+def start_bcrypt_calibration() -> None:
+    """
+    Lance (une seule fois) la calibration du coût bcrypt en arrière-plan, si BCRYPT_ROUNDS
+    n'est pas fixé. Appelée au démarrage de l'API : les scripts qui importent auth
+    (création des utilisateurs, tests) gardent le coût par défaut sans mesure.
+    
+    Thread daemon : il ne retient pas l'arrêt du processus ; d'ici là, DEFAULT_BCRYPT_ROUNDS
+    s'applique.
+    """
+    global _calibration_started
+    if settings.BCRYPT_ROUNDS is not None:
+        return
+    with _calibration_lock:
+        if _calibration_started:
+            return
+        _calibration_started = True
+    threading.Thread(
+        target=_calibrate_bcrypt_rounds,
+        args=(settings.BCRYPT_TARGET_MS,),
+        name="bcrypt-calibration",
+        daemon=True
+    ).start()
+
 # Sécurité HTTP Bearer
 security = HTTPBearer()
 
+@lru_cache(maxsize=4096)
+def _decode_token(token: str) -> dict:
+    """Vérifie la signature d'un JWT, mis en cache par token brut (l'expiration est contrôlée à part)"""
+    return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], options={"verify_exp": False})
+
+class _UserCache:
+    """
+    Cache LRU à durée de vie limitée des utilisateurs authentifiés, par ID (claim « sub »).
+    
+    Les utilisateurs sont détachés de leur session : seules leurs colonnes sont lues
+    par les routes, qui rechargent l'utilisateur avant toute modification.
+    
+    Le cache est propre à chaque processus : invalidate_cached_user n'agit que sur le
+    worker qui a traité la modification. Sur les autres workers uvicorn, un utilisateur
+    désactivé ou rétrogradé garde son ancien état jusqu'à AUTH_USER_CACHE_TTL secondes ;
+    get_current_admin_user relit donc is_active/is_admin en base.
+    """
+    
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, user_id: str) -> Optional[User]:
+        """Retourne l'utilisateur en cache ou None si absent/expiré"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires_at, user = entry
+            if expires_at < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return user
+    
+    def set(self, user_id: str, user: User) -> None:
+        """Stocke un utilisateur en évinçant le moins récemment utilisé si besoin"""
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, user)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+    
+    def invalidate(self, user_id: str) -> None:
+        """Oublie un utilisateur (profil, mot de passe ou droits modifiés)"""
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+_user_cache = _UserCache(settings.AUTH_USER_CACHE_SIZE, settings.AUTH_USER_CACHE_TTL)
+
+def invalidate_cached_user(user_id: int) -> None:
+    """
+    À appeler après toute modification d'un utilisateur. Effet limité au processus courant :
+    les autres workers voient le changement au plus tard après AUTH_USER_CACHE_TTL secondes.
+    """
+    _user_cache.invalidate(str(user_id))
+
 class AuthManager:
     """Gestionnaire d'authentification"""
     
@@ -32,7 +165,7 @@ class AuthManager:
     @staticmethod
     def get_password_hash(password: str) -> str:
         """Hache un mot de passe"""
-        return pwd_context.hash(password)
+        return _bcrypt_hasher.hash(password)
     
     @staticmethod
     def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -51,10 +184,15 @@ class AuthManager:
     def verify_token(token: str) -> Optional[dict]:
         """Vérifie et décode un token JWT"""
         try:
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-            return payload
+            payload = _decode_token(token)
         except JWTError:
             return None
+        
+        # Contrôle hors cache pour que l'expiration reste effective
+        exp = payload.get("exp")
+        if exp is not None and exp < time.time():
+            return None
+        return dict(payload)
     
     @staticmethod
     def authenticate_user(db: Session, email: str, password: str) -> Optional[User]:
@@ -99,6 +237,53 @@ class AuthManager:
         db.commit()
         db.refresh(db_user)
         return db_user
+    
+    # Variantes asynchrones (AsyncSession) ; le hachage bcrypt part dans le threadpool
+    
+    @staticmethod
+    async def get_user_by_email_async(db: AsyncSession, email: str) -> Optional[User]:
+        """Récupère un utilisateur par email (asynchrone)"""
+        result = await db.execute(select(User).where(User.email == email))
+        return result.scalar_one_or_none()
+    
+    @staticmethod
+    async def get_user_by_id_async(db: AsyncSession, user_id: int) -> Optional[User]:
+        """Récupère un utilisateur par ID (asynchrone)"""
+        result = await db.execute(select(User).where(User.id == user_id))
+        return result.scalar_one_or_none()
+    
+    @staticmethod
+    async def authenticate_user_async(db: AsyncSession, email: str, password: str) -> Optional[User]:
+        """Authentifie un utilisateur (asynchrone)"""
+        user = await AuthManager.get_user_by_email_async(db, email)
+        if not user:
+            return None
+        if not await run_in_threadpool(AuthManager.verify_password, password, user.hashed_password):
+            return None
+        return user
+    
+    @staticmethod
+    async def create_user_async(db: AsyncSession, email: str, username: str, password: str, full_name: str = None) -> User:
+        """Crée un nouvel utilisateur (asynchrone)"""
+        if await AuthManager.get_user_by_email_async(db, email):
+            raise ValueError("Email déjà utilisé")
+        
+        result = await db.execute(select(User.id).where(User.username == username))
+        if result.first():
+            raise ValueError("Nom d'utilisateur déjà utilisé")
+        
+        hashed_password = await run_in_threadpool(AuthManager.get_password_hash, password)
+        db_user = User(
+            email=email,
+            username=username,
+            hashed_password=hashed_password,
+            full_name=full_name
+        )
+        
+        db.add(db_user)
+        await db.commit()
+        await db.refresh(db_user)
+        return db_user
 
 # Dépendances FastAPI
 def get_current_user(
@@ -124,9 +309,15 @@ def get_current_user(
     except JWTError:
         raise credentials_exception
     
-    user = AuthManager.get_user_by_id(db, user_id)
+    # Utilisateur en cache : ni SELECT ni vérification de signature (déjà en cache par token)
+    user = _user_cache.get(str(user_id))
     if user is None:
-        raise credentials_exception
+        user = AuthManager.get_user_by_id(db, user_id)
+        if user is None:
+            raise credentials_exception
+        # Détaché pour être partagé entre requêtes sans être expiré par un commit
+        db.expunge(user)
+        _user_cache.set(str(user.id), user)
     
     if not user.is_active:
         raise HTTPException(
@@ -145,9 +336,26 @@ def get_current_active_user(current_user: User = Depends(get_current_user)) -> U
         )
     return current_user
 
-def get_current_admin_user(current_user: User = Depends(get_current_user)) -> User:
-    """Dépendance pour obtenir l'utilisateur admin actuel"""
-    if not current_user.is_admin:
+def get_current_admin_user(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+) -> User:
+    """
+    Dépendance pour obtenir l'utilisateur admin actuel
+    
+    is_active et is_admin sont relus en base (pas depuis le cache des utilisateurs, propre
+    à chaque worker) : une désactivation ou une rétrogradation s'applique immédiatement
+    aux routes d'administration, quel que soit le worker.
+    """
+    row = db.execute(
+        select(User.is_active, User.is_admin).where(User.id == current_user.id)
+    ).first()
+    if row is None or not row.is_active:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Utilisateur inactif"
+        )
+    if not row.is_admin:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Permissions insuffisantes"
@@ -155,20 +363,40 @@ def get_current_admin_user(current_user: User = Depends(get_current_user)) -> Us
     return current_user
 
 # Modèles Pydantic pour l'API
-from pydantic import BaseModel, EmailStr
+import re
+from pydantic import BaseModel, field_validator
 from typing import Optional
 
+# Compilé une seule fois à l'import ; remplace la validation RFC complète d'EmailStr
+_EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+def _validate_email(v: str) -> str:
+    """Valide un email (préfiltre '@' avant la regex)"""
+    if "@" not in v or not _EMAIL_RE.match(v):
+        raise ValueError("Email invalide")
+    return v
+
 class UserCreate(BaseModel):
     """Modèle pour la création d'utilisateur"""
-    email: EmailStr
+    email: str
     username: str
     password: str
     full_name: Optional[str] = None
+    
+    @field_validator("email")
+    @classmethod
+    def check_email(cls, v: str) -> str:
+        return _validate_email(v)
 
 class UserLogin(BaseModel):
     """Modèle pour la connexion"""
-    email: EmailStr
+    email: str
     password: str
+    
+    @field_validator("email")
+    @classmethod
+    def check_email(cls, v: str) -> str:
+        return _validate_email(v)
 
 class UserResponse(BaseModel):
     """Modèle pour la réponse utilisateur"""
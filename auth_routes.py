@@ -1,11 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import HTTPBearer
-from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import timedelta
 import logging
 
-from models import get_db, User
-from auth import AuthManager, get_current_user, get_current_admin_user, UserCreate, UserLogin, UserResponse, Token
+from models import get_async_db, User
+from auth import AuthManager, get_current_user, get_current_admin_user, invalidate_cached_user, UserCreate, UserLogin, UserResponse, Token
 from config import settings
 
 logger = logging.getLogger(__name__)
@@ -13,7 +15,7 @@ logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/auth", tags=["authentication"])
 
 @router.post("/register", response_model=UserResponse)
-def register(user_data: UserCreate, db: Session = Depends(get_db)):
+async def register(user_data: UserCreate, db: AsyncSession = Depends(get_async_db)):
     """Inscription d'un nouvel utilisateur"""
     try:
         # Vérifier la longueur du mot de passe
@@ -24,7 +26,7 @@ def register(user_data: UserCreate, db: Session = Depends(get_db)):
             )
         
         # Créer l'utilisateur
-        user = AuthManager.create_user(
+        user = await AuthManager.create_user_async(
             db=db,
             email=user_data.email,
             username=user_data.username,
@@ -32,7 +34,7 @@ def register(user_data: UserCreate, db: Session = Depends(get_db)):
             full_name=user_data.full_name
         )
         
-        logger.info(f"Nouvel utilisateur créé: {user.email}")
+        logger.info("Nouvel utilisateur créé: %s", user.email)
         return user
         
     except ValueError as e:
@@ -41,18 +43,18 @@ def register(user_data: UserCreate, db: Session = Depends(get_db)):
             detail=str(e)
         )
     except Exception as e:
-        logger.error(f"Erreur lors de l'inscription: {e}")
+        logger.error("Erreur lors de l'inscription: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Erreur interne du serveur"
         )
 
 @router.post("/login", response_model=Token)
-def login(user_credentials: UserLogin, db: Session = Depends(get_db)):
+async def login(user_credentials: UserLogin, db: AsyncSession = Depends(get_async_db)):
     """Connexion utilisateur"""
     try:
         # Authentifier l'utilisateur
-        user = AuthManager.authenticate_user(
+        user = await AuthManager.authenticate_user_async(
             db=db,
             email=user_credentials.email,
             password=user_credentials.password
@@ -74,8 +76,8 @@ def login(user_credentials: UserLogin, db: Session = Depends(get_db)):
         # Mettre à jour la date de dernière connexion
         from datetime import datetime
         user.last_login = datetime.utcnow()
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        await db.refresh(user)
         
         # Créer le token d'accès
         access_token_expires = timedelta(minutes=30)
@@ -84,7 +86,7 @@ def login(user_credentials: UserLogin, db: Session = Depends(get_db)):
             expires_delta=access_token_expires
         )
         
-        logger.info(f"Connexion réussie: {user.email}")
+        logger.info("Connexion réussie: %s", user.email)
         
         return {
             "access_token": access_token,
@@ -95,7 +97,7 @@ def login(user_credentials: UserLogin, db: Session = Depends(get_db)):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Erreur lors de la connexion: {e}")
+        logger.error("Erreur lors de la connexion: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Erreur interne du serveur"
@@ -107,40 +109,43 @@ def get_current_user_info(current_user: User = Depends(get_current_user)):
     return current_user
 
 @router.put("/me", response_model=UserResponse)
-def update_current_user(
+async def update_current_user(
     full_name: str = None,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Mettre à jour les informations de l'utilisateur actuel"""
     try:
+        # current_user appartient à la session synchrone de get_current_user
+        user = await db.get(User, current_user.id)
         if full_name is not None:
-            current_user.full_name = full_name
+            user.full_name = full_name
         
-        db.commit()
-        db.refresh(current_user)
+        await db.commit()
+        invalidate_cached_user(user.id)
+        await db.refresh(user)
         
-        logger.info(f"Profil utilisateur mis à jour: {current_user.email}")
-        return current_user
+        logger.info("Profil utilisateur mis à jour: %s", user.email)
+        return user
         
     except Exception as e:
-        logger.error(f"Erreur lors de la mise à jour du profil: {e}")
+        logger.error("Erreur lors de la mise à jour du profil: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Erreur interne du serveur"
         )
 
 @router.post("/change-password")
-def change_password(
+async def change_password(
     current_password: str,
     new_password: str,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Changer le mot de passe de l'utilisateur actuel"""
     try:
         # Vérifier l'ancien mot de passe
-        if not AuthManager.verify_password(current_password, current_user.hashed_password):
+        if not await run_in_threadpool(AuthManager.verify_password, current_password, current_user.hashed_password):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Mot de passe actuel incorrect"
@@ -154,16 +159,18 @@ def change_password(
             )
         
         # Mettre à jour le mot de passe
-        current_user.hashed_password = AuthManager.get_password_hash(new_password)
-        db.commit()
+        user = await db.get(User, current_user.id)
+        user.hashed_password = await run_in_threadpool(AuthManager.get_password_hash, new_password)
+        await db.commit()
+        invalidate_cached_user(user.id)
         
-        logger.info(f"Mot de passe changé pour: {current_user.email}")
+        logger.info("Mot de passe changé pour: %s", current_user.email)
         return {"message": "Mot de passe changé avec succès"}
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Erreur lors du changement de mot de passe: {e}")
+        logger.error("Erreur lors du changement de mot de passe: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Erreur interne du serveur"
@@ -171,30 +178,30 @@ def change_password(
 
 # Routes administrateur
 @router.get("/users", response_model=list[UserResponse])
-def get_all_users(
+async def get_all_users(
     current_user: User = Depends(get_current_admin_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Obtenir la liste de tous les utilisateurs (admin uniquement)"""
     try:
-        users = db.query(User).all()
-        return users
+        result = await db.execute(select(User))
+        return result.scalars().all()
     except Exception as e:
-        logger.error(f"Erreur lors de la récupération des utilisateurs: {e}")
+        logger.error("Erreur lors de la récupération des utilisateurs: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Erreur interne du serveur"
         )
 
 @router.put("/users/{user_id}/toggle-status")
-def toggle_user_status(
+async def toggle_user_status(
     user_id: int,
     current_user: User = Depends(get_current_admin_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Activer/désactiver un utilisateur (admin uniquement)"""
     try:
-        user = db.query(User).filter(User.id == user_id).first()
+        user = await AuthManager.get_user_by_id_async(db, user_id)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -209,10 +216,11 @@ def toggle_user_status(
             )
         
         user.is_active = not user.is_active
-        db.commit()
+        await db.commit()
+        invalidate_cached_user(user.id)
         
         status_text = "activé" if user.is_active else "désactivé"
-        logger.info(f"Utilisateur {user.email} {status_text} par {current_user.email}")
+        logger.info("Utilisateur %s %s par %s", user.email, status_text, current_user.email)
         
         return {
             "message": f"Utilisateur {status_text} avec succès",
@@ -223,21 +231,21 @@ def toggle_user_status(
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Erreur lors du changement de statut utilisateur: {e}")
+        logger.error("Erreur lors du changement de statut utilisateur: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Erreur interne du serveur"
         )
 
 @router.put("/users/{user_id}/toggle-admin")
-def toggle_admin_status(
+async def toggle_admin_status(
     user_id: int,
     current_user: User = Depends(get_current_admin_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Donner/retirer les droits admin (admin uniquement)"""
     try:
-        user = db.query(User).filter(User.id == user_id).first()
+        user = await AuthManager.get_user_by_id_async(db, user_id)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -252,10 +260,11 @@ def toggle_admin_status(
             )
         
         user.is_admin = not user.is_admin
-        db.commit()
+        await db.commit()
+        invalidate_cached_user(user.id)
         
         status_text = "promu administrateur" if user.is_admin else "rétrogradé utilisateur"
-        logger.info(f"Utilisateur {user.email} {status_text} par {current_user.email}")
+        logger.info("Utilisateur %s %s par %s", user.email, status_text, current_user.email)
         
         return {
             "message": f"Utilisateur {status_text} avec succès",
@@ -266,7 +275,7 @@ def toggle_admin_status(
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Erreur lors du changement de droits admin: {e}")
+        logger.error("Erreur lors du changement de droits admin: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Erreur interne du serveur"
@@ -1,9 +1,14 @@
 import os
+from functools import lru_cache
 from dotenv import load_dotenv
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Literal
 from pydantic_settings import BaseSettings
 
-load_dotenv()
+# Le .env n'est lu qu'une fois par processus, même si le module est réimporté
+# (scripts, sous-processus lancés par start.py / run.py)
+if "_DOTENV_LOADED" not in os.environ:
+    load_dotenv(override=False)
+    os.environ["_DOTENV_LOADED"] = "1"
 
 class Settings(BaseSettings):
     """Configuration de l'application"""
@@ -22,11 +27,18 @@ class Settings(BaseSettings):
     SOURCE_DIR: str = os.getenv("SOURCE_DIR", "./source")
     UPLOAD_DIR: str = os.getenv("UPLOAD_DIR", "./uploads")
     MAX_FILE_SIZE: int = int(os.getenv("MAX_FILE_SIZE", "50"))  # MB
-    SUPPORTED_FORMATS: list = [
+    SUPPORTED_FORMATS: frozenset[str] = frozenset({
         '.pdf', '.txt', '.docx', '.doc', 
         '.xlsx', '.xls', '.csv',
         '.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff'
-    ]
+    })
+    
+    # Processus de chargement parallèle des documents
+    LOADER_MAX_WORKERS: int = int(os.getenv("LOADER_MAX_WORKERS", str(min(os.cpu_count() or 1, 4))))
+    # Fichiers traités par un processus avant son remplacement (0 = jamais)
+    LOADER_MAX_TASKS_PER_CHILD: int = int(os.getenv("LOADER_MAX_TASKS_PER_CHILD", "200"))
+    # Cache persistant des documents extraits (chemin, mtime, taille) ; vide = désactivé
+    DOCUMENT_CACHE_DIR: str = os.getenv("DOCUMENT_CACHE_DIR", os.path.expanduser("~/.cache/docsearch_documents"))
     
     # RAG Configuration
     CHUNK_SIZE: int = int(os.getenv("CHUNK_SIZE", "1000"))
@@ -35,7 +47,13 @@ class Settings(BaseSettings):
     
     # Image Processing
     ENABLE_OCR: bool = os.getenv("ENABLE_OCR", "true").lower() == "true"
-    OCR_LANGUAGES: list = ["en", "fr"]  # Languages for OCR
+    OCR_LANGUAGES: tuple[str, ...] = ("en", "fr")  # Languages for OCR
+    OCR_DEVICE: Literal["auto", "cpu", "cuda", "mps"] = os.getenv("OCR_DEVICE", "auto")
+    # Modèles EasyOCR quantifiés en int8 sur CPU (à désactiver si la précision baisse)
+    OCR_QUANTIZE: bool = os.getenv("OCR_QUANTIZE", "true").lower() == "true"
+    # Cache des résultats OCR (par empreinte du contenu) ; OCR_CACHE_DIR vide = mémoire seule
+    OCR_CACHE_SIZE: int = int(os.getenv("OCR_CACHE_SIZE", "1024"))
+    OCR_CACHE_DIR: str = os.getenv("OCR_CACHE_DIR", os.path.expanduser("~/.cache/docsearch_ocr"))
     
     # API Configuration
     API_HOST: str = os.getenv("API_HOST", "0.0.0.0")
@@ -45,8 +63,26 @@ class Settings(BaseSettings):
     # Logging
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
     LOG_FILE: str = os.getenv("LOG_FILE", "./logs/app.log")
+    # Debug/tests : tout chargement paresseux de relation lève une erreur (détection des N+1)
+    SQL_RAISELOAD: bool = os.getenv("SQL_RAISELOAD", "false").lower() == "true"
+    
+    # Pool de connexions SQLAlchemy : taille ≈ threads de travail (40 par défaut pour
+    # les routes synchrones), le débordement absorbe les pics
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "25"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "25"))
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # secondes
+    
+    # Cache des résultats de requêtes (statistiques, recherches, tags)
+    QUERY_CACHE_SIZE: int = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+    QUERY_CACHE_TTL: int = int(os.getenv("QUERY_CACHE_TTL", "30"))  # secondes
     
     # Security
+    # Coût bcrypt : fixé explicitement, sinon calibré au démarrage sur BCRYPT_TARGET_MS
+    BCRYPT_ROUNDS: Optional[int] = int(os.getenv("BCRYPT_ROUNDS")) if os.getenv("BCRYPT_ROUNDS") else None
+    BCRYPT_TARGET_MS: int = int(os.getenv("BCRYPT_TARGET_MS", "250"))
+    # Utilisateurs authentifiés gardés en mémoire (évite le SELECT users à chaque requête)
+    AUTH_USER_CACHE_SIZE: int = int(os.getenv("AUTH_USER_CACHE_SIZE", "10000"))
+    AUTH_USER_CACHE_TTL: int = int(os.getenv("AUTH_USER_CACHE_TTL", "60"))  # secondes
     CORS_ORIGINS: list = [
         "http://localhost:3000",
         "http://localhost:3001",
@@ -59,6 +95,7 @@ class Settings(BaseSettings):
 # Instance globale des paramètres
 settings = Settings()
 
+@lru_cache(maxsize=1)
 def get_model_config() -> Dict[str, Any]:
     """Retourne la configuration du modèle LLM"""
     return {
@@ -68,6 +105,7 @@ def get_model_config() -> Dict[str, Any]:
         "api_key": settings.OPENAI_API_KEY
     }
 
+@lru_cache(maxsize=1)
 def get_embedding_config() -> Dict[str, Any]:
     """Retourne la configuration des embeddings"""
     return {
@@ -76,6 +114,7 @@ def get_embedding_config() -> Dict[str, Any]:
         "encode_kwargs": {"normalize_embeddings": True}
     }
 
+@lru_cache(maxsize=1)
 def get_rag_config() -> Dict[str, Any]:
     """Retourne la configuration RAG"""
     return {
@@ -7,8 +7,10 @@ import sys
 import os
 import secrets
 import string
+from concurrent.futures import ThreadPoolExecutor
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+from sqlalchemy import insert
 from models import SessionLocal, User
 from auth import AuthManager
 
@@ -68,47 +70,60 @@ def create_initial_users():
     try:
         db = SessionLocal()
         
+        # Vérifier en une requête les emails et usernames déjà pris
+        emails = [u["email"] for u in users_data]
+        usernames = [u["username"] for u in users_data]
+        existing_emails = {
+            email for (email,) in db.query(User.email).filter(User.email.in_(emails))
+        }
+        existing_usernames = {
+            username for (username,) in db.query(User.username).filter(User.username.in_(usernames))
+        }
+        
+        new_users = []
         for user_data in users_data:
-            # Générer un mot de passe sécurisé
-            password = generate_secure_password()
-            
-            # Vérifier si l'utilisateur existe déjà
-            existing_user = AuthManager.get_user_by_email(db, user_data["email"])
-            if existing_user:
+            if user_data["email"] in existing_emails:
                 print(f"⚠️  Utilisateur {user_data['email']} existe déjà, ignoré")
                 continue
-            
-            existing_username = db.query(User).filter(User.username == user_data["username"]).first()
-            if existing_username:
+            if user_data["username"] in existing_usernames:
                 print(f"⚠️  Username {user_data['username']} existe déjà, ignoré")
                 continue
-            
-            # Créer l'utilisateur
-            hashed_password = AuthManager.get_password_hash(password)
-            user = User(
-                email=user_data["email"],
-                username=user_data["username"],
-                hashed_password=hashed_password,
-                full_name=user_data["full_name"],
-                is_admin=user_data["is_admin"],
-                is_active=True
-            )
-            
-            db.add(user)
+            new_users.append(user_data)
+        
+        # Générer les mots de passe et les hacher en parallèle (bcrypt libère le GIL)
+        passwords = [generate_secure_password() for _ in new_users]
+        with ThreadPoolExecutor() as executor:
+            hashes = list(executor.map(AuthManager.get_password_hash, passwords))
+        
+        rows = [
+            {
+                "email": user_data["email"],
+                "username": user_data["username"],
+                "hashed_password": hashed_password,
+                "full_name": user_data["full_name"],
+                "is_admin": user_data["is_admin"],
+                "is_active": True
+            }
+            for user_data, hashed_password in zip(new_users, hashes)
+        ]
+        
+        # Un seul INSERT multi-lignes pour tous les utilisateurs
+        if rows:
+            db.execute(insert(User), rows)
             db.commit()
-            db.refresh(user)
-            
+        
+        for row, password, user_data in zip(rows, passwords, new_users):
             created_users.append({
-                "user": user,
+                "user": row,
                 "password": password,
                 "description": user_data["description"]
             })
             
             print(f"✅ {user_data['description']} créé:")
-            print(f"   Email: {user.email}")
-            print(f"   Username: {user.username}")
+            print(f"   Email: {row['email']}")
+            print(f"   Username: {row['username']}")
             print(f"   Mot de passe: {password}")
-            print(f"   Admin: {user.is_admin}")
+            print(f"   Admin: {row['is_admin']}")
             print()
         
         # Afficher le résumé
@@ -120,11 +135,11 @@ def create_initial_users():
         for i, user_info in enumerate(created_users, 1):
             user = user_info["user"]
             print(f"{i}. {user_info['description']}")
-            print(f"   👤 {user.full_name}")
-            print(f"   📧 {user.email}")
-            print(f"   🔑 {user.username}")
+            print(f"   👤 {user['full_name']}")
+            print(f"   📧 {user['email']}")
+            print(f"   🔑 {user['username']}")
             print(f"   🔒 Mot de passe: {user_info['password']}")
-            print(f"   👑 Admin: {'Oui' if user.is_admin else 'Non'}")
+            print(f"   👑 Admin: {'Oui' if user['is_admin'] else 'Non'}")
             print()
         
         print("💡 CONSEILS D'UTILISATION")
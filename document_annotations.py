@@ -5,23 +5,287 @@ Gère les annotations, commentaires et tags sur les documents
 """
 
 import json
+import time
 import logging
+import threading
+import weakref
+from collections import OrderedDict
 from datetime import datetime
-from typing import List, Dict, Any, Optional
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_, desc, func
+from typing import List, Dict, Any, Optional, Tuple
+from sqlalchemy.orm import Session, contains_eager, selectinload, raiseload
+from sqlalchemy import and_, or_, desc, func, select, update, delete, insert, distinct, literal, union_all, bindparam, tuple_, String, table, column
 
-from models import Document, DocumentAnnotation, DocumentTag, User
+from models import Document, DocumentAnnotation, DocumentTag, DocumentTagAssociation, AnnotationTag, User, ANNOTATION_FTS_TABLE, utcnow
 from auth import get_current_user
+from config import settings
+
+# orjson (Rust) est nettement plus rapide que json, utilisé s'il est installé
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
+if orjson is not None:
+    def _dumps(obj: Any) -> str:
+        return orjson.dumps(obj).decode()
+else:
+    _dumps = json.dumps
+
+class QueryResultCache:
+    """
+    Cache LRU à durée de vie limitée pour les résultats sérialisés des requêtes de lecture.
+    
+    Les clés incluent un numéro de version par espace (utilisateur, tags) : une écriture
+    incrémente la version, les anciennes entrées ne sont plus jamais lues et expirent d'elles-mêmes.
+    """
+    
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+        self._versions: Dict[Any, int] = {}
+        self._lock = threading.Lock()
+    
+    def version(self, namespace: Any) -> int:
+        """Version courante d'un espace de cache"""
+        return self._versions.get(namespace, 0)
+    
+    def invalidate(self, namespace: Any) -> None:
+        """Rend obsolètes toutes les entrées d'un espace"""
+        with self._lock:
+            self._versions[namespace] = self._versions.get(namespace, 0) + 1
+    
+    def key(self, namespace: Any, *parts: Any) -> tuple:
+        """Construit une clé (espace, version, paramètres)"""
+        return (namespace, self.version(namespace)) + parts
+    
+    def get(self, key: tuple) -> Any:
+        """Retourne la valeur en cache ou None si absente/expirée"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+    
+    def set(self, key: tuple, value: Any) -> None:
+        """Stocke une valeur en évinçant l'entrée la moins récemment utilisée si besoin"""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+    
+    def clear(self) -> None:
+        """Vide entièrement le cache"""
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+
+# Cache partagé par les services d'annotations et de tags
+query_cache = QueryResultCache(settings.QUERY_CACHE_SIZE, settings.QUERY_CACHE_TTL)
+
+_TAGS_NAMESPACE = "tags"
+
+def _user_namespace(user_id: int) -> tuple:
+    return ("user", user_id)
+
+def _position_columns(position: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Champs page/x/y d'une position JSON, pour les colonnes dédiées (None si absents ou non numériques)"""
+    if not isinstance(position, dict):
+        position = {}
+    
+    def number(key: str, cast):
+        value = position.get(key)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return None
+        return cast(value)
+    
+    return {
+        "position_page": number("page", int),
+        "position_x": number("x", float),
+        "position_y": number("y", float),
+    }
+
+def serialize_annotation(annotation: DocumentAnnotation) -> Dict[str, Any]:
+    """Représentation JSON d'une annotation (format des routes de recherche)"""
+    return {
+        "id": annotation.id,
+        "document_id": annotation.document_id,
+        "annotation_type": annotation.annotation_type,
+        "content": annotation.content,
+        "tags": annotation.tags,
+        "created_at": annotation.created_at.isoformat()
+    }
+
+def serialize_tag(tag: DocumentTag) -> Dict[str, Any]:
+    """Représentation JSON d'un tag"""
+    return {
+        "id": tag.id,
+        "name": tag.name,
+        "color": tag.color,
+        "description": tag.description,
+        "created_at": tag.created_at.isoformat() if tag.created_at else None
+    }
+
+# Présence de l'index FTS5 par moteur (vérifiée une seule fois)
+_fts_available: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+_annotation_fts = table(ANNOTATION_FTS_TABLE, column("rowid"), column(ANNOTATION_FTS_TABLE))
+
+# Le tokenizer trigram ne sait pas chercher moins de 3 caractères
+_FTS_MIN_QUERY_LENGTH = 3
+
+def _has_annotation_fts(db: Session) -> bool:
+    """Indique si la base dispose de l'index plein texte des annotations"""
+    engine = db.get_bind()
+    if engine not in _fts_available:
+        _fts_available[engine] = engine.dialect.name == "sqlite" and db.execute(
+            select(literal(1)).select_from(table("sqlite_master", column("name"))).where(
+                column("name") == ANNOTATION_FTS_TABLE
+            )
+        ).first() is not None
+    return _fts_available[engine]
+
+def _contains_pattern(query: str):
+    """Motif ILIKE « contient query », lié une seule fois et réutilisable dans la requête"""
+    return bindparam("search_pattern", f"%{query}%")
+
+def _annotation_content_match(db: Session, query: str):
+    """Filtre « contenu contient query » : FTS5 si disponible, ILIKE sinon"""
+    if len(query) >= _FTS_MIN_QUERY_LENGTH and _has_annotation_fts(db):
+        # Chaîne FTS5 entre guillemets : recherche de sous-chaîne, insensible à la casse
+        fts_query = '"' + query.replace('"', '""') + '"'
+        return DocumentAnnotation.id.in_(
+            select(_annotation_fts.c.rowid).where(
+                _annotation_fts.c[ANNOTATION_FTS_TABLE].match(fts_query)
+            )
+        )
+    return DocumentAnnotation.content.ilike(_contains_pattern(query))
+
+# Curseur de pagination : (created_at, id) de la dernière annotation d'une page
+AnnotationCursor = Tuple[datetime, int]
+
+DEFAULT_PAGE_SIZE = 100
+
+def encode_cursor(cursor: Optional[AnnotationCursor]) -> Optional[str]:
+    """Curseur -> chaîne opaque pour l'API"""
+    if cursor is None:
+        return None
+    created_at, annotation_id = cursor
+    return f"{created_at.isoformat()}|{annotation_id}"
+
+def decode_cursor(value: Optional[str]) -> Optional[AnnotationCursor]:
+    """Chaîne de l'API -> curseur (ValueError si invalide)"""
+    if not value:
+        return None
+    created_at, _, annotation_id = value.rpartition("|")
+    return datetime.fromisoformat(created_at), int(annotation_id)
+
+def _paginate(query, cursor: Optional[AnnotationCursor], limit: int):
+    """
+    Pagination par clé (created_at, id) décroissante : pas d'OFFSET, le coût d'une page
+    ne dépend pas de sa position. Retourne (annotations, curseur de la page suivante).
+    """
+    if cursor is not None:
+        query = query.filter(
+            tuple_(DocumentAnnotation.created_at, DocumentAnnotation.id) < tuple_(*cursor)
+        )
+    
+    # Une ligne de plus pour savoir s'il existe une page suivante
+    annotations = query.order_by(
+        desc(DocumentAnnotation.created_at), desc(DocumentAnnotation.id)
+    ).limit(limit + 1).all()
+    
+    if len(annotations) <= limit:
+        return annotations, None
+    annotations = annotations[:limit]
+    last = annotations[-1]
+    return annotations, (last.created_at, last.id)
+
+def _raiseload_options() -> tuple:
+    """raiseload('*') quand SQL_RAISELOAD est actif, pour que les tests détectent les N+1"""
+    return (raiseload("*"),) if settings.SQL_RAISELOAD else ()
+
+def _top_tags_subquery(annotation_ids, limit: int = 10):
+    """Sous-requête (key, count) des tags les plus fréquents parmi les annotations `annotation_ids`"""
+    return select(
+        DocumentTag.name.label("key"),
+        func.count().label("count")
+    ).select_from(AnnotationTag).join(
+        DocumentTag, DocumentTag.id == AnnotationTag.tag_id
+    ).where(
+        AnnotationTag.annotation_id.in_(annotation_ids)
+    ).group_by(DocumentTag.name).order_by(
+        func.count().desc()
+    ).limit(limit).subquery()
+
+def _annotations_with_tags(tags: List[str]):
+    """Sélection des IDs d'annotations portant tous les tags donnés"""
+    names = set(tags)
+    return select(AnnotationTag.annotation_id).join(
+        DocumentTag, DocumentTag.id == AnnotationTag.tag_id
+    ).where(
+        DocumentTag.name.in_(names)
+    ).group_by(AnnotationTag.annotation_id).having(
+        func.count(distinct(DocumentTag.id)) == len(names)
+    )
+
 class DocumentAnnotationService:
     """Service de gestion des annotations et tags de documents"""
     
+    # Instancié à chaque requête : pas de __dict__, seule la session est portée
+    __slots__ = ("db",)
+    
     def __init__(self, db: Session):
         self.db = db
     
+    def _link_annotation_tags(self, tags_by_annotation: Dict[int, List[str]]) -> None:
+        """
+        Associe des tags à des annotations (les tags inconnus sont créés ;
+        le commit reste à la charge de l'appelant)
+        """
+        tags_by_annotation = {
+            annotation_id: list(dict.fromkeys(tag for tag in tags if tag))
+            for annotation_id, tags in tags_by_annotation.items()
+        }
+        names = list(dict.fromkeys(
+            name for tags in tags_by_annotation.values() for name in tags
+        ))
+        if not names:
+            return
+        
+        tag_ids = dict(self.db.execute(
+            select(DocumentTag.name, DocumentTag.id).where(DocumentTag.name.in_(names))
+        ).all())
+        missing = [name for name in names if name not in tag_ids]
+        if missing:
+            self.db.execute(insert(DocumentTag), [
+                {"name": name, "is_active": True}
+                for name in missing
+            ])
+            tag_ids.update(self.db.execute(
+                select(DocumentTag.name, DocumentTag.id).where(DocumentTag.name.in_(missing))
+            ).all())
+            query_cache.invalidate(_TAGS_NAMESPACE)
+        
+        self.db.execute(insert(AnnotationTag), [
+            {"annotation_id": annotation_id, "tag_id": tag_ids[name]}
+            for annotation_id, tags in tags_by_annotation.items()
+            for name in tags
+        ])
+    
+    def _set_annotation_tags(self, annotation_id: int, tags: List[str]) -> None:
+        """Remplace les tags d'une annotation dans la table d'association"""
+        self.db.execute(delete(AnnotationTag).where(AnnotationTag.annotation_id == annotation_id))
+        self._link_annotation_tags({annotation_id: tags})
+    
     def create_annotation(self, document_id: int, user_id: int, 
                          annotation_type: str, content: str, 
                          position: Dict[str, Any] = None, 
@@ -47,23 +311,29 @@ class DocumentAnnotationService:
             ).first()
             
             if not document:
-                raise ValueError("Document non trouvé ou accès non autorisé")
-            
-            # Créer l'annotation
-            annotation = DocumentAnnotation(
-                document_id=document_id,
-                user_id=user_id,
-                annotation_type=annotation_type,
-                content=content,
-                position=json.dumps(position) if position else None,
-                tags=json.dumps(tags) if tags else [],
-                created_at=datetime.now(),
-                is_active=True
-            )
+                raise PermissionError("Document non trouvé ou accès non autorisé")
+            
+            # Créer l'annotation : INSERT ... RETURNING charge aussi les colonnes
+            # remplies par la base (id, created_at), sans refresh()
+            annotation = self.db.scalars(
+                insert(DocumentAnnotation).values(
+                    document_id=document_id,
+                    user_id=user_id,
+                    annotation_type=annotation_type,
+                    content=content,
+                    position=_dumps(position) if position else None,
+                    **_position_columns(position),
+                    tags=_dumps(tags) if tags else None,
+                    is_active=True
+                ).returning(DocumentAnnotation)
+            ).one()
             
-            self.db.add(annotation)
+            if tags:
+                self._link_annotation_tags({annotation.id: tags})
+            # Détachée avant le commit pour que ses attributs ne soient pas expirés
+            self.db.expunge(annotation)
             self.db.commit()
-            self.db.refresh(annotation)
+            query_cache.invalidate(_user_namespace(user_id))
             
             logger.info(f"Nouvelle annotation créée pour le document {document_id}")
             return annotation
@@ -73,18 +343,90 @@ class DocumentAnnotationService:
             self.db.rollback()
             raise
     
+    def bulk_create_annotations(self, document_id: int, user_id: int,
+                                items: List[Dict[str, Any]]) -> List[int]:
+        """
+        Crée plusieurs annotations sur un document en un seul INSERT (import de surlignages, etc.)
+        
+        Args:
+            document_id: ID du document
+            user_id: ID de l'utilisateur
+            items: Annotations à créer ({"content", "annotation_type", "position", "tags"})
+            
+        Returns:
+            IDs des annotations créées, dans l'ordre de `items`
+        """
+        try:
+            if not items:
+                raise ValueError("Aucune annotation à créer")
+            
+            # Une seule vérification d'accès pour tout le lot
+            document_exists = self.db.execute(
+                select(Document.id).where(
+                    and_(Document.id == document_id, Document.user_id == user_id)
+                )
+            ).first()
+            
+            if not document_exists:
+                raise PermissionError("Document non trouvé ou accès non autorisé")
+            
+            rows = [
+                {
+                    "document_id": document_id,
+                    "user_id": user_id,
+                    "annotation_type": item.get("annotation_type", "note"),
+                    "content": item["content"],
+                    "position": _dumps(item["position"]) if item.get("position") else None,
+                    **_position_columns(item.get("position")),
+                    "tags": _dumps(item["tags"]) if item.get("tags") else None,
+                    "is_active": True
+                }
+                for item in items
+            ]
+            
+            # INSERT multi-lignes ; SQLite attribue les rowid dans l'ordre des VALUES,
+            # trier les IDs retournés redonne l'ordre de `items` (sort_by_parameter_order
+            # forcerait un INSERT par ligne sur SQLite)
+            annotation_ids = sorted(self.db.scalars(
+                insert(DocumentAnnotation).returning(DocumentAnnotation.id),
+                rows
+            ))
+            
+            self._link_annotation_tags({
+                annotation_id: item["tags"]
+                for annotation_id, item in zip(annotation_ids, items)
+                if item.get("tags")
+            })
+            
+            self.db.commit()
+            query_cache.invalidate(_user_namespace(user_id))
+            
+            logger.info(f"{len(annotation_ids)} annotations créées pour le document {document_id}")
+            return annotation_ids
+            
+        except Exception as e:
+            logger.error(f"Erreur lors de la création des annotations en lot: {e}")
+            self.db.rollback()
+            raise
+    
     def get_document_annotations(self, document_id: int, user_id: int, 
-                                annotation_type: str = None) -> List[DocumentAnnotation]:
+                                annotation_type: str = None,
+                                cursor: Optional[AnnotationCursor] = None,
+                                limit: int = DEFAULT_PAGE_SIZE,
+                                page: Optional[int] = None) -> Tuple[List[DocumentAnnotation], Optional[AnnotationCursor]]:
         """
-        Récupère toutes les annotations d'un document
+        Récupère une page des annotations d'un document (plus récentes d'abord)
         
         Args:
             document_id: ID du document
             user_id: ID de l'utilisateur
             annotation_type: Filtrer par type d'annotation (optionnel)
+            cursor: Curseur retourné par la page précédente (optionnel)
+            limit: Taille de la page
+            page: Filtrer sur la page du document (colonne indexée position_page, optionnel)
             
         Returns:
-            Liste des annotations
+            (annotations, curseur de la page suivante ou None)
         """
         try:
             # Vérifier les permissions
@@ -93,9 +435,13 @@ class DocumentAnnotationService:
             ).first()
             
             if not document:
-                raise ValueError("Document non trouvé ou accès non autorisé")
+                raise PermissionError("Document non trouvé ou accès non autorisé")
             
-            query = self.db.query(DocumentAnnotation).filter(
+            query = self.db.query(DocumentAnnotation).options(
+                selectinload(DocumentAnnotation.document),
+                selectinload(DocumentAnnotation.user),
+                *_raiseload_options()
+            ).filter(
                 and_(
                     DocumentAnnotation.document_id == document_id,
                     DocumentAnnotation.is_active == True
@@ -104,10 +450,10 @@ class DocumentAnnotationService:
             
             if annotation_type:
                 query = query.filter(DocumentAnnotation.annotation_type == annotation_type)
+            if page is not None:
+                query = query.filter(DocumentAnnotation.position_page == page)
             
-            annotations = query.order_by(desc(DocumentAnnotation.created_at)).all()
-            
-            return annotations
+            return _paginate(query, cursor, limit)
             
         except Exception as e:
             logger.error(f"Erreur lors de la récupération des annotations: {e}")
@@ -122,25 +468,20 @@ class DocumentAnnotationService:
             user_id: ID de l'utilisateur
             
         Returns:
-            DocumentAnnotation ou None
+            DocumentAnnotation ou None (introuvable ou accès non autorisé)
         """
         try:
-            annotation = self.db.query(DocumentAnnotation).filter(
-                DocumentAnnotation.id == annotation_id
-            ).first()
-            
-            if not annotation:
-                return None
-            
-            # Vérifier les permissions
-            document = self.db.query(Document).filter(
-                and_(Document.id == annotation.document_id, Document.user_id == user_id)
-            ).first()
-            
-            if not document:
-                raise ValueError("Accès non autorisé à cette annotation")
-            
-            return annotation
+            # Récupération et vérification des permissions en une seule requête
+            return self.db.query(DocumentAnnotation).join(
+                Document,
+                and_(
+                    Document.id == DocumentAnnotation.document_id,
+                    Document.user_id == user_id
+                )
+            ).options(
+                contains_eager(DocumentAnnotation.document),
+                *_raiseload_options()
+            ).filter(DocumentAnnotation.id == annotation_id).first()
             
         except Exception as e:
             logger.error(f"Erreur lors de la récupération de l'annotation: {e}")
@@ -163,18 +504,18 @@ class DocumentAnnotationService:
         try:
             annotation = self.get_annotation(annotation_id, user_id)
             if not annotation:
-                raise ValueError("Annotation non trouvée ou accès non autorisé")
+                raise PermissionError("Annotation non trouvée ou accès non autorisé")
             
             if content is not None:
                 annotation.content = content
             
             if tags is not None:
-                annotation.tags = json.dumps(tags)
-            
-            annotation.updated_at = datetime.now()
+                annotation.tags = _dumps(tags)
+                self._set_annotation_tags(annotation_id, tags)
             
             self.db.commit()
             self.db.refresh(annotation)
+            query_cache.invalidate(_user_namespace(user_id))
             
             logger.info(f"Annotation {annotation_id} mise à jour")
             return annotation
@@ -196,14 +537,23 @@ class DocumentAnnotationService:
             True si supprimée
         """
         try:
-            annotation = self.get_annotation(annotation_id, user_id)
-            if not annotation:
-                raise ValueError("Annotation non trouvée ou accès non autorisé")
-            
-            annotation.is_active = False
-            annotation.deleted_at = datetime.now()
+            # Un seul UPDATE : la vérification des permissions est dans le WHERE
+            result = self.db.execute(
+                update(DocumentAnnotation).where(
+                    DocumentAnnotation.id == annotation_id,
+                    DocumentAnnotation.document_id.in_(
+                        select(Document.id).where(Document.user_id == user_id)
+                    )
+                ).values(
+                    is_active=False,
+                    deleted_at=utcnow()
+                ).execution_options(synchronize_session=False)
+            )
+            if result.rowcount == 0:
+                raise PermissionError("Annotation non trouvée ou accès non autorisé")
             
             self.db.commit()
+            query_cache.invalidate(_user_namespace(user_id))
             
             logger.info(f"Annotation {annotation_id} supprimée")
             return True
@@ -214,22 +564,29 @@ class DocumentAnnotationService:
             raise
     
     def search_annotations(self, user_id: int, query: str = None, 
-                          annotation_type: str = None, tags: List[str] = None) -> List[DocumentAnnotation]:
+                          annotation_type: str = None, tags: List[str] = None,
+                          cursor: Optional[AnnotationCursor] = None,
+                          limit: int = DEFAULT_PAGE_SIZE) -> Tuple[List[DocumentAnnotation], Optional[AnnotationCursor]]:
         """
-        Recherche dans les annotations
+        Recherche dans les annotations (une page, plus récentes d'abord)
         
         Args:
             user_id: ID de l'utilisateur
             query: Texte à rechercher
             annotation_type: Filtrer par type
             tags: Filtrer par tags
+            cursor: Curseur retourné par la page précédente (optionnel)
+            limit: Taille de la page
             
         Returns:
-            Liste des annotations correspondantes
+            (annotations correspondantes, curseur de la page suivante ou None)
         """
         try:
-            # Construire la requête de base
-            base_query = self.db.query(DocumentAnnotation).join(Document).filter(
+            # Construire la requête de base ; le JOIN sert aussi à peupler annotation.document
+            base_query = self.db.query(DocumentAnnotation).join(Document).options(
+                contains_eager(DocumentAnnotation.document),
+                *_raiseload_options()
+            ).filter(
                 and_(
                     Document.user_id == user_id,
                     DocumentAnnotation.is_active == True
@@ -240,8 +597,8 @@ class DocumentAnnotationService:
             if query:
                 base_query = base_query.filter(
                     or_(
-                        DocumentAnnotation.content.ilike(f"%{query}%"),
-                        Document.filename.ilike(f"%{query}%")
+                        _annotation_content_match(self.db, query),
+                        Document.filename.ilike(_contains_pattern(query))
                     )
                 )
             
@@ -249,17 +606,40 @@ class DocumentAnnotationService:
                 base_query = base_query.filter(DocumentAnnotation.annotation_type == annotation_type)
             
             if tags:
-                for tag in tags:
-                    base_query = base_query.filter(DocumentAnnotation.tags.contains(tag))
-            
-            annotations = base_query.order_by(desc(DocumentAnnotation.created_at)).all()
+                base_query = base_query.filter(
+                    DocumentAnnotation.id.in_(_annotations_with_tags(tags))
+                )
             
-            return annotations
+            return _paginate(base_query, cursor, limit)
             
         except Exception as e:
             logger.error(f"Erreur lors de la recherche d'annotations: {e}")
             raise
     
+    def search_annotations_cached(self, user_id: int, query: str = None,
+                                  annotation_type: str = None,
+                                  tags: List[str] = None,
+                                  cursor: Optional[AnnotationCursor] = None,
+                                  limit: int = DEFAULT_PAGE_SIZE) -> Tuple[List[Dict[str, Any]], Optional[AnnotationCursor]]:
+        """
+        Variante de search_annotations retournant des résultats sérialisés mis en cache
+        
+        Returns:
+            (annotations sérialisées (voir serialize_annotation), curseur de la page suivante)
+        """
+        key = query_cache.key(
+            _user_namespace(user_id), "search", query, annotation_type, tuple(tags or ()),
+            cursor, limit
+        )
+        page = query_cache.get(key)
+        if page is None:
+            annotations, next_cursor = self.search_annotations(
+                user_id, query, annotation_type, tags, cursor, limit
+            )
+            page = ([serialize_annotation(annotation) for annotation in annotations], next_cursor)
+            query_cache.set(key, page)
+        return page
+    
     def get_annotation_statistics(self, user_id: int) -> Dict[str, Any]:
         """
         Récupère les statistiques des annotations d'un utilisateur
@@ -270,63 +650,71 @@ class DocumentAnnotationService:
         Returns:
             Statistiques des annotations
         """
+        cache_key = query_cache.key(_user_namespace(user_id), "statistics")
+        cached = query_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
         try:
-            # Total d'annotations
-            total_annotations = self.db.query(DocumentAnnotation).join(Document).filter(
-                and_(
-                    Document.user_id == user_id,
-                    DocumentAnnotation.is_active == True
-                )
-            ).count()
-            
-            # Par type d'annotation
-            type_stats = self.db.query(
+            # Une seule requête : CTE des annotations actives de l'utilisateur,
+            # puis UNION ALL des agrégats sous la forme (kind, key, count)
+            base = select(
+                DocumentAnnotation.id,
                 DocumentAnnotation.annotation_type,
-                func.count(DocumentAnnotation.id)
-            ).join(Document).filter(
-                and_(
-                    Document.user_id == user_id,
-                    DocumentAnnotation.is_active == True
-                )
-            ).group_by(DocumentAnnotation.annotation_type).all()
-            
-            # Documents les plus annotés
-            document_stats = self.db.query(
-                Document.filename,
-                func.count(DocumentAnnotation.id)
-            ).join(DocumentAnnotation).filter(
-                and_(
-                    Document.user_id == user_id,
-                    DocumentAnnotation.is_active == True
-                )
-            ).group_by(Document.id, Document.filename).order_by(
-                func.count(DocumentAnnotation.id).desc()
-            ).limit(10).all()
-            
-            # Tags les plus utilisés
-            all_tags = []
-            annotations = self.db.query(DocumentAnnotation).join(Document).filter(
+                DocumentAnnotation.document_id
+            ).join(Document).where(
                 and_(
                     Document.user_id == user_id,
                     DocumentAnnotation.is_active == True
                 )
+            ).cte("base")
+            
+            total_query = select(
+                literal("total").label("kind"),
+                literal(None, String).label("key"),
+                func.count().label("count")
+            ).select_from(base)
+            
+            type_query = select(
+                literal("type"),
+                base.c.annotation_type,
+                func.count()
+            ).group_by(base.c.annotation_type)
+            
+            top_documents = select(
+                Document.filename.label("key"),
+                func.count().label("count")
+            ).select_from(base).join(Document, Document.id == base.c.document_id).group_by(
+                Document.id, Document.filename
+            ).order_by(func.count().desc()).limit(10).subquery()
+            document_query = select(literal("document"), top_documents.c.key, top_documents.c.count)
+            
+            tags_subquery = _top_tags_subquery(select(base.c.id))
+            tag_query = select(literal("tag"), tags_subquery.c.key, tags_subquery.c.count)
+            
+            rows = self.db.execute(
+                union_all(total_query, type_query, document_query, tag_query)
             ).all()
             
-            for annotation in annotations:
-                if annotation.tags:
-                    try:
-                        tags = json.loads(annotation.tags)
-                        all_tags.extend(tags)
-                    except:
-                        pass
-            
-            tag_counts = {}
-            for tag in all_tags:
-                tag_counts[tag] = tag_counts.get(tag, 0) + 1
-            
-            top_tags = sorted(tag_counts.items(), key=lambda x: x[1], reverse=True)[:10]
-            
-            return {
+            total_annotations = 0
+            type_stats = []
+            document_stats = []
+            top_tags = []
+            for kind, key, count in rows:
+                if kind == "total":
+                    total_annotations = count
+                elif kind == "type":
+                    type_stats.append((key, count))
+                elif kind == "document":
+                    document_stats.append((key, count))
+                else:
+                    top_tags.append((key, count))
+            
+            # UNION ALL ne garantit pas l'ordre des sous-requêtes
+            document_stats.sort(key=lambda x: x[1], reverse=True)
+            top_tags.sort(key=lambda x: x[1], reverse=True)
+            
+            statistics = {
                 "total_annotations": total_annotations,
                 "annotations_by_type": dict(type_stats),
                 "most_annotated_documents": [
@@ -338,6 +726,8 @@ class DocumentAnnotationService:
                     for tag, count in top_tags
                 ]
             }
+            query_cache.set(cache_key, statistics)
+            return statistics
             
         except Exception as e:
             logger.error(f"Erreur lors du calcul des statistiques: {e}")
@@ -346,6 +736,9 @@ class DocumentAnnotationService:
 class DocumentTagService:
     """Service de gestion des tags de documents"""
     
+    # Instancié à chaque requête : pas de __dict__, seule la session est portée
+    __slots__ = ("db",)
+    
     def __init__(self, db: Session):
         self.db = db
     
@@ -370,17 +763,18 @@ class DocumentTagService:
             if existing_tag:
                 return existing_tag
             
-            tag = DocumentTag(
-                name=name,
-                color=color,
-                description=description,
-                created_at=datetime.now(),
-                is_active=True
-            )
+            tag = self.db.scalars(
+                insert(DocumentTag).values(
+                    name=name,
+                    color=color,
+                    description=description,
+                    is_active=True
+                ).returning(DocumentTag)
+            ).one()
             
-            self.db.add(tag)
+            self.db.expunge(tag)
             self.db.commit()
-            self.db.refresh(tag)
+            query_cache.invalidate(_TAGS_NAMESPACE)
             
             logger.info(f"Nouveau tag créé: {name}")
             return tag
@@ -400,6 +794,156 @@ class DocumentTagService:
             logger.error(f"Erreur lors de la récupération des tags: {e}")
             raise
     
+    def get_all_tags_cached(self) -> List[Dict[str, Any]]:
+        """
+        Variante de get_all_tags retournant des tags sérialisés mis en cache
+        
+        Les colonnes sont lues directement (sans objets ORM ni identity map).
+        """
+        key = query_cache.key(_TAGS_NAMESPACE, "all")
+        tags = query_cache.get(key)
+        if tags is None:
+            try:
+                rows = self.db.execute(
+                    select(
+                        DocumentTag.id, DocumentTag.name, DocumentTag.color,
+                        DocumentTag.description, DocumentTag.created_at
+                    ).where(DocumentTag.is_active == True).order_by(DocumentTag.name)
+                ).mappings()
+            except Exception as e:
+                logger.error(f"Erreur lors de la récupération des tags: {e}")
+                raise
+            tags = [
+                {**row, "created_at": row["created_at"].isoformat() if row["created_at"] else None}
+                for row in rows
+            ]
+            query_cache.set(key, tags)
+        return tags
+    
+    def get_all_tags_json(self) -> Tuple[int, bytes]:
+        """
+        Tags actifs déjà sérialisés en tableau JSON, mis en cache avec la liste
+        
+        Returns:
+            (nombre de tags, tableau JSON encodé)
+        """
+        key = query_cache.key(_TAGS_NAMESPACE, "all-json")
+        cached = query_cache.get(key)
+        if cached is None:
+            tags = self.get_all_tags_cached()
+            cached = (len(tags), _dumps(tags).encode())
+            query_cache.set(key, cached)
+        return cached
+    
+    def get_document_tags(self, document_id: int) -> List[Dict[str, Any]]:
+        """Tags actifs associés à un document (colonnes lues directement)"""
+        try:
+            rows = self.db.execute(
+                select(
+                    DocumentTag.id, DocumentTag.name, DocumentTag.color,
+                    DocumentTag.description, DocumentTag.created_at
+                ).join(
+                    DocumentTagAssociation, DocumentTagAssociation.tag_id == DocumentTag.id
+                ).where(
+                    and_(
+                        DocumentTagAssociation.document_id == document_id,
+                        DocumentTag.is_active == True
+                    )
+                ).order_by(DocumentTag.name)
+            ).mappings()
+            return [
+                {**row, "created_at": row["created_at"].isoformat() if row["created_at"] else None}
+                for row in rows
+            ]
+        except Exception as e:
+            logger.error(f"Erreur lors de la récupération des tags du document: {e}")
+            raise
+    
+    def add_tags_to_document(self, document_id: int, tag_ids: List[int]) -> int:
+        """
+        Associe des tags actifs à un document (une seule insertion groupée)
+        
+        Args:
+            document_id: ID du document
+            tag_ids: IDs des tags à associer
+            
+        Returns:
+            Nombre d'associations créées (les associations existantes sont ignorées)
+        """
+        try:
+            tag_ids = list(dict.fromkeys(tag_ids))
+            active_ids = set(self.db.execute(
+                select(DocumentTag.id).where(
+                    and_(DocumentTag.id.in_(tag_ids), DocumentTag.is_active == True)
+                )
+            ).scalars())
+            linked_ids = set(self.db.execute(
+                select(DocumentTagAssociation.tag_id).where(
+                    and_(
+                        DocumentTagAssociation.document_id == document_id,
+                        DocumentTagAssociation.tag_id.in_(tag_ids)
+                    )
+                )
+            ).scalars())
+            
+            new_ids = [tag_id for tag_id in tag_ids if tag_id in active_ids and tag_id not in linked_ids]
+            if new_ids:
+                self.db.execute(insert(DocumentTagAssociation), [
+                    {"document_id": document_id, "tag_id": tag_id}
+                    for tag_id in new_ids
+                ])
+                self.db.commit()
+                query_cache.invalidate(_TAGS_NAMESPACE)
+            
+            return len(new_ids)
+            
+        except Exception as e:
+            logger.error(f"Erreur lors de l'ajout des tags au document: {e}")
+            self.db.rollback()
+            raise
+    
+    def add_tag_to_document(self, document_id: int, tag_id: int) -> bool:
+        """Associe un tag à un document ; False si le tag n'existe pas ou plus"""
+        self.add_tags_to_document(document_id, [tag_id])
+        return self.db.execute(
+            select(DocumentTagAssociation.tag_id).where(
+                and_(
+                    DocumentTagAssociation.document_id == document_id,
+                    DocumentTagAssociation.tag_id == tag_id
+                )
+            )
+        ).first() is not None
+    
+    def remove_tags_from_document(self, document_id: int, tag_ids: List[int]) -> int:
+        """
+        Retire des tags d'un document (une seule suppression groupée)
+        
+        Returns:
+            Nombre d'associations supprimées
+        """
+        try:
+            result = self.db.execute(
+                delete(DocumentTagAssociation).where(
+                    and_(
+                        DocumentTagAssociation.document_id == document_id,
+                        DocumentTagAssociation.tag_id.in_(tag_ids)
+                    )
+                )
+            )
+            self.db.commit()
+            if result.rowcount:
+                query_cache.invalidate(_TAGS_NAMESPACE)
+            return result.rowcount
+            
+        except Exception as e:
+            logger.error(f"Erreur lors du retrait des tags du document: {e}")
+            self.db.rollback()
+            raise
+    
+    def remove_tag_from_document(self, document_id: int, tag_id: int) -> bool:
+        """Retire un tag d'un document ; False si l'association n'existait pas"""
+        return self.remove_tags_from_document(document_id, [tag_id]) > 0
+    
     def get_tag(self, tag_id: int) -> Optional[DocumentTag]:
         """Récupère un tag spécifique"""
         try:
@@ -436,10 +980,9 @@ class DocumentTagService:
             if description is not None:
                 tag.description = description
             
-            tag.updated_at = datetime.now()
-            
             self.db.commit()
             self.db.refresh(tag)
+            query_cache.invalidate(_TAGS_NAMESPACE)
             
             logger.info(f"Tag {tag_id} mis à jour")
             return tag
@@ -460,14 +1003,17 @@ class DocumentTagService:
             True si supprimé
         """
         try:
-            tag = self.get_tag(tag_id)
-            if not tag:
+            result = self.db.execute(
+                update(DocumentTag).where(DocumentTag.id == tag_id).values(
+                    is_active=False,
+                    deleted_at=utcnow()
+                ).execution_options(synchronize_session=False)
+            )
+            if result.rowcount == 0:
                 raise ValueError("Tag non trouvé")
             
-            tag.is_active = False
-            tag.deleted_at = datetime.now()
-            
             self.db.commit()
+            query_cache.invalidate(_TAGS_NAMESPACE)
             
             logger.info(f"Tag {tag_id} supprimé")
             return True
@@ -490,7 +1036,7 @@ class DocumentTagService:
         try:
             return self.db.query(DocumentTag).filter(
                 and_(
-                    DocumentTag.name.ilike(f"%{query}%"),
+                    DocumentTag.name.ilike(_contains_pattern(query)),
                     DocumentTag.is_active == True
                 )
             ).order_by(DocumentTag.name).all()
@@ -506,27 +1052,29 @@ class DocumentTagService:
             Statistiques des tags
         """
         try:
-            # Total de tags
-            total_tags = self.db.query(DocumentTag).filter(
-                DocumentTag.is_active == True
-            ).count()
-            
-            # Tags les plus utilisés
-            tag_usage = {}
-            annotations = self.db.query(DocumentAnnotation).filter(
+            # Total de tags et tags les plus utilisés en un seul aller-retour
+            total_query = select(
+                literal("total").label("kind"),
+                literal(None, String).label("key"),
+                func.count().label("count")
+            ).select_from(DocumentTag).where(DocumentTag.is_active == True)
+            
+            active_annotations = select(DocumentAnnotation.id).where(
                 DocumentAnnotation.is_active == True
-            ).all()
-            
-            for annotation in annotations:
-                if annotation.tags:
-                    try:
-                        tags = json.loads(annotation.tags)
-                        for tag in tags:
-                            tag_usage[tag] = tag_usage.get(tag, 0) + 1
-                    except:
-                        pass
-            
-            top_tags = sorted(tag_usage.items(), key=lambda x: x[1], reverse=True)[:10]
+            )
+            tags_subquery = _top_tags_subquery(active_annotations)
+            tag_query = select(literal("tag"), tags_subquery.c.key, tags_subquery.c.count)
+            
+            rows = self.db.execute(union_all(total_query, tag_query)).all()
+            
+            total_tags = 0
+            top_tags = []
+            for kind, key, count in rows:
+                if kind == "total":
+                    total_tags = count
+                else:
+                    top_tags.append((key, count))
+            top_tags.sort(key=lambda x: x[1], reverse=True)
             
             return {
                 "total_tags": total_tags,
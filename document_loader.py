@@ -1,76 +1,522 @@
 import os
+import csv
+import json
+import mmap
 import logging
+import hashlib
+import importlib.metadata
+import sqlite3
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Dict, Any, Optional
-import PyPDF2
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Optional, Iterator, Tuple, Union
 import pypdf
 from docx import Document
 import pandas as pd
+import openpyxl
 from PIL import Image
 import pytesseract
-import easyocr
+import numpy as np
 import io
-import base64
+import binascii
+
+# PyMuPDF et PDFium (C/C++) : extraction de texte bien plus rapide que pypdf/PyPDF2, optionnels
+try:
+    import pymupdf
+except ImportError:
+    pymupdf = None
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
 
 from config import settings
 
 logger = logging.getLogger(__name__)
 
+IMAGE_EXTENSIONS = frozenset({'.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff'})
+WORD_EXTENSIONS = frozenset({'.docx', '.doc'})
+EXCEL_EXTENSIONS = frozenset({'.xlsx', '.xls'})
+
+# Signatures (octets de tête) attendues par extension ; .txt et .csv ne sont pas vérifiés
+_OLE_SIGNATURE = (b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1",)
+_ZIP_SIGNATURE = (b"PK\x03\x04",)
+FILE_SIGNATURES = {
+    '.png': (b"\x89PNG\r\n\x1a\n",),
+    '.jpg': (b"\xff\xd8\xff",),
+    '.jpeg': (b"\xff\xd8\xff",),
+    '.gif': (b"GIF87a", b"GIF89a"),
+    '.bmp': (b"BM",),
+    '.tiff': (b"II*\x00", b"MM\x00*"),
+    '.docx': _ZIP_SIGNATURE,
+    '.xlsx': _ZIP_SIGNATURE,
+    '.doc': _OLE_SIGNATURE,
+    '.xls': _OLE_SIGNATURE,
+}
+# Les lecteurs PDF tolèrent des octets parasites avant l'en-tête %PDF
+PDF_HEADER_SEARCH = 1024
+
+# OCR par lots : taille de lot et dimensions communes des images envoyées à EasyOCR
+OCR_BATCH_SIZE = 16
+OCR_BATCH_WIDTH = 800
+OCR_BATCH_HEIGHT = 600
+# Côté le plus long des images envoyées à l'OCR unitaire (au-delà, réduction préalable)
+OCR_MAX_DIMENSION = 1600
+
+# Tampon de lecture des PDF pour pypdf/PyPDF2 : moins d'appels read() pendant l'analyse de la table xref
+PDF_READ_BUFFER = 1 << 20
+
+# À incrémenter à chaque changement du texte ou des métadonnées produits par les
+# extracteurs : les résultats mis en cache par une version antérieure sont ignorés
+DOCUMENT_EXTRACTOR_VERSION = 1
+
+def _package_version(name: str) -> str:
+    """Version installée d'une distribution, sans l'importer ("absent" si non installée)"""
+    try:
+        return importlib.metadata.version(name)
+    except importlib.metadata.PackageNotFoundError:
+        return "absent"
+
+def _ocr_fingerprint() -> str:
+    """Version des extracteurs, moteurs et réglages dont dépend un résultat OCR"""
+    return "|".join((
+        str(DOCUMENT_EXTRACTOR_VERSION),
+        ",".join(settings.OCR_LANGUAGES),
+        f"quantize={settings.OCR_QUANTIZE}",
+        f"device={settings.OCR_DEVICE}",
+        f"easyocr={_package_version('easyocr')}",
+        f"pytesseract={_package_version('pytesseract')}",
+    ))
+
+def _pdf_engine() -> str:
+    """Moteur PDF essayé en premier par iter_pages selon les bibliothèques installées"""
+    if pymupdf is not None:
+        return f"PyMuPDF={_package_version('pymupdf')}"
+    if pdfium is not None:
+        return f"PDFium={_package_version('pypdfium2')}"
+    return f"pypdf={_package_version('pypdf')}"
+
+def _extraction_fingerprint() -> str:
+    """Version des extracteurs, moteur PDF et réglages OCR dont dépend le résultat d'une extraction"""
+    return f"ocr={settings.ENABLE_OCR}|pdf={_pdf_engine()}|{_ocr_fingerprint()}"
+
+class OcrResultCache:
+    """
+    Cache des résultats OCR indexé par l'empreinte BLAKE2 du contenu de l'image.
+    LRU en mémoire, doublé d'une table SQLite si un répertoire de persistance est fourni
+    (SQLite tolère plusieurs processus écrivains, contrairement à shelve). Une entrée
+    persistée n'est lue que si elle a été produite avec la même empreinte OCR (version
+    des extracteurs et du moteur, langues, quantification, périphérique).
+    """
+    
+    def __init__(self, maxsize: int, cache_dir: str = "", fingerprint: str = ""):
+        self.maxsize = maxsize
+        self.fingerprint = fingerprint
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._db_path = None
+        if cache_dir:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                self._db_path = os.path.join(cache_dir, "ocr_cache.sqlite")
+                with sqlite3.connect(self._db_path) as connection:
+                    connection.execute(
+                        "CREATE TABLE IF NOT EXISTS ocr_cache "
+                        "(digest TEXT PRIMARY KEY, fingerprint TEXT NOT NULL DEFAULT '', "
+                        "text TEXT NOT NULL, fields TEXT NOT NULL)"
+                    )
+                    # Cache créé avant l'empreinte : ses entrées ne correspondront plus
+                    columns = {row[1] for row in connection.execute("PRAGMA table_info(ocr_cache)")}
+                    if "fingerprint" not in columns:
+                        connection.execute(
+                            "ALTER TABLE ocr_cache ADD COLUMN fingerprint TEXT NOT NULL DEFAULT ''"
+                        )
+            except Exception as e:
+                logger.warning(f"Cache OCR persistant indisponible ({cache_dir}): {e}")
+                self._db_path = None
+    
+    def get(self, digest: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """(texte, champs OCR des métadonnées) ou None"""
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                self._entries.move_to_end(digest)
+                return entry
+        if self._db_path:
+            try:
+                with sqlite3.connect(self._db_path) as connection:
+                    row = connection.execute(
+                        "SELECT text, fields FROM ocr_cache WHERE digest = ? AND fingerprint = ?",
+                        (digest, self.fingerprint)
+                    ).fetchone()
+            except Exception as e:
+                logger.warning(f"Lecture du cache OCR échouée: {e}")
+                row = None
+            if row is not None:
+                entry = (row[0], json.loads(row[1]))
+                self._remember(digest, entry)
+                return entry
+        return None
+    
+    def set(self, digest: str, text: str, fields: Dict[str, Any]) -> None:
+        """Enregistre un résultat OCR"""
+        self._remember(digest, (text, fields))
+        if self._db_path:
+            try:
+                with sqlite3.connect(self._db_path) as connection:
+                    connection.execute(
+                        "INSERT OR REPLACE INTO ocr_cache (digest, fingerprint, text, fields) "
+                        "VALUES (?, ?, ?, ?)",
+                        (digest, self.fingerprint, text, json.dumps(fields))
+                    )
+            except Exception as e:
+                logger.warning(f"Écriture du cache OCR échouée: {e}")
+    
+    def _remember(self, digest: str, entry: Tuple[str, Dict[str, Any]]) -> None:
+        with self._lock:
+            self._entries[digest] = entry
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+ocr_cache = OcrResultCache(settings.OCR_CACHE_SIZE, settings.OCR_CACHE_DIR, _ocr_fingerprint())
+
+class DocumentCache:
+    """
+    Cache persistant (SQLite) des documents extraits, indexé par chemin absolu.
+    Une entrée n'est valable que si mtime et taille du fichier n'ont pas changé, et si
+    elle a été produite avec la même empreinte d'extraction (version des extracteurs,
+    moteur PDF installé et réglages OCR).
+    """
+    
+    # Limite de paramètres par requête SQLite
+    LOOKUP_CHUNK = 500
+    
+    def __init__(self, cache_dir: str = "", fingerprint: str = ""):
+        self._db_path = None
+        self.fingerprint = fingerprint
+        if cache_dir:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                self._db_path = os.path.join(cache_dir, "documents.sqlite")
+                with sqlite3.connect(self._db_path) as connection:
+                    connection.execute(
+                        "CREATE TABLE IF NOT EXISTS documents "
+                        "(path TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL, size INTEGER NOT NULL, "
+                        "fingerprint TEXT NOT NULL DEFAULT '', payload TEXT NOT NULL)"
+                    )
+                    # Cache créé avant l'empreinte : ses entrées ne correspondront plus
+                    columns = {row[1] for row in connection.execute("PRAGMA table_info(documents)")}
+                    if "fingerprint" not in columns:
+                        connection.execute(
+                            "ALTER TABLE documents ADD COLUMN fingerprint TEXT NOT NULL DEFAULT ''"
+                        )
+            except Exception as e:
+                logger.warning(f"Cache de documents indisponible ({cache_dir}): {e}")
+                self._db_path = None
+    
+    @property
+    def enabled(self) -> bool:
+        return self._db_path is not None
+    
+    def get_many(self, file_paths: List[Path], stats: List[os.stat_result]) -> Dict[int, Dict[str, Any]]:
+        """Documents encore valides, par position dans file_paths"""
+        if not self._db_path:
+            return {}
+        positions = {os.path.abspath(file_path): i for i, file_path in enumerate(file_paths)}
+        keys = list(positions)
+        found = {}
+        try:
+            with sqlite3.connect(self._db_path) as connection:
+                for start in range(0, len(keys), self.LOOKUP_CHUNK):
+                    chunk = keys[start:start + self.LOOKUP_CHUNK]
+                    rows = connection.execute(
+                        "SELECT path, mtime_ns, size, payload FROM documents "
+                        f"WHERE fingerprint = ? AND path IN ({', '.join('?' * len(chunk))})",
+                        [self.fingerprint, *chunk]
+                    )
+                    for path, mtime_ns, size, payload in rows:
+                        i = positions[path]
+                        if (mtime_ns, size) == (stats[i].st_mtime_ns, stats[i].st_size):
+                            found[i] = json.loads(payload)
+        except Exception as e:
+            logger.warning(f"Lecture du cache de documents échouée: {e}")
+            return {}
+        return found
+    
+    def set_many(self, entries: List[Tuple[Path, os.stat_result, Dict[str, Any]]]) -> None:
+        """Enregistre des documents fraîchement chargés"""
+        if not self._db_path or not entries:
+            return
+        try:
+            with sqlite3.connect(self._db_path) as connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO documents (path, mtime_ns, size, fingerprint, payload) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (os.path.abspath(file_path), stat_result.st_mtime_ns, stat_result.st_size,
+                         self.fingerprint, json.dumps(doc))
+                        for file_path, stat_result, doc in entries
+                    ]
+                )
+        except Exception as e:
+            logger.warning(f"Écriture du cache de documents échouée: {e}")
+
+document_cache = DocumentCache(settings.DOCUMENT_CACHE_DIR, _extraction_fingerprint())
+
+# Champs de métadonnées produits par l'OCR (mis en cache avec le texte)
+OCR_METADATA_FIELDS = ("ocr_confidence", "ocr_method", "ocr_boxes")
+
+def _content_digest(data: bytes) -> str:
+    """Empreinte BLAKE2b (128 bits) d'un contenu"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def _file_digest(file_path: Path) -> str:
+    """Empreinte BLAKE2b (128 bits) du contenu d'un fichier"""
+    return _content_digest(file_path.read_bytes())
+
+def _rows_to_text(rows) -> str:
+    """Une ligne par rangée, cellules séparées par des tabulations (rangées vides ignorées)"""
+    return "\n".join(
+        "\t".join("" if value is None else str(value) for value in row)
+        for row in rows
+        if any(value is not None and value != "" for value in row)
+    )
+
+def _check_signature(extension: str, header: bytes) -> bool:
+    """Vérifie que les premiers octets du fichier correspondent à son extension"""
+    if extension == '.pdf':
+        return b"%PDF" in header[:PDF_HEADER_SEARCH]
+    signatures = FILE_SIGNATURES.get(extension)
+    return signatures is None or header.startswith(signatures)
+
+def _prepare_ocr_image(img: Image.Image) -> Image.Image:
+    """Image RGB réduite à OCR_MAX_DIMENSION, partagée par EasyOCR et Tesseract"""
+    # JPEG : décodage directement à l'échelle réduite la plus proche
+    img.draft("RGB", (OCR_MAX_DIMENSION, OCR_MAX_DIMENSION))
+    ocr_image = img.convert("RGB")
+    if max(ocr_image.size) > OCR_MAX_DIMENSION:
+        ocr_image.thumbnail((OCR_MAX_DIMENSION, OCR_MAX_DIMENSION), Image.LANCZOS)
+    return ocr_image
+
+def detect_ocr_device() -> str:
+    """Meilleur périphérique disponible pour EasyOCR : "cuda", "mps" ou "cpu" """
+    try:
+        import torch
+    except ImportError:
+        return "cpu"
+    if torch.cuda.is_available():
+        return "cuda"
+    mps = getattr(torch.backends, "mps", None)
+    if mps is not None and mps.is_available():
+        return "mps"
+    return "cpu"
+
+def _pdf_stream(file_path: Path, file_data: Optional[bytes] = None):
+    """Flux binaire du PDF pour pypdf/PyPDF2 : en mémoire si file_data est fourni, sinon fichier avec tampon"""
+    if file_data is not None:
+        return io.BytesIO(file_data)
+    return open(file_path, 'rb', buffering=PDF_READ_BUFFER)
+
+# PDFium n'est pas thread-safe : tous les appels passent par ce verrou
+_PDFIUM_LOCK = threading.Lock()
+
+@lru_cache(maxsize=64)
+def _open_pdf(path: str, mtime_ns: int, size: int):
+    """
+    Document PDFium gardé ouvert entre les appels (xref déjà analysée).
+    mtime et taille font partie de la clé : un fichier modifié est rouvert.
+    """
+    return pdfium.PdfDocument(path)
+
 class AdvancedDocumentLoader:
     """Chargeur de documents avancé avec support multi-format"""
     
     def __init__(self):
-        self.supported_extensions = set(settings.SUPPORTED_FORMATS)
-        self.ocr_reader = None
-        self._init_ocr()
+        self.supported_extensions = settings.SUPPORTED_FORMATS
+        self._ocr_reader = None
+        self._ocr_initialized = False
+        self._ocr_lock = threading.Lock()
+    
+    @property
+    def ocr_reader(self):
+        """Lecteur EasyOCR, initialisé au premier usage (None si indisponible)"""
+        if not self._ocr_initialized:
+            with self._ocr_lock:
+                if not self._ocr_initialized:
+                    self._init_ocr()
+                    self._ocr_initialized = True
+        return self._ocr_reader
     
     def _init_ocr(self):
-        """Initialise le système OCR"""
-        if settings.ENABLE_OCR:
+        """Initialise le système OCR (GPU si disponible, CPU sinon)"""
+        if not settings.ENABLE_OCR:
+            return
+        
+        # Import différé : easyocr charge torch, inutile pour les lots sans image
+        # (notamment dans les processus du pool, qui ne font pas d'OCR)
+        try:
+            import easyocr
+        except ImportError as e:
+            logger.warning(f"EasyOCR non installé, OCR via Tesseract uniquement: {e}")
+            return
+        
+        device = settings.OCR_DEVICE
+        if device == "auto":
+            device = detect_ocr_device()
+        
+        if device != "cpu":
             try:
-                # EasyOCR pour une meilleure reconnaissance multi-langue
-                self.ocr_reader = easyocr.Reader(settings.OCR_LANGUAGES)
-                logger.info("OCR EasyOCR initialisé")
+                # EasyOCR accepte un nom de périphérique ("cuda", "mps") pour gpu
+                self._ocr_reader = easyocr.Reader(
+                    list(settings.OCR_LANGUAGES),
+                    gpu=device,
+                    cudnn_benchmark=(device == "cuda")
+                )
+                self._warmup_ocr()
+                logger.info(f"OCR EasyOCR initialisé sur {device}")
+                return
             except Exception as e:
-                logger.warning(f"Impossible d'initialiser EasyOCR: {e}")
-                self.ocr_reader = None
+                logger.warning(f"EasyOCR indisponible sur {device}, repli sur le CPU: {e}")
+        
+        try:
+            # EasyOCR pour une meilleure reconnaissance multi-langue ; sur CPU, quantize
+            # applique torch.quantization.quantize_dynamic (int8) au détecteur et au reconnaisseur
+            self._ocr_reader = easyocr.Reader(
+                list(settings.OCR_LANGUAGES),
+                gpu=False,
+                quantize=settings.OCR_QUANTIZE
+            )
+            logger.info("OCR EasyOCR initialisé sur cpu")
+        except Exception as e:
+            logger.warning(f"Impossible d'initialiser EasyOCR: {e}")
+            self._ocr_reader = None
     
-    def load_documents(self, source_dir: str = None) -> List[Dict[str, Any]]:
+    def _warmup_ocr(self):
+        """Premier lot à vide sur GPU : l'autotune cuDNN n'est pas payé par le premier vrai lot"""
+        try:
+            self._ocr_reader.readtext_batched(
+                np.zeros([OCR_BATCH_SIZE, OCR_BATCH_HEIGHT, OCR_BATCH_WIDTH, 3], dtype=np.uint8),
+                batch_size=OCR_BATCH_SIZE
+            )
+        except Exception as e:
+            logger.warning(f"Préchauffage EasyOCR échoué: {e}")
+    
+    def load_documents(self, source_dir: str = None, max_workers: Optional[int] = None,
+                       use_cache: bool = True) -> List[Dict[str, Any]]:
         """
         Charge tous les documents supportés d'un répertoire
         
         Args:
             source_dir: Chemin vers le répertoire source
+            max_workers: Nombre de processus de chargement (défaut: settings.LOADER_MAX_WORKERS)
+            use_cache: Réutiliser les extractions des fichiers inchangés (False pour tout recharger)
             
         Returns:
-            Liste des documents chargés
+            Liste des documents chargés, dans l'ordre du répertoire
         """
         source_path = Path(source_dir or settings.SOURCE_DIR)
         if not source_path.exists():
             logger.warning(f"Le répertoire {source_path} n'existe pas")
             return []
         
-        documents = []
+        # scandir connaît le type de chaque entrée sans stat() supplémentaire ;
+        # le stat() fait ici est réutilisé par les chargeurs
+        file_paths = []
+        stats = []
+        with os.scandir(source_path) as entries:
+            for entry in entries:
+                # Path n'est construit que pour les fichiers retenus
+                if entry.is_file() and os.path.splitext(entry.name)[1].lower() in self.supported_extensions:
+                    file_paths.append(Path(entry.path))
+                    stats.append(entry.stat())
+        if not file_paths:
+            return []
         
-        for file_path in source_path.iterdir():
-            if file_path.is_file() and file_path.suffix.lower() in self.supported_extensions:
-                try:
-                    doc = self.load_single_document(file_path)
-                    if doc:
-                        documents.append(doc)
-                        logger.info(f"Document chargé: {file_path.name}")
-                    
-                except Exception as e:
-                    logger.error(f"Erreur lors du chargement de {file_path}: {e}")
+        # Fichiers inchangés depuis la dernière extraction : ni analyse ni OCR
+        results: List[Optional[Dict[str, Any]]] = [None] * len(file_paths)
+        cached = document_cache.get_many(file_paths, stats) if use_cache else {}
+        for i, doc in cached.items():
+            results[i] = doc
+        to_load = [i for i in range(len(file_paths)) if i not in cached]
+        
+        # Avec EasyOCR, les images sont traitées ensemble dans ce processus
+        # (readtext_batched) ; les autres fichiers passent par le pool
+        if settings.ENABLE_OCR:
+            image_indexes = [
+                i for i in to_load
+                if file_paths[i].suffix.lower() in IMAGE_EXTENSIONS
+            ]
+        else:
+            image_indexes = []
+        image_index_set = set(image_indexes)
+        other_indexes = [i for i in to_load if i not in image_index_set]
+        image_paths = [file_paths[i] for i in image_indexes]
+        image_stats = [stats[i] for i in image_indexes]
+        other_paths = [file_paths[i] for i in other_indexes]
+        other_stats = [stats[i] for i in other_indexes]
+        
+        # Extraction PDF, OCR et pandas sont indépendants d'un fichier à l'autre : un
+        # processus par cœur. Chaque processus crée son propre chargeur (et son OCR
+        # au premier besoin) ; « spawn » évite de forker un contexte CUDA déjà ouvert.
+        # load_single_document journalise ses erreurs et retourne None. Les processus sont
+        # recyclés environ tous les LOADER_MAX_TASKS_PER_CHILD fichiers (un pool neuf par
+        # tranche) : la mémoire retenue par les bibliothèques natives est rendue au système.
+        # max_tasks_per_child n'est pas utilisé : il bloque le pool sous Python 3.11.
+        max_workers = min(max_workers or settings.LOADER_MAX_WORKERS, len(other_paths))
+        if max_workers <= 1:
+            other_results = list(map(self.load_single_document, other_paths, other_stats))
+            image_results = self.load_images_batched(image_paths, image_stats)
+        else:
+            chunk_size = max_workers * settings.LOADER_MAX_TASKS_PER_CHILD or len(other_paths)
+            other_results = []
+            image_results = None
+            for start in range(0, len(other_paths), chunk_size):
+                with ProcessPoolExecutor(
+                    max_workers=max_workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                ) as executor:
+                    # Les tâches sont soumises immédiatement : l'OCR par lots tourne
+                    # pendant la première tranche
+                    pending = executor.map(
+                        _load_one_safe,
+                        other_paths[start:start + chunk_size],
+                        other_stats[start:start + chunk_size]
+                    )
+                    if image_results is None:
+                        image_results = self.load_images_batched(image_paths, image_stats)
+                    other_results.extend(pending)
+        
+        for i, doc in zip(other_indexes, other_results):
+            results[i] = doc
+        for i, doc in zip(image_indexes, image_results):
+            results[i] = doc
+        
+        # Les échecs d'OCR ne sont pas mis en cache : ils seront retentés
+        document_cache.set_many([
+            (file_paths[i], stats[i], results[i]) for i in to_load
+            if results[i] and results[i]["metadata"].get("ocr_method") != "failed"
+        ])
+        
+        documents = []
+        for file_path, doc in zip(file_paths, results):
+            if doc:
+                documents.append(doc)
+                logger.info(f"Document chargé: {file_path.name}")
         
         return documents
     
-    def load_single_document(self, file_path: Path) -> Optional[Dict[str, Any]]:
+    def load_single_document(self, file_path: Path, stat_result: Optional[os.stat_result] = None) -> Optional[Dict[str, Any]]:
         """
         Charge un document unique selon son type
         
         Args:
             file_path: Chemin vers le fichier
+            stat_result: Résultat de os.stat déjà obtenu (évite un nouvel appel)
             
         Returns:
             Dictionnaire contenant le texte et les métadonnées
@@ -78,18 +524,30 @@ class AdvancedDocumentLoader:
         extension = file_path.suffix.lower()
         
         try:
+            # Fichiers vides ou dont l'en-tête ne correspond pas à l'extension :
+            # rejet immédiat, sans lancer l'analyse complète du chargeur
+            stat_result = stat_result or os.stat(file_path)
+            if not stat_result.st_size:
+                logger.warning(f"Fichier vide ignoré: {file_path}")
+                return None
+            with open(file_path, 'rb') as file:
+                header = file.read(PDF_HEADER_SEARCH)
+            if not _check_signature(extension, header):
+                logger.warning(f"Contenu ne correspondant pas à l'extension {extension}, fichier ignoré: {file_path}")
+                return None
+            
             if extension == '.pdf':
-                return self.load_pdf(file_path)
-            elif extension in ['.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff']:
-                return self.load_image(file_path)
-            elif extension in ['.docx', '.doc']:
-                return self.load_word(file_path)
-            elif extension in ['.xlsx', '.xls']:
-                return self.load_excel(file_path)
+                return self.load_pdf(file_path, stat_result)
+            elif extension in IMAGE_EXTENSIONS:
+                return self.load_image(file_path, stat_result)
+            elif extension in WORD_EXTENSIONS:
+                return self.load_word(file_path, stat_result)
+            elif extension in EXCEL_EXTENSIONS:
+                return self.load_excel(file_path, stat_result)
             elif extension == '.csv':
-                return self.load_csv(file_path)
+                return self.load_csv(file_path, stat_result)
             elif extension == '.txt':
-                return self.load_txt(file_path)
+                return self.load_txt(file_path, stat_result)
             else:
                 logger.warning(f"Format non supporté: {extension}")
                 return None
@@ -98,43 +556,27 @@ class AdvancedDocumentLoader:
             logger.error(f"Erreur lors du chargement de {file_path}: {e}")
             return None
     
-    def load_pdf(self, file_path: Path) -> Dict[str, Any]:
-        """Charge un fichier PDF avec extraction de texte avancée"""
+    def load_pdf(self, file_path: Path, stat_result: Optional[os.stat_result] = None,
+                 file_data: Optional[bytes] = None) -> Dict[str, Any]:
+        """
+        Charge un fichier PDF avec extraction de texte avancée
+        (file_data : contenu déjà en mémoire, file_path ne sert alors que de nom)
+        """
         try:
-            text = ""
+            if file_data is None:
+                stat_result = stat_result or os.stat(file_path)
             metadata = {
                 "source": str(file_path),
                 "filename": file_path.name,
                 "file_type": "pdf",
-                "file_size": file_path.stat().st_size
+                "file_size": len(file_data) if file_data is not None else stat_result.st_size
             }
             
-            # Essayer d'abord avec pypdf (plus récent)
-            try:
-                with open(file_path, 'rb') as file:
-                    pdf_reader = pypdf.PdfReader(file)
-                    metadata["total_pages"] = len(pdf_reader.pages)
-                    
-                    for page_num, page in enumerate(pdf_reader.pages):
-                        page_text = page.extract_text()
-                        if page_text.strip():
-                            text += f"Page {page_num + 1}:\n{page_text}\n\n"
-                        else:
-                            # Si pas de texte, essayer OCR sur cette page
-                            if self.ocr_reader:
-                                # Convertir la page en image et faire OCR
-                                pass  # TODO: Implémenter OCR sur pages PDF
-                    
-            except Exception as e:
-                logger.warning(f"pypdf échoué, essai avec PyPDF2: {e}")
-                # Fallback vers PyPDF2
-                with open(file_path, 'rb') as file:
-                    pdf_reader = PyPDF2.PdfReader(file)
-                    metadata["total_pages"] = len(pdf_reader.pages)
-                    
-                    for page_num, page in enumerate(pdf_reader.pages):
-                        page_text = page.extract_text()
-                        text += f"Page {page_num + 1}:\n{page_text}\n\n"
+            text = "\n\n".join(
+                f"Page {page_num}:\n{page_text}"
+                for page_num, page_text in self.iter_pages(file_path, metadata, stat_result, file_data)
+                if page_text.strip()
+            )
             
             return {
                 "text": text.strip(),
@@ -145,45 +587,262 @@ class AdvancedDocumentLoader:
             logger.error(f"Erreur lors du chargement du PDF {file_path}: {e}")
             raise
     
-    def load_image(self, file_path: Path) -> Dict[str, Any]:
-        """Charge une image et extrait le texte via OCR"""
+    def iter_pages(self, file_path: Path, metadata: Optional[Dict[str, Any]] = None,
+                   stat_result: Optional[os.stat_result] = None,
+                   file_data: Optional[bytes] = None) -> Iterator[Tuple[int, str]]:
+        """
+        Itère sur les pages d'un PDF sans garder le texte complet en mémoire
+        
+        Args:
+            file_path: Chemin vers le PDF
+            metadata: Dictionnaire à compléter avec "total_pages" (optionnel)
+            stat_result: Résultat de os.stat déjà obtenu (clé du cache PDFium)
+            file_data: Contenu du PDF déjà en mémoire (le fichier n'est alors pas lu)
+            
+        Yields:
+            (numéro de page à partir de 1, texte de la page)
+        """
+        if metadata is None:
+            metadata = {}
+        
+        # Essayer d'abord les moteurs natifs (PyMuPDF, PDFium), puis pypdf, puis PyPDF2.
+        # On ne change de moteur que si aucune page n'a encore été produite.
+        for name, iter_engine in (
+            ("PyMuPDF", self._iter_pages_pymupdf),
+            ("PDFium", self._iter_pages_pdfium),
+            ("pypdf", self._iter_pages_pypdf),
+            ("PyPDF2", self._iter_pages_pypdf2),
+        ):
+            if (name == "PyMuPDF" and pymupdf is None) or (name == "PDFium" and pdfium is None):
+                continue
+            
+            pages_yielded = 0
+            try:
+                for page in iter_engine(file_path, metadata, stat_result, file_data):
+                    pages_yielded += 1
+                    yield page
+                return
+            except Exception as e:
+                if pages_yielded or name == "PyPDF2":
+                    raise
+                logger.warning(f"{name} échoué, essai avec le moteur suivant: {e}")
+    
+    def _iter_pages_pymupdf(self, file_path: Path, metadata: Dict[str, Any],
+                            stat_result: Optional[os.stat_result] = None,
+                            file_data: Optional[bytes] = None) -> Iterator[Tuple[int, str]]:
+        """Pages d'un PDF via PyMuPDF (MuPDF, C)"""
+        if file_data is not None:
+            doc = pymupdf.open(stream=file_data, filetype="pdf")
+        else:
+            doc = pymupdf.open(str(file_path))
+        with doc:
+            metadata["total_pages"] = doc.page_count
+            
+            for page_num, page in enumerate(doc):
+                yield page_num + 1, page.get_text("text")
+    
+    def _iter_pages_pdfium(self, file_path: Path, metadata: Dict[str, Any],
+                           stat_result: Optional[os.stat_result] = None,
+                           file_data: Optional[bytes] = None) -> Iterator[Tuple[int, str]]:
+        """Pages d'un PDF via PDFium ; chaque page est libérée avant la suivante"""
+        with _PDFIUM_LOCK:
+            if file_data is not None:
+                # Contenu en mémoire : hors cache, fermé à la fin
+                pdf = pdfium.PdfDocument(file_data)
+            else:
+                # Document partagé via le cache : il n'est pas fermé ici
+                stat_result = stat_result or os.stat(file_path)
+                pdf = _open_pdf(str(file_path), stat_result.st_mtime_ns, stat_result.st_size)
+            total_pages = len(pdf)
+        metadata["total_pages"] = total_pages
+        
+        try:
+            for page_num in range(total_pages):
+                with _PDFIUM_LOCK:
+                    page = pdf[page_num]
+                    textpage = page.get_textpage()
+                    try:
+                        page_text = textpage.get_text_range()
+                    finally:
+                        # Libérer explicitement la mémoire native
+                        textpage.close()
+                        page.close()
+                yield page_num + 1, page_text
+        finally:
+            if file_data is not None:
+                with _PDFIUM_LOCK:
+                    pdf.close()
+    
+    def _iter_pages_pypdf(self, file_path: Path, metadata: Dict[str, Any],
+                          stat_result: Optional[os.stat_result] = None,
+                          file_data: Optional[bytes] = None) -> Iterator[Tuple[int, str]]:
+        """Pages d'un PDF via pypdf (Python pur)"""
+        with _pdf_stream(file_path, file_data) as file:
+            pdf_reader = pypdf.PdfReader(file)
+            metadata["total_pages"] = len(pdf_reader.pages)
+            
+            for page_num, page in enumerate(pdf_reader.pages):
+                page_text = page.extract_text()
+                if not page_text.strip() and self._ocr_reader:
+                    # Si pas de texte, essayer OCR sur cette page
+                    # Convertir la page en image et faire OCR
+                    pass  # TODO: Implémenter OCR sur pages PDF
+                yield page_num + 1, page_text
+    
+    def _iter_pages_pypdf2(self, file_path: Path, metadata: Dict[str, Any],
+                           stat_result: Optional[os.stat_result] = None,
+                           file_data: Optional[bytes] = None) -> Iterator[Tuple[int, str]]:
+        """Pages d'un PDF via PyPDF2 (dernier recours)"""
+        import PyPDF2
+        
+        with _pdf_stream(file_path, file_data) as file:
+            pdf_reader = PyPDF2.PdfReader(file)
+            metadata["total_pages"] = len(pdf_reader.pages)
+            
+            for page_num, page in enumerate(pdf_reader.pages):
+                yield page_num + 1, page.extract_text() or ""
+    
+    def load_images_batched(self, file_paths: List[Path],
+                            stats: Optional[List[os.stat_result]] = None) -> List[Optional[Dict[str, Any]]]:
+        """
+        Charge plusieurs images avec un seul appel EasyOCR par lots
+        
+        Args:
+            file_paths: Chemins des images
+            stats: Résultats de os.stat correspondants (optionnel)
+            
+        Returns:
+            Documents chargés (None pour les images en erreur), dans l'ordre de file_paths
+        """
+        if not file_paths:
+            return []
+        stats = stats or [None] * len(file_paths)
+        
+        digests = []
+        for file_path in file_paths:
+            try:
+                digests.append(_file_digest(file_path))
+            except OSError:
+                digests.append(None)
+        
+        # Seules les images absentes du cache OCR partent dans le lot ;
+        # sans résultat par lots, load_image refait l'OCR image par image
+        batched_results = [None] * len(file_paths)
+        misses = [i for i, digest in enumerate(digests) if digest is None or ocr_cache.get(digest) is None]
+        if misses and self.ocr_reader:
+            try:
+                miss_results = self.ocr_reader.readtext_batched(
+                    [str(file_paths[i]) for i in misses],
+                    n_width=OCR_BATCH_WIDTH,
+                    n_height=OCR_BATCH_HEIGHT,
+                    batch_size=OCR_BATCH_SIZE
+                )
+                for i, ocr_results in zip(misses, miss_results):
+                    batched_results[i] = ocr_results
+            except Exception as e:
+                logger.warning(f"EasyOCR par lots échoué, OCR image par image: {e}")
+        
+        documents = []
+        for file_path, stat_result, ocr_results, digest in zip(file_paths, stats, batched_results, digests):
+            try:
+                documents.append(self.load_image(file_path, stat_result, ocr_results, digest))
+            except Exception as e:
+                logger.error(f"Erreur lors du chargement de {file_path}: {e}")
+                documents.append(None)
+        return documents
+    
+    def load_image(self, file_path: Path, stat_result: Optional[os.stat_result] = None,
+                   ocr_results: Optional[list] = None, digest: Optional[str] = None,
+                   file_data: Optional[bytes] = None) -> Dict[str, Any]:
+        """
+        Charge une image et extrait le texte via OCR
+        (ocr_results : résultat EasyOCR déjà calculé ; digest : empreinte déjà calculée ;
+        file_data : contenu déjà en mémoire, file_path ne sert alors que de nom)
+        """
         try:
+            if file_data is not None:
+                file_size = len(file_data)
+                digest = digest or _content_digest(file_data)
+            else:
+                file_size = (stat_result or os.stat(file_path)).st_size
+                digest = digest or _file_digest(file_path)
             text = ""
             metadata = {
                 "source": str(file_path),
                 "filename": file_path.name,
                 "file_type": "image",
-                "file_size": file_path.stat().st_size
+                "file_size": file_size
             }
             
             # Ouvrir l'image
-            with Image.open(file_path) as img:
+            with Image.open(io.BytesIO(file_data) if file_data is not None else file_path) as img:
                 metadata["image_size"] = img.size
                 metadata["image_mode"] = img.mode
                 
+                # Même contenu déjà reconnu : pas de nouvel OCR
+                cached = ocr_cache.get(digest)
+                if cached is not None:
+                    text, ocr_fields = cached
+                    metadata.update(ocr_fields)
+                    return {
+                        "text": text,
+                        "metadata": metadata
+                    }
+                
+                # Image décodée une seule fois pour les deux moteurs ; les dimensions
+                # d'origine restent dans les métadonnées
+                ocr_image = _prepare_ocr_image(img) if ocr_results is None else None
+                
                 # Essayer OCR avec EasyOCR d'abord
-                if self.ocr_reader:
+                num_boxes = 0
+                if ocr_results is not None or self.ocr_reader:
                     try:
-                        results = self.ocr_reader.readtext(str(file_path))
-                        for (bbox, text_detected, confidence) in results:
-                            if confidence > 0.5:  # Seuil de confiance
-                                text += text_detected + " "
-                        metadata["ocr_confidence"] = confidence if results else 0
+                        if ocr_results is not None:
+                            results = ocr_results
+                        else:
+                            # EasyOCR accepte directement un tableau numpy
+                            results = self.ocr_reader.readtext(np.array(ocr_image))
+                        num_boxes = len(results)
+                        text = " ".join(
+                            text_detected
+                            for (bbox, text_detected, confidence) in results
+                            if confidence > 0.5  # Seuil de confiance
+                        )
+                        if num_boxes and not text.strip():
+                            # Zones détectées mais toutes sous le seuil : texte au mieux,
+                            # un second moteur OCR coûterait sans garantie de faire mieux
+                            logger.info(f"EasyOCR peu confiant pour {file_path.name}, texte conservé tel quel")
+                            text = " ".join(text_detected for (bbox, text_detected, confidence) in results)
+                        metadata["ocr_method"] = "easyocr"
+                        metadata["ocr_boxes"] = num_boxes
+                        if num_boxes:
+                            metadata["ocr_confidence"] = (
+                                sum(confidence for (bbox, text_detected, confidence) in results) / num_boxes
+                            )
                     except Exception as e:
                         logger.warning(f"EasyOCR échoué: {e}")
                 
-                # Fallback vers Tesseract si EasyOCR échoue
-                if not text.strip():
+                # Fallback vers Tesseract seulement si EasyOCR n'a détecté aucune zone de texte
+                if not num_boxes:
                     try:
-                        text = pytesseract.image_to_string(img, lang='fra+eng')
+                        if ocr_image is None:
+                            ocr_image = _prepare_ocr_image(img)
+                        text = pytesseract.image_to_string(ocr_image, lang='fra+eng')
                         metadata["ocr_method"] = "tesseract"
                     except Exception as e:
                         logger.warning(f"Tesseract échoué: {e}")
                         text = f"[Image: {file_path.name}] - Texte non extrait"
                         metadata["ocr_method"] = "failed"
             
+            text = text.strip()
+            # Les échecs et les reconnaissances peu sûres ne sont pas mis en cache
+            if metadata.get("ocr_method") != "failed" and metadata.get("ocr_confidence", 1) >= 0.5:
+                ocr_cache.set(digest, text, {
+                    field: metadata[field] for field in OCR_METADATA_FIELDS if field in metadata
+                })
+            
             return {
-                "text": text.strip(),
+                "text": text,
                 "metadata": metadata
             }
             
@@ -191,21 +850,21 @@ class AdvancedDocumentLoader:
             logger.error(f"Erreur lors du chargement de l'image {file_path}: {e}")
             raise
     
-    def load_word(self, file_path: Path) -> Dict[str, Any]:
+    def load_word(self, file_path: Path, stat_result: Optional[os.stat_result] = None) -> Dict[str, Any]:
         """Charge un document Word"""
         try:
+            stat_result = stat_result or os.stat(file_path)
             doc = Document(file_path)
-            text = ""
-            
-            for paragraph in doc.paragraphs:
-                if paragraph.text.strip():
-                    text += paragraph.text + "\n"
+            text = "\n".join(
+                paragraph.text for paragraph in doc.paragraphs
+                if paragraph.text.strip()
+            )
             
             metadata = {
                 "source": str(file_path),
                 "filename": file_path.name,
                 "file_type": "word",
-                "file_size": file_path.stat().st_size,
+                "file_size": stat_result.st_size,
                 "paragraphs": len(doc.paragraphs)
             }
             
@@ -218,24 +877,41 @@ class AdvancedDocumentLoader:
             logger.error(f"Erreur lors du chargement du document Word {file_path}: {e}")
             raise
     
-    def load_excel(self, file_path: Path) -> Dict[str, Any]:
+    def load_excel(self, file_path: Path, stat_result: Optional[os.stat_result] = None) -> Dict[str, Any]:
         """Charge un fichier Excel"""
         try:
-            df = pd.read_excel(file_path, sheet_name=None)
-            text = ""
-            
-            for sheet_name, sheet_df in df.items():
-                text += f"Feuille: {sheet_name}\n"
-                text += sheet_df.to_string(index=False) + "\n\n"
-            
+            stat_result = stat_result or os.stat(file_path)
             metadata = {
                 "source": str(file_path),
                 "filename": file_path.name,
                 "file_type": "excel",
-                "file_size": file_path.stat().st_size,
-                "sheets": list(df.keys())
+                "file_size": stat_result.st_size
             }
             
+            if file_path.suffix.lower() == '.xls':
+                # openpyxl ne lit pas l'ancien format binaire : pandas (xlrd). Classeur
+                # ouvert une fois, feuilles lues une à une (chaque DataFrame est libéré
+                # dès sa conversion en texte)
+                with pd.ExcelFile(file_path) as workbook:
+                    metadata["sheets"] = workbook.sheet_names
+                    text = "\n\n".join(
+                        f"Feuille: {sheet_name}\n"
+                        + workbook.parse(sheet_name).to_csv(sep="\t", index=False, lineterminator="\n").rstrip()
+                        for sheet_name in workbook.sheet_names
+                    )
+            else:
+                # Lecture en flux, valeurs calculées plutôt que formules
+                workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+                try:
+                    metadata["sheets"] = workbook.sheetnames
+                    text = "\n\n".join(
+                        f"Feuille: {worksheet.title}\n{_rows_to_text(worksheet.iter_rows(values_only=True))}"
+                        for worksheet in workbook.worksheets
+                    )
+                finally:
+                    # Le mode read_only garde le fichier ouvert jusqu'à la fermeture
+                    workbook.close()
+            
             return {
                 "text": text.strip(),
                 "metadata": metadata
@@ -245,20 +921,24 @@ class AdvancedDocumentLoader:
             logger.error(f"Erreur lors du chargement du fichier Excel {file_path}: {e}")
             raise
     
-    def load_csv(self, file_path: Path) -> Dict[str, Any]:
+    def load_csv(self, file_path: Path, stat_result: Optional[os.stat_result] = None) -> Dict[str, Any]:
         """Charge un fichier CSV"""
         try:
-            df = pd.read_csv(file_path)
-            text = f"Fichier CSV: {file_path.name}\n"
-            text += df.to_string(index=False)
+            stat_result = stat_result or os.stat(file_path)
+            with open(file_path, newline='', encoding='utf-8', errors='replace') as file:
+                reader = csv.reader(file)
+                columns = next(reader, [])
+                lines = [_rows_to_text([columns])] if columns else []
+                lines.extend(_rows_to_text([row]) for row in reader if any(row))
+            text = f"Fichier CSV: {file_path.name}\n" + "\n".join(lines)
             
             metadata = {
                 "source": str(file_path),
                 "filename": file_path.name,
                 "file_type": "csv",
-                "file_size": file_path.stat().st_size,
-                "rows": len(df),
-                "columns": list(df.columns)
+                "file_size": stat_result.st_size,
+                "rows": max(len(lines) - 1, 0),
+                "columns": columns
             }
             
             return {
@@ -270,17 +950,24 @@ class AdvancedDocumentLoader:
             logger.error(f"Erreur lors du chargement du fichier CSV {file_path}: {e}")
             raise
     
-    def load_txt(self, file_path: Path) -> Dict[str, Any]:
+    def load_txt(self, file_path: Path, stat_result: Optional[os.stat_result] = None) -> Dict[str, Any]:
         """Charge un fichier texte"""
         try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                text = file.read()
+            # Fichier projeté en mémoire puis décodé en une passe : pas de copie
+            # intermédiaire du contenu dans le tas Python
+            stat_result = stat_result or os.stat(file_path)
+            if stat_result.st_size:
+                with open(file_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    text = str(mapped, 'utf-8', 'replace')
+            else:
+                # mmap refuse les fichiers vides
+                text = ""
             
             metadata = {
                 "source": str(file_path),
                 "filename": file_path.name,
                 "file_type": "txt",
-                "file_size": file_path.stat().st_size
+                "file_size": stat_result.st_size
             }
             
             return {
@@ -292,38 +979,48 @@ class AdvancedDocumentLoader:
             logger.error(f"Erreur lors du chargement du fichier texte {file_path}: {e}")
             raise
     
-    def load_from_base64(self, base64_data: str, filename: str) -> Optional[Dict[str, Any]]:
+    def load_from_base64(self, base64_data: Union[str, bytes], filename: str) -> Optional[Dict[str, Any]]:
         """Charge un document depuis des données base64 (pour upload API)"""
         try:
-            # Décoder les données base64
-            file_data = base64.b64decode(base64_data)
-            
-            # Créer un fichier temporaire en mémoire
-            file_obj = io.BytesIO(file_data)
+            # Décodage C direct ; accepte str ASCII ou bytes et ignore les retours à la ligne
+            file_data = binascii.a2b_base64(base64_data)
+        except (binascii.Error, ValueError) as e:
+            logger.error(f"Erreur lors du chargement depuis base64: {e}")
+            return None
+        return self.load_from_bytes(file_data, filename)
+    
+    def load_from_bytes(self, file_data: bytes, filename: str) -> Optional[Dict[str, Any]]:
+        """Charge un document déjà en mémoire (upload API)"""
+        try:
+            # Le contenu reste en mémoire : le nom ne sert qu'aux métadonnées
+            file_path = Path(Path(filename).name)
+            extension = file_path.suffix.lower()
             
-            # Déterminer le type de fichier
-            extension = Path(filename).suffix.lower()
+            if not file_data:
+                logger.warning(f"Upload vide ignoré: {filename}")
+                return None
+            if not _check_signature(extension, file_data[:PDF_HEADER_SEARCH]):
+                logger.warning(f"Contenu ne correspondant pas à l'extension {extension}, upload ignoré: {filename}")
+                return None
             
             if extension == '.pdf':
-                # Créer un PDF temporaire
-                temp_path = Path(f"/tmp/{filename}")
-                with open(temp_path, 'wb') as f:
-                    f.write(file_data)
-                result = self.load_pdf(temp_path)
-                temp_path.unlink()  # Supprimer le fichier temporaire
-                return result
-            elif extension in ['.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff']:
-                # Créer une image temporaire
-                temp_path = Path(f"/tmp/{filename}")
-                with open(temp_path, 'wb') as f:
-                    f.write(file_data)
-                result = self.load_image(temp_path)
-                temp_path.unlink()
-                return result
+                return self.load_pdf(file_path, file_data=file_data)
+            elif extension in IMAGE_EXTENSIONS:
+                return self.load_image(file_path, file_data=file_data)
             else:
                 logger.warning(f"Format non supporté pour upload: {extension}")
                 return None
                 
         except Exception as e:
-            logger.error(f"Erreur lors du chargement depuis base64: {e}")
-            return None 
\ No newline at end of file
+            logger.error(f"Erreur lors du chargement de {filename}: {e}")
+            return None 
+
+# Chargeur propre à chaque processus du pool de load_documents
+_worker_loader: Optional[AdvancedDocumentLoader] = None
+
+def _load_one_safe(file_path: Path, stat_result: Optional[os.stat_result] = None) -> Optional[Dict[str, Any]]:
+    """Point d'entrée des processus du pool : charge un fichier avec le chargeur du processus"""
+    global _worker_loader
+    if _worker_loader is None:
+        _worker_loader = AdvancedDocumentLoader()
+    return _worker_loader.load_single_document(file_path, stat_result)
@@ -2,120 +2,215 @@
 Routes pour la gestion avancée des documents de DocSearch AI
 """
 
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query
+from fastapi import APIRouter, Body, Depends, HTTPException, UploadFile, File, Form, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.routing import APIRoute
+from fastapi.exceptions import RequestValidationError
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from typing import List, Dict, Any, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Dict, Any, Optional, AsyncIterator
 from datetime import datetime, timedelta
 import json
+import asyncio
+import hashlib
+import logging
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 
 from auth import get_current_user, get_current_admin_user
-from models import User, get_db
+from models import User, get_db, get_async_db
 from document_versioning import DocumentVersioningService
-from document_annotations import DocumentAnnotationService, DocumentTagService
+from document_annotations import DocumentAnnotationService, DocumentTagService, DEFAULT_PAGE_SIZE, encode_cursor, decode_cursor
 from document_sharing import DocumentSharingService
 
-router = APIRouter(prefix="/documents", tags=["document-management"])
+# orjson (Rust) est nettement plus rapide que json, utilisé s'il est installé ;
+# orjson.JSONDecodeError hérite de json.JSONDecodeError
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+# ciso8601 (C) parse l'ISO 8601, « Z » compris, bien plus vite que datetime.fromisoformat
+try:
+    from ciso8601 import parse_datetime as _parse_datetime
+except ImportError:
+    def _parse_datetime(value: str) -> datetime:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+logger = logging.getLogger(__name__)
+
+class ServiceErrorRoute(APIRoute):
+    """
+    Route traduisant en un seul point les exceptions non gérées par les handlers :
+    ValueError -> 400, PermissionError -> 403, autres -> 500
+    
+    Les handlers ne gardent que les cas où un code plus précis est attendu.
+    """
+    
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        
+        async def route_handler(request: Request) -> Response:
+            try:
+                return await handler(request)
+            except (HTTPException, RequestValidationError):
+                raise
+            except PermissionError as e:
+                return JSONResponse({"success": False, "detail": str(e)}, status_code=403)
+            except ValueError as e:
+                return JSONResponse({"success": False, "detail": str(e)}, status_code=400)
+            except Exception as e:
+                # Le détail (SQL, chemins) reste dans les journaux, pas dans la réponse
+                logger.error(f"Erreur sur {request.method} {request.url.path}: {e}", exc_info=True)
+                return JSONResponse({"success": False, "detail": "Erreur interne du serveur"}, status_code=500)
+        
+        return route_handler
+
+router = APIRouter(prefix="/documents", tags=["document-management"], route_class=ServiceErrorRoute)
+
+# Le versioning passe par AsyncSession ; les autres services sont synchrones : leurs
+# routes sont des fonctions « def », exécutées par FastAPI dans le threadpool pour
+# ne pas bloquer la boucle d'événements
 
 # ==================== VERSIONING ====================
 
+class UserSummaryOut(BaseModel):
+    """Auteur d'une version ou d'une annotation"""
+    model_config = ConfigDict(from_attributes=True)
+    
+    id: int
+    username: str
+    full_name: Optional[str] = None
+
+class VersionOut(BaseModel):
+    """Représentation JSON d'une version (colonnes de DocumentVersion)"""
+    model_config = ConfigDict(from_attributes=True)
+    
+    id: int
+    document_id: int
+    version_number: int
+    filename: str
+    file_type: str
+    file_size: int
+    file_hash: str
+    uploaded_by: int
+    created_at: datetime
+    metadata: Dict[str, Any] = Field(default_factory=dict, validation_alias="metadata_json")
+    
+    @field_validator("metadata", mode="before")
+    @classmethod
+    def parse_metadata(cls, v):
+        if isinstance(v, str):
+            return json.loads(v)
+        return v or {}
+
+class VersionWithUploaderOut(VersionOut):
+    """Version accompagnée de son auteur (préchargé par get_versions_async)"""
+    uploader: Optional[UserSummaryOut] = None
+
+def _serialize_version(version) -> Dict[str, Any]:
+    """Représentation JSON d'une version, pour les réponses unitaires"""
+    return VersionOut.model_validate(version).model_dump(mode="json")
+
+def _json_response(model: BaseModel) -> Response:
+    """Sérialise directement un modèle Pydantic (pydantic-core), sans passer par jsonable_encoder"""
+    return Response(content=model.model_dump_json(), media_type="application/json")
+
 @router.get("/{document_id}/versions")
 async def get_document_versions(
     document_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Récupère toutes les versions d'un document"""
+    """
+    Récupère toutes les versions d'un document
+    
+    La réponse est envoyée en flux (chunked) au fil de la lecture des lignes : la mémoire
+    ne dépend pas de la longueur de l'historique.
+    """
     try:
         versioning_service = DocumentVersioningService(db)
-        versions = versioning_service.get_document_versions(document_id)
-        
-        # Vérifier les permissions
-        if not versioning_service.check_permission(document_id, current_user.id, "read"):
-            raise HTTPException(status_code=403, detail="Accès non autorisé")
-        
-        version_data = []
-        for version in versions:
-            version_data.append({
-                "id": version.id,
-                "version_number": version.version_number,
-                "filename": version.filename,
-                "file_type": version.file_type,
-                "file_size": version.file_size,
-                "uploaded_by": version.uploaded_by,
-                "created_at": version.created_at.isoformat(),
-                "metadata": version.metadata
-            })
-        
-        return {
-            "success": True,
-            "data": version_data,
-            "total_versions": len(version_data)
-        }
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erreur lors de la récupération des versions: {str(e)}")
+        versions = await versioning_service.stream_versions_async(document_id, current_user.id)
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    
+    return StreamingResponse(_stream_version_list(versions), media_type="application/json")
+
+async def _stream_version_list(versions) -> AsyncIterator[bytes]:
+    """Écrit {"success", "data", "total_versions"} une version à la fois"""
+    yield b'{"success":true,"data":['
+    total = 0
+    async for partition in versions.partitions():
+        chunk = b",".join(
+            VersionWithUploaderOut.model_validate(version).model_dump_json().encode()
+            for version in partition
+        )
+        yield (b"," if total else b"") + chunk
+        total += len(partition)
+    yield b'],"total_versions":' + str(total).encode() + b"}"
+
+# Le client garde la réponse mais la revalide à chaque fois (If-None-Match -> 304) : les
+# droits sont revérifiés, un partage révoqué ne laisse rien lisible depuis le cache
+VERSION_CACHE_CONTROL = "private, no-cache"
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Vérifie l'en-tête If-None-Match (liste d'ETags, faibles ou forts, ou « * »)"""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or any(tag.removeprefix("W/") == etag for tag in candidates)
 
 @router.get("/versions/{version_id}")
 async def get_version_details(
     version_id: int,
+    request: Request,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Récupère les détails d'une version spécifique"""
+    """Récupère les détails d'une version spécifique (ETag sur la représentation, 304 si inchangée)"""
     try:
         versioning_service = DocumentVersioningService(db)
-        version = versioning_service.get_version(version_id)
-        
-        if not version:
-            raise HTTPException(status_code=404, detail="Version non trouvée")
-        
-        # Vérifier les permissions
-        if not versioning_service.check_permission(version.document_id, current_user.id, "read"):
-            raise HTTPException(status_code=403, detail="Accès non autorisé")
-        
-        return {
-            "success": True,
-            "data": {
-                "id": version.id,
-                "document_id": version.document_id,
-                "version_number": version.version_number,
-                "filename": version.filename,
-                "file_type": version.file_type,
-                "file_size": version.file_size,
-                "file_hash": version.file_hash,
-                "uploaded_by": version.uploaded_by,
-                "created_at": version.created_at.isoformat(),
-                "metadata": version.metadata
-            }
-        }
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erreur lors de la récupération de la version: {str(e)}")
+        version = await versioning_service.get_version_async(version_id, current_user.id)
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    
+    if not version:
+        raise HTTPException(status_code=404, detail="Version non trouvée")
+    
+    # ETag sur la représentation complète (métadonnées comprises), pas seulement sur
+    # le hash du fichier ; les droits sont vérifiés à chaque appel, seul le corps est évité
+    data = VersionOut.model_validate(version).model_dump_json()
+    etag = f'"{hashlib.blake2b(data.encode(), digest_size=16).hexdigest()}"'
+    cache_headers = {"ETag": etag, "Cache-Control": VERSION_CACHE_CONTROL}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=cache_headers)
+    
+    return Response(
+        content='{"success":true,"data":' + data + '}',
+        media_type="application/json",
+        headers=cache_headers
+    )
 
 @router.post("/{document_id}/versions")
 async def create_new_version(
     document_id: int,
     file: UploadFile = File(...),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Crée une nouvelle version d'un document"""
     try:
-        # Vérifier les permissions
         versioning_service = DocumentVersioningService(db)
-        if not versioning_service.check_permission(document_id, current_user.id, "write"):
-            raise HTTPException(status_code=403, detail="Accès non autorisé")
         
-        # Lire le contenu du fichier
-        file_content = await file.read()
-        
-        # Créer la nouvelle version
-        new_version = versioning_service.create_version(
+        # Créer la nouvelle version (vérifie que l'utilisateur possède le document) ;
+        # le fichier déjà reçu (SpooledTemporaryFile) est haché dans un thread
+        new_version = await versioning_service.create_version_async(
             document_id=document_id,
-            file_content=file_content,
+            user_id=current_user.id,
             filename=file.filename,
             file_type=file.filename.split('.')[-1] if '.' in file.filename else 'unknown',
-            user_id=current_user.id
+            file_obj=file.file
         )
         
         return {
@@ -129,67 +224,76 @@ async def create_new_version(
             "message": f"Nouvelle version {new_version.version_number} créée"
         }
         
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erreur lors de la création de la version: {str(e)}")
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
 
 @router.get("/versions/{version1_id}/compare/{version2_id}")
 async def compare_versions(
     version1_id: int,
     version2_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Compare deux versions d'un document"""
     try:
         versioning_service = DocumentVersioningService(db)
-        comparison = versioning_service.compare_versions(version1_id, version2_id)
-        
-        if "error" in comparison:
-            raise HTTPException(status_code=404, detail=comparison["error"])
+        comparison = await versioning_service.compare_versions_async(version1_id, version2_id, current_user.id)
         
         return {
             "success": True,
             "data": comparison
         }
         
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erreur lors de la comparaison: {str(e)}")
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
 
 @router.post("/versions/{version_id}/restore")
 async def restore_version(
     version_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Restaure une version précédente"""
     try:
         versioning_service = DocumentVersioningService(db)
-        version = versioning_service.get_version(version_id)
-        
-        if not version:
-            raise HTTPException(status_code=404, detail="Version non trouvée")
-        
-        # Vérifier les permissions
-        if not versioning_service.check_permission(version.document_id, current_user.id, "write"):
-            raise HTTPException(status_code=403, detail="Accès non autorisé")
-        
-        success = versioning_service.restore_version(version_id, current_user.id)
+        new_version = await versioning_service.restore_version_async(version_id, current_user.id)
         
-        if success:
-            return {
-                "success": True,
-                "message": f"Version {version.version_number} restaurée avec succès"
-            }
-        else:
-            raise HTTPException(status_code=400, detail="Impossible de restaurer la version")
+        return {
+            "success": True,
+            "message": f"Version restaurée avec succès (nouvelle version {new_version.version_number})",
+            "data": _serialize_version(new_version)
+        }
         
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erreur lors de la restauration: {str(e)}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 # ==================== ANNOTATIONS ====================
 
+class AnnotationOut(BaseModel):
+    """Représentation JSON d'une annotation"""
+    model_config = ConfigDict(from_attributes=True)
+    
+    id: int
+    content: str
+    annotation_type: Optional[str] = None
+    position: Optional[str] = None
+    position_page: Optional[int] = None
+    position_x: Optional[float] = None
+    position_y: Optional[float] = None
+    user_id: int
+    user: Optional[UserSummaryOut] = None
+    created_at: datetime
+    updated_at: Optional[datetime] = None
+
+class AnnotationListResponse(BaseModel):
+    """Liste des annotations d'un document"""
+    success: bool = True
+    data: List[AnnotationOut]
+    total_annotations: int
+    next_cursor: Optional[str] = None
+
 @router.post("/{document_id}/annotations")
-async def create_annotation(
+def create_annotation(
     document_id: int,
     content: str = Form(...),
     annotation_type: str = Form("note"),
@@ -198,80 +302,64 @@ async def create_annotation(
     db: Session = Depends(get_db)
 ):
     """Crée une nouvelle annotation sur un document"""
+    annotation_service = DocumentAnnotationService(db)
+    
+    # Vérifier les permissions
+    if not DocumentSharingService(db).check_permission(document_id, current_user.id, "comment"):
+        raise HTTPException(status_code=403, detail="Accès non autorisé")
+    
+    # Parser la position JSON
     try:
-        annotation_service = DocumentAnnotationService(db)
-        
-        # Vérifier les permissions
-        if not annotation_service.check_permission(document_id, current_user.id, "comment"):
-            raise HTTPException(status_code=403, detail="Accès non autorisé")
-        
-        # Parser la position JSON
-        try:
-            position_data = json.loads(position)
-        except json.JSONDecodeError:
-            position_data = {}
-        
-        annotation = annotation_service.create_annotation(
-            document_id=document_id,
-            user_id=current_user.id,
-            content=content,
-            annotation_type=annotation_type,
-            position=position_data
-        )
-        
-        return {
-            "success": True,
-            "data": {
-                "id": annotation.id,
-                "content": annotation.content,
-                "annotation_type": annotation.annotation_type,
-                "created_at": annotation.created_at.isoformat()
-            },
-            "message": "Annotation créée avec succès"
-        }
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erreur lors de la création de l'annotation: {str(e)}")
+        position_data = _loads(position)
+    except json.JSONDecodeError:
+        position_data = {}
+    
+    annotation = annotation_service.create_annotation(
+        document_id=document_id,
+        user_id=current_user.id,
+        content=content,
+        annotation_type=annotation_type,
+        position=position_data
+    )
+    
+    return {
+        "success": True,
+        "data": {
+            "id": annotation.id,
+            "content": annotation.content,
+            "annotation_type": annotation.annotation_type,
+            "created_at": annotation.created_at.isoformat()
+        },
+        "message": "Annotation créée avec succès"
+    }
 
 @router.get("/{document_id}/annotations")
-async def get_document_annotations(
+def get_document_annotations(
     document_id: int,
+    page: Optional[int] = Query(None, description="Ne retourner que les annotations de cette page du document"),
+    cursor: Optional[str] = Query(None, description="Curseur de la page suivante"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=1000),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Récupère toutes les annotations d'un document"""
-    try:
-        annotation_service = DocumentAnnotationService(db)
-        
-        # Vérifier les permissions
-        if not annotation_service.check_permission(document_id, current_user.id, "read"):
-            raise HTTPException(status_code=403, detail="Accès non autorisé")
-        
-        annotations = annotation_service.get_document_annotations(document_id)
-        
-        annotation_data = []
-        for annotation in annotations:
-            annotation_data.append({
-                "id": annotation.id,
-                "content": annotation.content,
-                "annotation_type": annotation.annotation_type,
-                "position": annotation.position,
-                "user_id": annotation.user_id,
-                "created_at": annotation.created_at.isoformat(),
-                "updated_at": annotation.updated_at.isoformat() if annotation.updated_at else None
-            })
-        
-        return {
-            "success": True,
-            "data": annotation_data,
-            "total_annotations": len(annotation_data)
-        }
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erreur lors de la récupération des annotations: {str(e)}")
+    """Récupère une page des annotations d'un document (paginée par curseur)"""
+    annotation_service = DocumentAnnotationService(db)
+    
+    # Vérifier les permissions
+    if not DocumentSharingService(db).check_permission(document_id, current_user.id, "read"):
+        raise HTTPException(status_code=403, detail="Accès non autorisé")
+    
+    # Auteurs préchargés avec les annotations (une requête IN, pas de N+1)
+    annotations, next_cursor = annotation_service.get_document_annotations(
+        document_id, current_user.id, cursor=decode_cursor(cursor), limit=limit, page=page
+    )
+    
+    return _json_response(AnnotationListResponse(
+        data=annotations, total_annotations=len(annotations), next_cursor=encode_cursor(next_cursor)
+    ))
 
 @router.put("/annotations/{annotation_id}")
-async def update_annotation(
+def update_annotation(
     annotation_id: int,
     content: str = Form(...),
     annotation_type: str = Form("note"),
@@ -279,54 +367,46 @@ async def update_annotation(
     db: Session = Depends(get_db)
 ):
     """Met à jour une annotation"""
-    try:
-        annotation_service = DocumentAnnotationService(db)
-        
-        success = annotation_service.update_annotation(
-            annotation_id=annotation_id,
-            user_id=current_user.id,
-            content=content,
-            annotation_type=annotation_type
-        )
-        
-        if success:
-            return {
-                "success": True,
-                "message": "Annotation mise à jour avec succès"
-            }
-        else:
-            raise HTTPException(status_code=403, detail="Impossible de modifier cette annotation")
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erreur lors de la mise à jour: {str(e)}")
+    annotation_service = DocumentAnnotationService(db)
+    
+    success = annotation_service.update_annotation(
+        annotation_id=annotation_id,
+        user_id=current_user.id,
+        content=content,
+        annotation_type=annotation_type
+    )
+    
+    if success:
+        return {
+            "success": True,
+            "message": "Annotation mise à jour avec succès"
+        }
+    else:
+        raise HTTPException(status_code=403, detail="Impossible de modifier cette annotation")
 
 @router.delete("/annotations/{annotation_id}")
-async def delete_annotation(
+def delete_annotation(
     annotation_id: int,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Supprime une annotation"""
-    try:
-        annotation_service = DocumentAnnotationService(db)
-        
-        success = annotation_service.delete_annotation(annotation_id, current_user.id)
-        
-        if success:
-            return {
-                "success": True,
-                "message": "Annotation supprimée avec succès"
-            }
-        else:
-            raise HTTPException(status_code=403, detail="Impossible de supprimer cette annotation")
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erreur lors de la suppression: {str(e)}")
+    annotation_service = DocumentAnnotationService(db)
+    
+    success = annotation_service.delete_annotation(annotation_id, current_user.id)
+    
+    if success:
+        return {
+            "success": True,
+            "message": "Annotation supprimée avec succès"
+        }
+    else:
+        raise HTTPException(status_code=403, detail="Impossible de supprimer cette annotation")
 
 # ==================== TAGS ====================
 
 @router.post("/tags")
-async def create_tag(
+def create_tag(
     name: str = Form(...),
     color: str = Form("#3B82F6"),
     description: str = Form(None),
@@ -334,113 +414,166 @@ async def create_tag(
     db: Session = Depends(get_db)
 ):
     """Crée un nouveau tag"""
-    try:
-        tag_service = DocumentTagService(db)
-        tag = tag_service.create_tag(name=name, color=color, description=description)
-        
-        return {
-            "success": True,
-            "data": {
-                "id": tag.id,
-                "name": tag.name,
-                "color": tag.color,
-                "description": tag.description
-            },
-            "message": f"Tag '{name}' créé avec succès"
-        }
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erreur lors de la création du tag: {str(e)}")
+    tag_service = DocumentTagService(db)
+    tag = tag_service.create_tag(name=name, color=color, description=description)
+    
+    return {
+        "success": True,
+        "data": {
+            "id": tag.id,
+            "name": tag.name,
+            "color": tag.color,
+            "description": tag.description
+        },
+        "message": f"Tag '{name}' créé avec succès"
+    }
 
 @router.get("/tags")
-async def get_all_tags(
+def get_all_tags(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Récupère tous les tags"""
-    try:
-        tag_service = DocumentTagService(db)
-        tags = tag_service.get_all_tags()
-        
-        tag_data = []
-        for tag in tags:
-            tag_data.append({
-                "id": tag.id,
-                "name": tag.name,
-                "color": tag.color,
-                "description": tag.description,
-                "created_at": tag.created_at.isoformat()
-            })
-        
-        return {
-            "success": True,
-            "data": tag_data,
-            "total_tags": len(tag_data)
-        }
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erreur lors de la récupération des tags: {str(e)}")
+    """Récupère tous les tags (tableau JSON en cache, réutilisé tel quel)"""
+    total_tags, tag_json = DocumentTagService(db).get_all_tags_json()
+    
+    return Response(
+        content=b'{"success":true,"data":' + tag_json + b',"total_tags":' + str(total_tags).encode() + b"}",
+        media_type="application/json"
+    )
+
+# Déclarées avant /{document_id}/tags/{tag_id} : « bulk » n'est pas un ID de tag
+@router.post("/{document_id}/tags/bulk")
+def add_tags_to_document(
+    document_id: int,
+    tag_ids: List[int] = Body(..., embed=True, min_length=1),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Ajoute plusieurs tags à un document (une vérification de permission, une insertion)"""
+    if not DocumentSharingService(db).check_permission(document_id, current_user.id, "write"):
+        raise HTTPException(status_code=403, detail="Accès non autorisé")
+    
+    added = DocumentTagService(db).add_tags_to_document(document_id, tag_ids)
+    
+    return {
+        "success": True,
+        "added": added,
+        "message": f"{added} tag(s) ajouté(s) au document"
+    }
+
+@router.delete("/{document_id}/tags/bulk")
+def remove_tags_from_document(
+    document_id: int,
+    tag_ids: List[int] = Body(..., embed=True, min_length=1),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Retire plusieurs tags d'un document (une vérification de permission, une suppression)"""
+    if not DocumentSharingService(db).check_permission(document_id, current_user.id, "write"):
+        raise HTTPException(status_code=403, detail="Accès non autorisé")
+    
+    removed = DocumentTagService(db).remove_tags_from_document(document_id, tag_ids)
+    
+    return {
+        "success": True,
+        "removed": removed,
+        "message": f"{removed} tag(s) retiré(s) du document"
+    }
 
 @router.post("/{document_id}/tags/{tag_id}")
-async def add_tag_to_document(
+def add_tag_to_document(
     document_id: int,
     tag_id: int,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Ajoute un tag à un document"""
-    try:
-        tag_service = DocumentTagService(db)
-        
-        # Vérifier les permissions
-        if not tag_service.check_permission(document_id, current_user.id, "write"):
-            raise HTTPException(status_code=403, detail="Accès non autorisé")
-        
-        success = tag_service.add_tag_to_document(document_id, tag_id)
-        
-        if success:
-            return {
-                "success": True,
-                "message": "Tag ajouté au document avec succès"
-            }
-        else:
-            raise HTTPException(status_code=400, detail="Impossible d'ajouter le tag")
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erreur lors de l'ajout du tag: {str(e)}")
+    tag_service = DocumentTagService(db)
+    
+    # Vérifier les permissions
+    if not DocumentSharingService(db).check_permission(document_id, current_user.id, "write"):
+        raise HTTPException(status_code=403, detail="Accès non autorisé")
+    
+    success = tag_service.add_tag_to_document(document_id, tag_id)
+    
+    if success:
+        return {
+            "success": True,
+            "message": "Tag ajouté au document avec succès"
+        }
+    else:
+        raise HTTPException(status_code=400, detail="Impossible d'ajouter le tag")
 
 @router.delete("/{document_id}/tags/{tag_id}")
-async def remove_tag_from_document(
+def remove_tag_from_document(
     document_id: int,
     tag_id: int,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Retire un tag d'un document"""
-    try:
-        tag_service = DocumentTagService(db)
-        
-        # Vérifier les permissions
-        if not tag_service.check_permission(document_id, current_user.id, "write"):
-            raise HTTPException(status_code=403, detail="Accès non autorisé")
-        
-        success = tag_service.remove_tag_from_document(document_id, tag_id)
-        
-        if success:
-            return {
-                "success": True,
-                "message": "Tag retiré du document avec succès"
-            }
-        else:
-            raise HTTPException(status_code=400, detail="Impossible de retirer le tag")
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erreur lors du retrait du tag: {str(e)}")
+    tag_service = DocumentTagService(db)
+    
+    # Vérifier les permissions
+    if not DocumentSharingService(db).check_permission(document_id, current_user.id, "write"):
+        raise HTTPException(status_code=403, detail="Accès non autorisé")
+    
+    success = tag_service.remove_tag_from_document(document_id, tag_id)
+    
+    if success:
+        return {
+            "success": True,
+            "message": "Tag retiré du document avec succès"
+        }
+    else:
+        raise HTTPException(status_code=400, detail="Impossible de retirer le tag")
 
 # ==================== PARTAGE ====================
 
+# Champs « permissions » les plus fréquents, déjà parsés
+_COMMON_PERMISSIONS = {
+    '["read"]': ("read",),
+    '["read","write"]': ("read", "write"),
+    '["read", "write"]': ("read", "write"),
+    '["read","comment"]': ("read", "comment"),
+    '["read", "comment"]': ("read", "comment"),
+}
+
+class SharedDocumentOut(BaseModel):
+    """Document concerné par un partage"""
+    id: int
+    filename: str
+    file_type: Optional[str] = None
+    file_size: Optional[int] = None
+    upload_date: Optional[datetime] = None
+
+class ShareUserOut(BaseModel):
+    """Destinataire (ou auteur) d'un partage"""
+    id: int
+    email: str
+    username: str
+    full_name: Optional[str] = None
+
+class ShareOut(BaseModel):
+    """Représentation JSON d'un partage (format de DocumentSharingService.get_shared_documents)"""
+    share_id: int
+    document: SharedDocumentOut
+    user: Optional[ShareUserOut] = None
+    permissions: Any
+    expires_at: Optional[datetime] = None
+    message: Optional[str] = None
+    created_at: datetime
+    is_expired: bool
+
+class ShareListResponse(BaseModel):
+    """Liste des partages"""
+    success: bool = True
+    data: List[ShareOut]
+    total_shares: int
+    next_cursor: Optional[str] = None
+
 @router.post("/{document_id}/share")
-async def share_document(
+def share_document(
     document_id: int,
     shared_with_id: int = Form(...),
     permissions: str = Form('["read"]'),
@@ -453,17 +586,21 @@ async def share_document(
     try:
         sharing_service = DocumentSharingService(db)
         
-        # Parser les permissions JSON
-        try:
-            permissions_list = json.loads(permissions)
-        except json.JSONDecodeError:
-            permissions_list = ["read"]
+        # Parser les permissions JSON (valeurs usuelles servies sans parsing)
+        permissions_list = _COMMON_PERMISSIONS.get(permissions)
+        if permissions_list is None:
+            try:
+                permissions_list = _loads(permissions)
+            except json.JSONDecodeError:
+                permissions_list = ["read"]
+        else:
+            permissions_list = list(permissions_list)
         
         # Parser la date d'expiration
         expires_date = None
         if expires_at:
             try:
-                expires_date = datetime.fromisoformat(expires_at.replace('Z', '+00:00'))
+                expires_date = _parse_datetime(expires_at)
             except ValueError:
                 raise HTTPException(status_code=400, detail="Format de date invalide")
         
@@ -492,65 +629,93 @@ async def share_document(
         
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erreur lors du partage: {str(e)}")
 
 @router.get("/shared")
-async def get_shared_documents(
+def get_shared_documents(
     as_owner: bool = Query(False, description="Récupérer les documents partagés par l'utilisateur"),
+    cursor: Optional[str] = Query(None, description="Curseur de la page suivante"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=1000),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Récupère les documents partagés"""
-    try:
-        sharing_service = DocumentSharingService(db)
-        shares = sharing_service.get_shared_documents(current_user.id, as_owner=as_owner)
-        
-        share_data = []
-        for share in shares:
-            share_data.append({
-                "id": share.id,
-                "document_id": share.document_id,
-                "owner_id": share.owner_id,
-                "shared_with": share.shared_with,
-                "permissions": share.permissions,
-                "expires_at": share.expires_at.isoformat() if share.expires_at else None,
-                "message": share.message,
-                "created_at": share.created_at.isoformat(),
-                "is_expired": share.expires_at and share.expires_at < datetime.utcnow()
-            })
-        
-        return {
-            "success": True,
-            "data": share_data,
-            "total_shares": len(share_data)
-        }
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erreur lors de la récupération des partages: {str(e)}")
+    """Récupère une page des documents partagés"""
+    sharing_service = DocumentSharingService(db)
+    shares, next_cursor = sharing_service.get_shared_documents(
+        current_user.id, as_owner=as_owner, cursor=decode_cursor(cursor), limit=limit
+    )
+    
+    return _json_response(ShareListResponse(
+        data=shares, total_shares=len(shares), next_cursor=encode_cursor(next_cursor)
+    ))
 
 @router.delete("/shares/{share_id}")
-async def revoke_share(
+def revoke_share(
     share_id: int,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Révoque un partage de document"""
+    sharing_service = DocumentSharingService(db)
+    
+    success = sharing_service.revoke_share(share_id, current_user.id)
+    
+    if success:
+        return {
+            "success": True,
+            "message": "Partage révoqué avec succès"
+        }
+    else:
+        raise HTTPException(status_code=403, detail="Impossible de révoquer ce partage")
+
+# ==================== RÉSUMÉ ====================
+
+class DocumentSummaryResponse(BaseModel):
+    """Vue agrégée d'un document : versions, annotations, tags, partages et statistiques"""
+    success: bool = True
+    versions: List[VersionWithUploaderOut]
+    version_stats: Dict[str, Any]
+    annotations: List[AnnotationOut]
+    # Première page des annotations ; la suite via /{document_id}/annotations?cursor=
+    annotations_next_cursor: Optional[str] = None
+    tags: List[Dict[str, Any]]
+    shares: List[Dict[str, Any]]
+
+@router.get("/{document_id}/summary")
+async def get_document_summary(
+    document_id: int,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+    sync_db: Session = Depends(get_db)
+):
+    """
+    Récupère en un seul appel ce qu'affiche la page d'un document
+    
+    Les versions passent par la session asynchrone pendant que annotations, tags et
+    partages sont lus en parallèle dans le threadpool (session synchrone distincte).
+    """
+    def load_document_data():
+        annotations = DocumentAnnotationService(sync_db).get_document_annotations(document_id, current_user.id)
+        tags = DocumentTagService(sync_db).get_document_tags(document_id)
+        shares = DocumentSharingService(sync_db).get_document_shares(document_id, current_user.id)
+        return annotations, tags, shares
+    
     try:
-        sharing_service = DocumentSharingService(db)
-        
-        success = sharing_service.revoke_share(share_id, current_user.id)
-        
-        if success:
-            return {
-                "success": True,
-                "message": "Partage révoqué avec succès"
-            }
-        else:
-            raise HTTPException(status_code=403, detail="Impossible de révoquer ce partage")
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erreur lors de la révocation: {str(e)}")
+        # Les deux lectures vérifient que l'utilisateur possède le document
+        versions, ((annotations, next_cursor), tags, shares) = await asyncio.gather(
+            DocumentVersioningService(db).get_versions_async(document_id, current_user.id),
+            run_in_threadpool(load_document_data)
+        )
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    
+    return _json_response(DocumentSummaryResponse(
+        versions=versions,
+        version_stats=DocumentVersioningService.summarize_versions(versions),
+        annotations=annotations,
+        annotations_next_cursor=encode_cursor(next_cursor),
+        tags=tags,
+        shares=shares
+    ))
 
 # ==================== STATISTIQUES ====================
 
@@ -558,67 +723,52 @@ async def revoke_share(
 async def get_version_statistics(
     document_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Récupère les statistiques des versions d'un document"""
     try:
         versioning_service = DocumentVersioningService(db)
-        
-        # Vérifier les permissions
-        if not versioning_service.check_permission(document_id, current_user.id, "read"):
-            raise HTTPException(status_code=403, detail="Accès non autorisé")
-        
-        stats = versioning_service.get_version_statistics(document_id)
-        
-        if "error" in stats:
-            raise HTTPException(status_code=404, detail=stats["error"])
+        stats = await versioning_service.get_version_statistics_async(document_id, current_user.id)
         
         return {
             "success": True,
             "data": stats
         }
         
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erreur lors de la récupération des statistiques: {str(e)}")
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
 
 @router.get("/tag-statistics")
-async def get_tag_statistics(
+def get_tag_statistics(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Récupère les statistiques des tags"""
-    try:
-        tag_service = DocumentTagService(db)
-        stats = tag_service.get_tag_statistics()
-        
-        if "error" in stats:
-            raise HTTPException(status_code=500, detail=stats["error"])
-        
-        return {
-            "success": True,
-            "data": stats
-        }
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erreur lors de la récupération des statistiques: {str(e)}")
+    tag_service = DocumentTagService(db)
+    stats = tag_service.get_tag_statistics()
+    
+    if "error" in stats:
+        raise HTTPException(status_code=500, detail=stats["error"])
+    
+    return {
+        "success": True,
+        "data": stats
+    }
 
 @router.get("/share-statistics")
-async def get_share_statistics(
+def get_share_statistics(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Récupère les statistiques de partage"""
-    try:
-        sharing_service = DocumentSharingService(db)
-        stats = sharing_service.get_share_statistics(current_user.id)
-        
-        if "error" in stats:
-            raise HTTPException(status_code=500, detail=stats["error"])
-        
-        return {
-            "success": True,
-            "data": stats
-        }
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erreur lors de la récupération des statistiques: {str(e)}") 
\ No newline at end of file
+    sharing_service = DocumentSharingService(db)
+    stats = sharing_service.get_share_statistics(current_user.id)
+    
+    if "error" in stats:
+        raise HTTPException(status_code=500, detail=stats["error"])
+    
+    return {
+        "success": True,
+        "data": stats
+    }
+    
\ No newline at end of file
@@ -4,22 +4,92 @@ Service de partage de documents pour DocSearch AI
 Gère le partage de documents entre utilisateurs avec permissions et expiration
 """
 
+import json
 import logging
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_, desc, func
+from sqlalchemy import and_, or_, desc, func, select, lambda_stmt, case, literal, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
-from models import Document, DocumentShare, User
+from models import Document, DocumentShare, User, utcnow, SHARE_PERMISSION_BITS, permissions_to_mask
 from auth import get_current_user
+from document_annotations import query_cache, DEFAULT_PAGE_SIZE
 
 logger = logging.getLogger(__name__)
 
+# Partages expirés désactivés par transaction dans cleanup_expired_shares
+SHARE_CLEANUP_BATCH_SIZE = 10_000
+
+def _permission_namespace(document_id: int) -> tuple:
+    """Espace du cache des permissions d'un document (invalidé à chaque modification de partage)"""
+    return ("permissions", document_id)
+
+def _dialect_insert(session: Session):
+    """insert() du dialecte de la session (seuls SQLite et PostgreSQL offrent ON CONFLICT ici)"""
+    return sqlite_insert if session.get_bind().dialect.name == "sqlite" else pg_insert
+
+# Colonnes lues par get_shared_documents : seules celles qui sont sérialisées
+_SHARED_DOCUMENT_COLUMNS = (
+    DocumentShare.id.label("share_id"),
+    DocumentShare.permissions,
+    DocumentShare.expires_at,
+    DocumentShare.message,
+    DocumentShare.created_at,
+    Document.id.label("document_id"),
+    Document.filename,
+    Document.file_type,
+    Document.file_size,
+    Document.created_at.label("upload_date"),
+    User.id.label("user_id"),
+    User.email,
+    User.username,
+    User.full_name,
+)
+
+# Curseur de pagination : (created_at, id) du dernier partage d'une page
+ShareCursor = Tuple[datetime, int]
+
+def _serialize_shared_document(row) -> Dict[str, Any]:
+    """Représentation JSON d'une ligne de _SHARED_DOCUMENT_COLUMNS (+ is_expired)"""
+    return {
+        "share_id": row.share_id,
+        "document": {
+            "id": row.document_id,
+            "filename": row.filename,
+            "file_type": row.file_type,
+            "file_size": row.file_size,
+            "upload_date": row.upload_date.isoformat() if row.upload_date else None
+        },
+        "user": {
+            "id": row.user_id,
+            "email": row.email,
+            "username": row.username,
+            "full_name": row.full_name
+        } if row.user_id is not None else None,
+        "permissions": row.permissions,
+        "expires_at": row.expires_at.isoformat() if row.expires_at else None,
+        "message": row.message,
+        "created_at": row.created_at.isoformat(),
+        "is_expired": bool(row.is_expired)
+    }
+
 class DocumentSharingService:
     """Service de gestion du partage de documents"""
     
+    # Instancié à chaque requête : pas de __dict__, seuls la session et le mémo des permissions sont portés
+    __slots__ = ("db", "_permission_cache")
+    
     def __init__(self, db: Session):
         self.db = db
+        # Mémo des vérifications de la requête en cours : (document, utilisateur, permission) -> bool
+        self._permission_cache: Dict[tuple, bool] = {}
+    
+    def _invalidate_permissions(self, document_id: int) -> None:
+        """Invalide les permissions mises en cache pour un document (processus et requête)"""
+        query_cache.invalidate(_permission_namespace(document_id))
+        self._permission_cache.clear()
     
     def share_document(self, document_id: int, owner_id: int, shared_with_email: str,
                       permissions: List[str] = None, expires_at: datetime = None,
@@ -39,67 +109,32 @@ class DocumentSharingService:
             DocumentShare créé
         """
         try:
-            # Vérifier que le document appartient à l'utilisateur
-            document = self.db.query(Document).filter(
-                and_(Document.id == document_id, Document.user_id == owner_id)
-            ).first()
-            
-            if not document:
-                raise ValueError("Document non trouvé ou accès non autorisé")
-            
-            # Trouver l'utilisateur avec qui partager
-            shared_with_user = self.db.query(User).filter(
+            # Document de l'utilisateur et destinataire résolus en une seule requête ;
+            # la requête de diagnostic ne part que si l'un des deux manque
+            row = self.db.query(User.id).filter(
                 User.email == shared_with_email
+            ).join(
+                Document, and_(Document.id == document_id, Document.user_id == owner_id)
             ).first()
             
-            if not shared_with_user:
+            if row is None:
+                owns_document = self.db.query(Document.id).filter(
+                    and_(Document.id == document_id, Document.user_id == owner_id)
+                ).first() is not None
+                if not owns_document:
+                    raise PermissionError("Document non trouvé ou accès non autorisé")
                 raise ValueError(f"Utilisateur avec l'email {shared_with_email} non trouvé")
             
-            if shared_with_user.id == owner_id:
-                raise ValueError("Impossible de partager un document avec soi-même")
+            shared_with_id = row.id
             
-            # Vérifier si le partage existe déjà
-            existing_share = self.db.query(DocumentShare).filter(
-                and_(
-                    DocumentShare.document_id == document_id,
-                    DocumentShare.shared_with == shared_with_user.id,
-                    DocumentShare.is_active == True
-                )
-            ).first()
+            if shared_with_id == owner_id:
+                raise ValueError("Impossible de partager un document avec soi-même")
             
-            if existing_share:
-                # Mettre à jour le partage existant
-                if permissions:
-                    existing_share.permissions = permissions
-                if expires_at:
-                    existing_share.expires_at = expires_at
-                if message:
-                    existing_share.message = message
-                
-                existing_share.updated_at = datetime.now()
-                self.db.commit()
-                self.db.refresh(existing_share)
-                
-                logger.info(f"Partage mis à jour pour le document {document_id}")
-                return existing_share
-            
-            # Créer un nouveau partage
-            default_permissions = permissions or ["read"]
-            
-            share = DocumentShare(
-                document_id=document_id,
-                shared_by=owner_id,
-                shared_with=shared_with_user.id,
-                permissions=default_permissions,
-                expires_at=expires_at,
-                message=message,
-                created_at=datetime.now(),
-                is_active=True
+            share, = self._upsert_shares(
+                document_id, owner_id, [shared_with_id], permissions, expires_at, message
             )
-            
-            self.db.add(share)
             self.db.commit()
-            self.db.refresh(share)
+            self._invalidate_permissions(document_id)
             
             logger.info(f"Document {document_id} partagé avec {shared_with_email}")
             return share
@@ -109,87 +144,239 @@ class DocumentSharingService:
             self.db.rollback()
             raise
     
-    def get_shared_documents(self, user_id: int, as_owner: bool = False) -> List[Dict[str, Any]]:
+    def share_document_bulk(self, document_id: int, owner_id: int, shared_with_emails: List[str],
+                            permissions: List[str] = None, expires_at: datetime = None,
+                            message: str = None) -> List[DocumentShare]:
         """
-        Récupère les documents partagés avec un utilisateur ou par un utilisateur
+        Partage un document avec plusieurs utilisateurs en une seule transaction
+        
+        Args:
+            document_id: ID du document à partager
+            owner_id: ID du propriétaire du document
+            shared_with_emails: Emails des utilisateurs avec qui partager
+            permissions: Liste des permissions (read, write, comment, share)
+            expires_at: Date d'expiration des partages
+            message: Message optionnel pour les partages
+            
+        Returns:
+            Liste des DocumentShare créés ou mis à jour
+            
+        Raises:
+            PermissionError: Document inexistant ou n'appartenant pas à owner_id
+            ValueError: Liste vide, destinataire inconnu ou propriétaire parmi les destinataires
+        """
+        try:
+            emails = set(shared_with_emails)
+            if not emails:
+                raise ValueError("Aucun destinataire pour le partage")
+            
+            # Destinataires résolus en une requête (IN), jointe au document de l'utilisateur
+            rows = self.db.query(User.id, User.email).filter(
+                User.email.in_(emails)
+            ).join(
+                Document, and_(Document.id == document_id, Document.user_id == owner_id)
+            ).all()
+            
+            if not rows:
+                owns_document = self.db.query(Document.id).filter(
+                    and_(Document.id == document_id, Document.user_id == owner_id)
+                ).first() is not None
+                if not owns_document:
+                    raise PermissionError("Document non trouvé ou accès non autorisé")
+            
+            unknown = emails - {row.email for row in rows}
+            if unknown:
+                raise ValueError(f"Utilisateurs non trouvés: {', '.join(sorted(unknown))}")
+            
+            if any(row.id == owner_id for row in rows):
+                raise ValueError("Impossible de partager un document avec soi-même")
+            
+            shares = self._upsert_shares(
+                document_id, owner_id, [row.id for row in rows], permissions, expires_at, message
+            )
+            self.db.commit()
+            self._invalidate_permissions(document_id)
+            
+            logger.info(f"Document {document_id} partagé avec {len(shares)} utilisateurs")
+            return shares
+            
+        except Exception as e:
+            logger.error(f"Erreur lors du partage groupé du document: {e}")
+            self.db.rollback()
+            raise
+    
+    def _upsert_shares(self, document_id: int, owner_id: int, shared_with_ids: List[int],
+                       permissions: Optional[List[str]], expires_at: Optional[datetime],
+                       message: Optional[str]) -> List[DocumentShare]:
+        """
+        Crée ou met à jour les partages actifs d'un document (sans commit)
+        
+        Une seule instruction atomique INSERT ... ON CONFLICT sur l'index unique partiel
+        des partages actifs, quel que soit le nombre de destinataires : pas de SELECT
+        préalable ni de course entre deux partages simultanés. Seuls les champs fournis
+        sont mis à jour sur un partage existant.
+        """
+        granted = permissions or ["read"]
+        encoded_permissions = json.dumps(granted)
+        permissions_mask = permissions_to_mask(granted)
+        values = [
+            {
+                "document_id": document_id,
+                "owner_id": owner_id,
+                "shared_with": shared_with_id,
+                "permissions": encoded_permissions,
+                "permissions_mask": permissions_mask,
+                "expires_at": expires_at,
+                "message": message,
+                "is_active": True,
+                "created_at": utcnow(),
+                "updated_at": utcnow()
+            }
+            for shared_with_id in shared_with_ids
+        ]
+        
+        insert = _dialect_insert(self.db)
+        stmt = insert(DocumentShare).values(values)
+        updates = {"updated_at": utcnow()}
+        if permissions:
+            updates["permissions"] = stmt.excluded.permissions
+            updates["permissions_mask"] = stmt.excluded.permissions_mask
+        if expires_at:
+            updates["expires_at"] = stmt.excluded.expires_at
+        if message:
+            updates["message"] = stmt.excluded.message
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[DocumentShare.document_id, DocumentShare.shared_with],
+            index_where=DocumentShare.is_active == True,
+            set_=updates
+        ).returning(DocumentShare)
+        
+        shares = self.db.scalars(stmt).all()
+        # Détachés avant le commit : les lignes renvoyées par RETURNING restent lisibles
+        # sans nouveau SELECT
+        for share in shares:
+            self.db.expunge(share)
+        return shares
+    
+    def get_shared_documents(self, user_id: int, as_owner: bool = False,
+                             cursor: Optional[ShareCursor] = None,
+                             limit: int = DEFAULT_PAGE_SIZE) -> Tuple[List[Dict[str, Any]], Optional[ShareCursor]]:
+        """
+        Récupère une page des documents partagés avec un utilisateur ou par un utilisateur
+        (plus récents d'abord)
         
         Args:
             user_id: ID de l'utilisateur
             as_owner: True pour récupérer les documents partagés par l'utilisateur,
                      False pour récupérer les documents partagés avec l'utilisateur
+            cursor: Curseur retourné par la page précédente (optionnel)
+            limit: Taille de la page
             
         Returns:
-            Liste des documents partagés avec leurs informations
+            (documents partagés avec leurs informations, curseur de la page suivante ou None)
         """
-        try:
-            if as_owner:
-                # Documents partagés par l'utilisateur
-                shares = self.db.query(DocumentShare).filter(
-                    and_(
-                        DocumentShare.shared_by == user_id,
-                        DocumentShare.is_active == True
-                    )
-                ).order_by(desc(DocumentShare.created_at)).all()
-            else:
-                # Documents partagés avec l'utilisateur
-                shares = self.db.query(DocumentShare).filter(
-                    and_(
-                        DocumentShare.shared_with == user_id,
-                        DocumentShare.is_active == True,
-                        or_(
-                            DocumentShare.expires_at.is_(None),
-                            DocumentShare.expires_at > datetime.now()
-                        )
+        now = datetime.utcnow()
+        # Expiration calculée par la base pour la vue propriétaire ; côté destinataire
+        # les partages expirés sont filtrés, l'indicateur est donc toujours faux
+        if as_owner:
+            is_expired = case(
+                (DocumentShare.expires_at < now, True), else_=False
+            ).label("is_expired")
+        else:
+            is_expired = literal(False).label("is_expired")
+        
+        # Colonnes du partage, du document et de l'interlocuteur (destinataire pour le
+        # propriétaire, propriétaire pour le destinataire) en une seule requête, sans
+        # hydratation d'objets ORM ; la jointure interne sur le document écarte les
+        # partages de documents supprimés
+        counterpart_id = DocumentShare.shared_with if as_owner else DocumentShare.owner_id
+        query = self.db.query(*_SHARED_DOCUMENT_COLUMNS, is_expired).join(
+            Document, Document.id == DocumentShare.document_id
+        ).outerjoin(User, User.id == counterpart_id)
+        
+        if as_owner:
+            # Documents partagés par l'utilisateur
+            query = query.filter(
+                and_(
+                    DocumentShare.owner_id == user_id,
+                    DocumentShare.is_active == True
+                )
+            )
+        else:
+            # Documents partagés avec l'utilisateur (les partages expirés sont exclus)
+            query = query.filter(
+                and_(
+                    DocumentShare.shared_with == user_id,
+                    DocumentShare.is_active == True,
+                    or_(
+                        DocumentShare.expires_at.is_(None),
+                        DocumentShare.expires_at > now
                     )
-                ).order_by(desc(DocumentShare.created_at)).all()
-            
-            shared_docs = []
-            for share in shares:
-                # Récupérer les informations du document
-                document = self.db.query(Document).filter(Document.id == share.document_id).first()
-                if not document:
-                    continue
-                
-                # Récupérer les informations de l'utilisateur
-                if as_owner:
-                    user = self.db.query(User).filter(User.id == share.shared_with).first()
-                    user_info = {
-                        "id": user.id,
-                        "email": user.email,
-                        "username": user.username,
-                        "full_name": user.full_name
-                    } if user else None
-                else:
-                    user = self.db.query(User).filter(User.id == share.shared_by).first()
-                    user_info = {
-                        "id": user.id,
-                        "email": user.email,
-                        "username": user.username,
-                        "full_name": user.full_name
-                    } if user else None
-                
-                shared_docs.append({
-                    "share_id": share.id,
-                    "document": {
-                        "id": document.id,
-                        "filename": document.filename,
-                        "file_type": document.file_type,
-                        "file_size": document.file_size,
-                        "upload_date": document.upload_date.isoformat() if document.upload_date else None
-                    },
-                    "user": user_info,
-                    "permissions": share.permissions,
-                    "expires_at": share.expires_at.isoformat() if share.expires_at else None,
-                    "message": share.message,
-                    "created_at": share.created_at.isoformat(),
-                    "is_expired": share.expires_at and share.expires_at < datetime.now()
-                })
-            
-            return shared_docs
+                )
+            )
+        
+        # Pagination par clé (created_at, id) décroissante : pas d'OFFSET, chaque page
+        # est une recherche dans l'index partiel (utilisateur, created_at)
+        if cursor is not None:
+            query = query.filter(
+                tuple_(DocumentShare.created_at, DocumentShare.id) < tuple_(*cursor)
+            )
+        
+        # Une ligne de plus pour savoir s'il existe une page suivante
+        rows = query.order_by(
+            desc(DocumentShare.created_at), desc(DocumentShare.id)
+        ).limit(limit + 1).all()
+        
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = (rows[-1].created_at, rows[-1].share_id)
+        
+        return [_serialize_shared_document(row) for row in rows], next_cursor
+    
+    def get_document_shares(self, document_id: int, owner_id: int) -> List[Dict[str, Any]]:
+        """
+        Partages actifs d'un document, vus par son propriétaire
+        
+        Args:
+            document_id: ID du document
+            owner_id: ID du propriétaire du document
             
-        except Exception as e:
-            logger.error(f"Erreur lors de la récupération des documents partagés: {e}")
-            raise
+        Returns:
+            Liste des partages (destinataire, permissions, expiration)
+        """
+        now = datetime.utcnow()
+        rows = self.db.query(
+            DocumentShare.id,
+            DocumentShare.shared_with,
+            DocumentShare.permissions,
+            DocumentShare.expires_at,
+            DocumentShare.message,
+            DocumentShare.created_at,
+            and_(
+                DocumentShare.expires_at.is_not(None),
+                DocumentShare.expires_at < now
+            ).label("is_expired")
+        ).filter(
+            and_(
+                DocumentShare.document_id == document_id,
+                DocumentShare.owner_id == owner_id,
+                DocumentShare.is_active == True
+            )
+        ).order_by(desc(DocumentShare.created_at)).all()
+        
+        return [
+            {
+                "share_id": row.id,
+                "shared_with": row.shared_with,
+                "permissions": row.permissions,
+                "expires_at": row.expires_at.isoformat() if row.expires_at else None,
+                "message": row.message,
+                "created_at": row.created_at.isoformat() if row.created_at else None,
+                "is_expired": bool(row.is_expired)
+            }
+            for row in rows
+        ]
     
     def get_share(self, share_id: int, user_id: int) -> Optional[DocumentShare]:
         """
@@ -202,23 +389,18 @@ class DocumentSharingService:
         Returns:
             DocumentShare ou None
         """
-        try:
-            share = self.db.query(DocumentShare).filter(
-                DocumentShare.id == share_id
-            ).first()
-            
-            if not share:
-                return None
-            
-            # Vérifier que l'utilisateur a accès à ce partage
-            if share.shared_by != user_id and share.shared_with != user_id:
-                raise ValueError("Accès non autorisé à ce partage")
-            
-            return share
-            
-        except Exception as e:
-            logger.error(f"Erreur lors de la récupération du partage: {e}")
-            raise
+        share = self.db.execute(
+            lambda_stmt(lambda: select(DocumentShare).where(DocumentShare.id == share_id))
+        ).scalar_one_or_none()
+        
+        if not share:
+            return None
+        
+        # Vérifier que l'utilisateur a accès à ce partage
+        if share.owner_id != user_id and share.shared_with != user_id:
+            raise PermissionError("Accès non autorisé à ce partage")
+        
+        return share
     
     def update_share_permissions(self, share_id: int, owner_id: int, 
                                 permissions: List[str]) -> DocumentShare:
@@ -237,18 +419,22 @@ class DocumentSharingService:
             share = self.db.query(DocumentShare).filter(
                 and_(
                     DocumentShare.id == share_id,
-                    DocumentShare.shared_by == owner_id
+                    DocumentShare.owner_id == owner_id
                 )
             ).first()
             
             if not share:
-                raise ValueError("Partage non trouvé ou accès non autorisé")
+                raise PermissionError("Partage non trouvé ou accès non autorisé")
             
-            share.permissions = permissions
-            share.updated_at = datetime.now()
+            share.permissions = json.dumps(permissions)
+            share.permissions_mask = permissions_to_mask(permissions)
             
+            # updated_at est fixé par la base et relu par RETURNING au flush : détaché
+            # avant le commit, pas de refresh
+            self.db.flush()
+            self.db.expunge(share)
             self.db.commit()
-            self.db.refresh(share)
+            self._invalidate_permissions(share.document_id)
             
             logger.info(f"Permissions mises à jour pour le partage {share_id}")
             return share
@@ -275,18 +461,21 @@ class DocumentSharingService:
             share = self.db.query(DocumentShare).filter(
                 and_(
                     DocumentShare.id == share_id,
-                    DocumentShare.shared_by == owner_id
+                    DocumentShare.owner_id == owner_id
                 )
             ).first()
             
             if not share:
-                raise ValueError("Partage non trouvé ou accès non autorisé")
+                raise PermissionError("Partage non trouvé ou accès non autorisé")
             
             share.expires_at = new_expires_at
-            share.updated_at = datetime.now()
             
+            # updated_at est fixé par la base et relu par RETURNING au flush : détaché
+            # avant le commit, pas de refresh
+            self.db.flush()
+            self.db.expunge(share)
             self.db.commit()
-            self.db.refresh(share)
+            self._invalidate_permissions(share.document_id)
             
             logger.info(f"Expiration prolongée pour le partage {share_id}")
             return share
@@ -311,17 +500,18 @@ class DocumentSharingService:
             share = self.db.query(DocumentShare).filter(
                 and_(
                     DocumentShare.id == share_id,
-                    DocumentShare.shared_by == owner_id
+                    DocumentShare.owner_id == owner_id
                 )
             ).first()
             
             if not share:
-                raise ValueError("Partage non trouvé ou accès non autorisé")
+                raise PermissionError("Partage non trouvé ou accès non autorisé")
             
             share.is_active = False
-            share.revoked_at = datetime.now()
+            share.revoked_at = utcnow()
             
             self.db.commit()
+            self._invalidate_permissions(share.document_id)
             
             logger.info(f"Partage {share_id} révoqué")
             return True
@@ -336,6 +526,13 @@ class DocumentSharingService:
         """
         Vérifie si un utilisateur a une permission spécifique sur un document
         
+        Le résultat est mémorisé pour la durée de la requête (instance du service). Seule
+        la propriété du document est mise en cache (QUERY_CACHE_TTL secondes) : query_cache
+        est propre à chaque processus, et révoquer ou restreindre un partage n'invalide que
+        le cache du worker qui traite la requête. Un accès accordé par un partage est donc
+        toujours revérifié en base, pour qu'une révocation prenne effet immédiatement sur
+        tous les workers uvicorn.
+        
         Args:
             document_id: ID du document
             user_id: ID de l'utilisateur
@@ -344,36 +541,53 @@ class DocumentSharingService:
         Returns:
             True si l'utilisateur a la permission
         """
-        try:
-            # Vérifier si l'utilisateur est le propriétaire
-            document = self.db.query(Document).filter(
-                and_(Document.id == document_id, Document.user_id == user_id)
-            ).first()
-            
-            if document:
-                return True  # Le propriétaire a toutes les permissions
-            
-            # Vérifier les partages actifs
-            share = self.db.query(DocumentShare).filter(
-                and_(
-                    DocumentShare.document_id == document_id,
-                    DocumentShare.shared_with == user_id,
-                    DocumentShare.is_active == True,
-                    or_(
-                        DocumentShare.expires_at.is_(None),
-                        DocumentShare.expires_at > datetime.now()
-                    )
-                )
-            ).first()
-            
-            if share and required_permission in share.permissions:
-                return True
-            
-            return False
-            
-        except Exception as e:
-            logger.error(f"Erreur lors de la vérification des permissions: {e}")
-            return False
+        local_key = (document_id, user_id, required_permission)
+        allowed = self._permission_cache.get(local_key)
+        if allowed is not None:
+            return allowed
+        
+        owner_key = query_cache.key(_permission_namespace(document_id), user_id)
+        if query_cache.get(owner_key):
+            allowed = True  # Le propriétaire a toutes les permissions
+        else:
+            # Une erreur de base remonte à l'appelant (journalisée par la route)
+            owner, shared = self._check_permission_uncached(document_id, user_id, required_permission)
+            if owner:
+                query_cache.set(owner_key, True)
+            allowed = owner or shared
+        
+        self._permission_cache[local_key] = allowed
+        return allowed
+    
+    def _check_permission_uncached(self, document_id: int, user_id: int,
+                                   required_permission: str) -> Tuple[bool, bool]:
+        """Vérification en base (sans cache) : (propriétaire, partage accordant la permission)"""
+        now = datetime.utcnow()
+        bit = SHARE_PERMISSION_BITS.get(required_permission, 0)
+        # Propriété du document et partage actif accordant la permission, évalués en un
+        # seul aller-retour ; la permission est un test de bit sur permissions_mask (une
+        # permission inconnue donne 0, donc aucun partage) : aucune ligne ne remonte.
+        # lambda_stmt : l'expression n'est construite et compilée qu'une fois, les
+        # variables capturées deviennent des paramètres liés
+        stmt = lambda_stmt(lambda: select(
+            select(Document.id).where(
+                Document.id == document_id,
+                Document.user_id == user_id
+            ).exists(),
+            select(DocumentShare.id).where(
+                DocumentShare.document_id == document_id,
+                DocumentShare.shared_with == user_id,
+                DocumentShare.is_active == True,
+                or_(
+                    DocumentShare.expires_at.is_(None),
+                    DocumentShare.expires_at > now
+                ),
+                DocumentShare.permissions_mask.op("&")(bit) != 0
+            ).exists()
+        ))
+        
+        owner, shared = self.db.execute(stmt).one()
+        return bool(owner), bool(shared)
     
     def get_share_statistics(self, user_id: int) -> Dict[str, Any]:
         """
@@ -385,62 +599,51 @@ class DocumentSharingService:
         Returns:
             Statistiques des partages
         """
-        try:
-            # Partages créés par l'utilisateur
-            shares_created = self.db.query(DocumentShare).filter(
-                and_(
-                    DocumentShare.shared_by == user_id,
-                    DocumentShare.is_active == True
-                )
-            ).count()
-            
-            # Partages reçus par l'utilisateur
-            shares_received = self.db.query(DocumentShare).filter(
-                and_(
-                    DocumentShare.shared_with == user_id,
-                    DocumentShare.is_active == True,
-                    or_(
-                        DocumentShare.expires_at.is_(None),
-                        DocumentShare.expires_at > datetime.now()
-                    )
-                )
-            ).count()
-            
-            # Partages expirés
-            expired_shares = self.db.query(DocumentShare).filter(
-                and_(
-                    DocumentShare.shared_by == user_id,
-                    DocumentShare.is_active == True,
-                    DocumentShare.expires_at < datetime.now()
+        now = datetime.utcnow()
+        # Partages créés, reçus (non expirés) et expirés : une seule requête
+        # d'agrégats conditionnels (COUNT ... FILTER) au lieu de trois COUNT. is_active
+        # est répété dans chaque branche du OR pour que SQLite parcoure les deux index
+        # partiels (MULTI-INDEX OR) au lieu de toute la table
+        owned = DocumentShare.owner_id == user_id
+        shares_created, shares_received, expired_shares = self.db.query(
+            func.count().filter(owned),
+            func.count().filter(
+                DocumentShare.shared_with == user_id,
+                or_(
+                    DocumentShare.expires_at.is_(None),
+                    DocumentShare.expires_at > now
                 )
-            ).count()
-            
-            # Documents les plus partagés
-            most_shared_docs = self.db.query(
-                Document.filename,
-                func.count(DocumentShare.id)
-            ).join(DocumentShare).filter(
-                and_(
-                    Document.user_id == user_id,
-                    DocumentShare.is_active == True
-                )
-            ).group_by(Document.id, Document.filename).order_by(
-                func.count(DocumentShare.id).desc()
-            ).limit(5).all()
-            
-            return {
-                "shares_created": shares_created,
-                "shares_received": shares_received,
-                "expired_shares": expired_shares,
-                "most_shared_documents": [
-                    {"filename": filename, "count": count} 
-                    for filename, count in most_shared_docs
-                ]
-            }
-            
-        except Exception as e:
-            logger.error(f"Erreur lors du calcul des statistiques: {e}")
-            raise
+            ),
+            func.count().filter(owned, DocumentShare.expires_at < now)
+        ).filter(
+            or_(
+                and_(owned, DocumentShare.is_active == True),
+                and_(DocumentShare.shared_with == user_id, DocumentShare.is_active == True)
+            )
+        ).one()
+        
+        # Documents les plus partagés
+        most_shared_docs = self.db.query(
+            Document.filename,
+            func.count(DocumentShare.id)
+        ).join(DocumentShare).filter(
+            and_(
+                Document.user_id == user_id,
+                DocumentShare.is_active == True
+            )
+        ).group_by(Document.id, Document.filename).order_by(
+            func.count(DocumentShare.id).desc()
+        ).limit(5).all()
+        
+        return {
+            "shares_created": shares_created,
+            "shares_received": shares_received,
+            "expired_shares": expired_shares,
+            "most_shared_documents": [
+                {"filename": filename, "count": count} 
+                for filename, count in most_shared_docs
+            ]
+        }
     
     def cleanup_expired_shares(self) -> int:
         """
@@ -450,20 +653,32 @@ class DocumentSharingService:
             Nombre de partages nettoyés
         """
         try:
-            expired_shares = self.db.query(DocumentShare).filter(
-                and_(
-                    DocumentShare.is_active == True,
-                    DocumentShare.expires_at < datetime.now()
-                )
-            ).all()
+            now = datetime.utcnow()
+            # Lots bornés : chaque UPDATE ne verrouille qu'au plus SHARE_CLEANUP_BATCH_SIZE
+            # lignes et est validé aussitôt ; SKIP LOCKED (ignoré par SQLite) laisse
+            # plusieurs nettoyages tourner en parallèle. RETURNING fournit les documents
+            # dont il faut invalider le cache des permissions, sans SELECT préalable
+            batch = select(DocumentShare.id).where(
+                DocumentShare.is_active == True,
+                DocumentShare.expires_at < now
+            ).limit(SHARE_CLEANUP_BATCH_SIZE).with_for_update(skip_locked=True)
+            stmt = update(DocumentShare).where(
+                DocumentShare.id.in_(batch.scalar_subquery())
+            ).values(
+                is_active=False, revoked_at=utcnow()
+            ).returning(
+                DocumentShare.id, DocumentShare.document_id
+            ).execution_options(synchronize_session=False)
             
             cleaned_count = 0
-            for share in expired_shares:
-                share.is_active = False
-                share.revoked_at = datetime.now()
-                cleaned_count += 1
-            
-            self.db.commit()
+            while True:
+                expired = self.db.execute(stmt).all()
+                if not expired:
+                    break
+                self.db.commit()
+                cleaned_count += len(expired)
+                for document_id in {row.document_id for row in expired}:
+                    self._invalidate_permissions(document_id)
             
             logger.info(f"{cleaned_count} partages expirés nettoyés")
             return cleaned_count
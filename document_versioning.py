@@ -4,28 +4,142 @@ Service de versioning des documents pour DocSearch AI
 Gère l'historique des versions, la comparaison et la restauration
 """
 
+import asyncio
 import hashlib
 import json
 import logging
 from datetime import datetime
-from typing import List, Dict, Any, Optional
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, desc
+from difflib import SequenceMatcher
+from typing import List, Dict, Any, Optional, Union, BinaryIO, Sequence, Tuple
+from sqlalchemy.ext.asyncio import AsyncScalarResult
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, desc, func, select
 
 from models import Document, DocumentVersion, User
 from auth import get_current_user
 
 logger = logging.getLogger(__name__)
 
+# Versions lues par lot quand l'historique est parcouru en flux
+VERSION_STREAM_BATCH_SIZE = 500
+
+# Taille des blocs lus pour le hash quand hashlib.file_digest n'existe pas (Python < 3.11)
+HASH_CHUNK_SIZE = 1 << 20
+
+def _sha256_file(file_obj: BinaryIO) -> Tuple[str, int]:
+    """SHA-256 et taille d'un fichier ouvert, lu depuis le début (bloquant : à lancer dans un thread)"""
+    file_obj.seek(0)
+    if hasattr(hashlib, "file_digest"):
+        # Boucle de lecture en C, GIL relâché pendant le hachage
+        digest = hashlib.file_digest(file_obj, "sha256")
+    else:
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: file_obj.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest(), file_obj.tell()
+
+# Opération de diff au format difflib : (tag, i1, i2, j1, j2)
+DiffOpcode = Tuple[str, int, int, int, int]
+
+# diff-match-patch (diff natif en mode lignes, borné dans le temps) est utilisé s'il
+# est installé ; sinon difflib.SequenceMatcher
+try:
+    from diff_match_patch import diff_match_patch
+except ImportError:
+    diff_match_patch = None
+
+# Temps maximal (secondes) accordé à diff-match-patch : au-delà, le diff reste valide
+# mais n'est plus minimal
+DIFF_TIMEOUT = 1.0
+
+def _dmp_opcodes(a: Sequence[str], b: Sequence[str]) -> List[DiffOpcode]:
+    """Opcodes difflib calculés par diff-match-patch en mode lignes (une ligne = un caractère)"""
+    dmp = diff_match_patch()
+    dmp.Diff_Timeout = DIFF_TIMEOUT
+    # Chaque ligne terminée par \n : la dernière ligne est codée comme les autres
+    chars_a, chars_b, _ = dmp.diff_linesToChars(
+        "".join(line + "\n" for line in a),
+        "".join(line + "\n" for line in b)
+    )
+    
+    opcodes: List[DiffOpcode] = []
+    i = j = 0
+    for op, chars in dmp.diff_main(chars_a, chars_b, False):
+        n = len(chars)
+        if op == dmp.DIFF_EQUAL:
+            opcodes.append(("equal", i, i + n, j, j + n))
+            i += n
+            j += n
+            continue
+        if op == dmp.DIFF_DELETE:
+            i += n
+        else:
+            j += n
+        # Suppression et insertion adjacentes fusionnées en remplacement (format difflib)
+        if opcodes and opcodes[-1][0] != "equal":
+            _, i1, _, j1, _ = opcodes.pop()
+            opcodes.append(("replace", i1, i, j1, j))
+        else:
+            start_i, start_j = (i - n, j) if op == dmp.DIFF_DELETE else (i, j - n)
+            opcodes.append(("delete" if op == dmp.DIFF_DELETE else "insert", start_i, i, start_j, j))
+    return opcodes
+
+def diff_opcodes(a: Sequence[str], b: Sequence[str]) -> List[DiffOpcode]:
+    """
+    Diff ligne à ligne (diff-match-patch si disponible, sinon difflib.SequenceMatcher) :
+    un bloc de lignes identiques est une seule opération, quelle que soit sa longueur
+    
+    Returns:
+        Opérations (tag, i1, i2, j1, j2) avec tag dans equal, replace, delete, insert
+    """
+    # Préfixe et suffixe communs traités sans passer par SequenceMatcher
+    prefix = 0
+    limit = min(len(a), len(b))
+    while prefix < limit and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    limit -= prefix
+    while suffix < limit and a[len(a) - 1 - suffix] == b[len(b) - 1 - suffix]:
+        suffix += 1
+    
+    opcodes = [("equal", 0, prefix, 0, prefix)] if prefix else []
+    a_end, b_end = len(a) - suffix, len(b) - suffix
+    if prefix < a_end or prefix < b_end:
+        a_mid, b_mid = a[prefix:a_end], b[prefix:b_end]
+        if diff_match_patch is not None:
+            middle = _dmp_opcodes(a_mid, b_mid)
+        else:
+            # autojunk laissé actif : sans lui, les lignes très fréquentes (lignes vides,
+            # séparateurs) rendent la recherche des blocs communs quadratique
+            middle = SequenceMatcher(None, a_mid, b_mid).get_opcodes()
+        opcodes.extend(
+            (tag, i1 + prefix, i2 + prefix, j1 + prefix, j2 + prefix)
+            for tag, i1, i2, j1, j2 in middle
+        )
+    if suffix:
+        opcodes.append(("equal", a_end, len(a), b_end, len(b)))
+    return opcodes
+
 class DocumentVersioningService:
     """Service de gestion des versions de documents"""
     
-    def __init__(self, db: Session):
+    # Instancié à chaque requête : pas de __dict__, seule la session est portée
+    __slots__ = ("db",)
+    
+    def __init__(self, db: Union[Session, AsyncSession]):
         self.db = db
     
-    def _calculate_content_hash(self, content: str) -> str:
-        """Calcule le hash du contenu pour détecter les changements"""
-        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+    def _calculate_content_hash(self, content: Union[str, bytes]) -> str:
+        """Calcule le hash du contenu pour détecter les changements (texte ou octets)"""
+        if not isinstance(content, str):
+            return hashlib.sha256(content).hexdigest()
+        # Texte encodé par tranches : même empreinte que l'encodage d'un seul bloc, sans
+        # copie UTF-8 complète du contenu en mémoire
+        digest = hashlib.sha256()
+        for start in range(0, len(content), HASH_CHUNK_SIZE):
+            digest.update(content[start:start + HASH_CHUNK_SIZE].encode('utf-8'))
+        return digest.hexdigest()
     
     def _extract_metadata(self, document: Document) -> Dict[str, Any]:
         """Extrait les métadonnées importantes du document"""
@@ -105,7 +219,7 @@ class DocumentVersioningService:
             ).first()
             
             if not document:
-                raise ValueError("Document non trouvé ou accès non autorisé")
+                raise PermissionError("Document non trouvé ou accès non autorisé")
             
             versions = self.db.query(DocumentVersion).filter(
                 DocumentVersion.document_id == document_id
@@ -152,7 +266,7 @@ class DocumentVersioningService:
             ).first()
             
             if not document:
-                raise ValueError("Accès non autorisé à cette version")
+                raise PermissionError("Accès non autorisé à cette version")
             
             return version
             
@@ -195,24 +309,19 @@ class DocumentVersioningService:
             lines1 = content1.split('\n')
             lines2 = content2.split('\n')
             
+            # Diff par blocs : une ligne insérée ne décale plus toute la suite, et les
+            # lignes inchangées sont comptées par bloc, sans parcours ligne à ligne
+            unchanged_lines = 0
             added_lines = []
             removed_lines = []
-            unchanged_lines = []
-            
-            # Comparaison ligne par ligne (simplifiée)
-            for i, line in enumerate(lines1):
-                if i < len(lines2):
-                    if line == lines2[i]:
-                        unchanged_lines.append(line)
-                    else:
-                        removed_lines.append(line)
-                        added_lines.append(lines2[i])
-                else:
-                    removed_lines.append(line)
-            
-            # Ajouter les lignes supplémentaires de la version 2
-            for i in range(len(lines1), len(lines2)):
-                added_lines.append(lines2[i])
+            for tag, i1, i2, j1, j2 in diff_opcodes(lines1, lines2):
+                if tag == "equal":
+                    unchanged_lines += i2 - i1
+                    continue
+                if tag != "insert":
+                    removed_lines.extend(lines1[i1:i2])
+                if tag != "delete":
+                    added_lines.extend(lines2[j1:j2])
             
             return {
                 "version1": {
@@ -230,12 +339,12 @@ class DocumentVersioningService:
                 "comparison": {
                     "total_lines_v1": len(lines1),
                     "total_lines_v2": len(lines2),
-                    "unchanged_lines": len(unchanged_lines),
+                    "unchanged_lines": unchanged_lines,
                     "added_lines": len(added_lines),
                     "removed_lines": len(removed_lines),
                     "added_content": added_lines,
                     "removed_content": removed_lines,
-                    "similarity_percentage": len(unchanged_lines) / max(len(lines1), len(lines2)) * 100 if max(len(lines1), len(lines2)) > 0 else 100
+                    "similarity_percentage": unchanged_lines / max(len(lines1), len(lines2)) * 100 if max(len(lines1), len(lines2)) > 0 else 100
                 }
             }
             
@@ -257,7 +366,7 @@ class DocumentVersioningService:
         try:
             version_to_restore = self.get_version(version_id, user_id)
             if not version_to_restore:
-                raise ValueError("Version non trouvée ou accès non autorisé")
+                raise PermissionError("Version non trouvée ou accès non autorisé")
             
             # Récupérer le document
             document = self.db.query(Document).filter(Document.id == version_to_restore.document_id).first()
@@ -292,7 +401,7 @@ class DocumentVersioningService:
         try:
             version = self.get_version(version_id, user_id)
             if not version:
-                raise ValueError("Version non trouvée ou accès non autorisé")
+                raise PermissionError("Version non trouvée ou accès non autorisé")
             
             # Vérifier que ce n'est pas la dernière version
             latest_version = self.get_latest_version(version.document_id)
@@ -358,4 +467,292 @@ class DocumentVersioningService:
             
         except Exception as e:
             logger.error(f"Erreur lors de la récupération des statistiques: {e}")
-            raise 
\ No newline at end of file
+            raise
+    
+    # Variantes asynchrones (AsyncSession) ; elles reposent sur les colonnes de
+    # DocumentVersion (fichier versionné : file_hash, file_size, uploaded_by)
+    
+    async def _get_owned_document_async(self, document_id: int, user_id: int) -> Document:
+        """Document appartenant à l'utilisateur, sinon ValueError"""
+        result = await self.db.execute(
+            select(Document).where(Document.id == document_id, Document.user_id == user_id)
+        )
+        document = result.scalar_one_or_none()
+        if not document:
+            raise PermissionError("Document non trouvé ou accès non autorisé")
+        return document
+    
+    async def get_versions_async(self, document_id: int, user_id: int) -> List[DocumentVersion]:
+        """Récupère toutes les versions non supprimées d'un document, avec leur auteur (asynchrone)"""
+        try:
+            await self._get_owned_document_async(document_id, user_id)
+            # Auteurs chargés en une seule requête IN (pas de chargement paresseux en async)
+            result = await self.db.execute(
+                select(DocumentVersion)
+                .options(selectinload(DocumentVersion.uploader))
+                .where(DocumentVersion.document_id == document_id, DocumentVersion.deleted_at.is_(None))
+                .order_by(desc(DocumentVersion.version_number))
+            )
+            return list(result.scalars().all())
+            
+        except Exception as e:
+            logger.error(f"Erreur lors de la récupération des versions: {e}")
+            raise
+    
+    async def stream_versions_async(self, document_id: int, user_id: int,
+                                    batch_size: int = VERSION_STREAM_BATCH_SIZE) -> AsyncScalarResult:
+        """
+        Ouvre un curseur sur les versions non supprimées d'un document (plus récente d'abord)
+        
+        La propriété du document est vérifiée avant le retour ; les versions sont ensuite
+        lues par lots de `batch_size` (auteurs préchargés lot par lot) au fil de l'itération.
+        """
+        try:
+            await self._get_owned_document_async(document_id, user_id)
+            result = await self.db.stream(
+                select(DocumentVersion)
+                .options(selectinload(DocumentVersion.uploader))
+                .where(DocumentVersion.document_id == document_id, DocumentVersion.deleted_at.is_(None))
+                .order_by(desc(DocumentVersion.version_number))
+                .execution_options(yield_per=batch_size)
+            )
+            return result.scalars()
+            
+        except Exception as e:
+            logger.error(f"Erreur lors de la récupération des versions: {e}")
+            raise
+    
+    async def get_latest_version_async(self, document_id: int) -> Optional[DocumentVersion]:
+        """Récupère la version la plus récente d'un document (asynchrone)"""
+        try:
+            result = await self.db.execute(
+                select(DocumentVersion)
+                .where(DocumentVersion.document_id == document_id, DocumentVersion.deleted_at.is_(None))
+                .order_by(desc(DocumentVersion.version_number))
+                .limit(1)
+            )
+            return result.scalar_one_or_none()
+        except Exception as e:
+            logger.error(f"Erreur lors de la récupération de la dernière version: {e}")
+            return None
+    
+    async def get_version_async(self, version_id: int, user_id: int) -> Optional[DocumentVersion]:
+        """Récupère une version et vérifie la propriété du document en une requête (asynchrone)"""
+        try:
+            result = await self.db.execute(
+                select(DocumentVersion, Document.user_id)
+                .join(Document, Document.id == DocumentVersion.document_id)
+                .where(DocumentVersion.id == version_id, DocumentVersion.deleted_at.is_(None))
+            )
+            row = result.first()
+            if not row:
+                return None
+            
+            version, owner_id = row
+            if owner_id != user_id:
+                raise PermissionError("Accès non autorisé à cette version")
+            
+            return version
+            
+        except Exception as e:
+            logger.error(f"Erreur lors de la récupération de la version: {e}")
+            raise
+    
+    async def get_next_version_number_async(self, document_id: int) -> int:
+        """Calcule le prochain numéro de version (les versions supprimées gardent leur numéro)"""
+        result = await self.db.execute(
+            select(func.max(DocumentVersion.version_number)).where(DocumentVersion.document_id == document_id)
+        )
+        return (result.scalar() or 0) + 1
+    
+    async def create_version_async(self, document_id: int, user_id: int, filename: str, file_type: str,
+                                   file_obj: BinaryIO, metadata: Dict[str, Any] = None) -> DocumentVersion:
+        """
+        Crée une nouvelle version d'un document à partir du fichier reçu (asynchrone)
+        
+        Args:
+            document_id: ID du document
+            user_id: ID de l'utilisateur (propriétaire du document)
+            filename: Nom du fichier
+            file_type: Type du fichier
+            file_obj: Fichier reçu, ouvert en binaire (haché dans un thread, sans être chargé en mémoire)
+            metadata: Métadonnées de la version
+            
+        Returns:
+            DocumentVersion créée (ou la dernière si le fichier est identique)
+        """
+        try:
+            # Propriété vérifiée avant de lire le fichier
+            await self._get_owned_document_async(document_id, user_id)
+            
+            # Hash calculé hors de la boucle d'événements
+            file_hash, file_size = await asyncio.to_thread(_sha256_file, file_obj)
+            
+            # Vérifier si le fichier a changé
+            latest_version = await self.get_latest_version_async(document_id)
+            if latest_version and latest_version.file_hash == file_hash:
+                logger.info(f"Fichier identique pour le document {document_id}, pas de nouvelle version créée")
+                return latest_version
+            
+            version_number = await self.get_next_version_number_async(document_id)
+            new_version = DocumentVersion(
+                document_id=document_id,
+                version_number=version_number,
+                filename=filename,
+                file_type=file_type,
+                file_hash=file_hash,
+                file_size=file_size,
+                uploaded_by=user_id,
+                metadata_json=json.dumps(metadata) if metadata else None
+            )
+            
+            self.db.add(new_version)
+            await self.db.commit()
+            await self.db.refresh(new_version)
+            
+            logger.info(f"Nouvelle version {version_number} créée pour le document {document_id}")
+            return new_version
+            
+        except Exception as e:
+            logger.error(f"Erreur lors de la création de la version: {e}")
+            await self.db.rollback()
+            raise
+    
+    async def compare_versions_async(self, version1_id: int, version2_id: int, user_id: int) -> Dict[str, Any]:
+        """Compare les fichiers de deux versions d'un document (asynchrone)"""
+        try:
+            version1 = await self.get_version_async(version1_id, user_id)
+            version2 = await self.get_version_async(version2_id, user_id)
+            
+            if not version1 or not version2:
+                raise ValueError("Une ou les deux versions non trouvées")
+            
+            if version1.document_id != version2.document_id:
+                raise ValueError("Les versions doivent appartenir au même document")
+            
+            return {
+                "version1": {
+                    "id": version1.id,
+                    "version_number": version1.version_number,
+                    "created_at": version1.created_at.isoformat()
+                },
+                "version2": {
+                    "id": version2.id,
+                    "version_number": version2.version_number,
+                    "created_at": version2.created_at.isoformat()
+                },
+                "comparison": {
+                    "identical": version1.file_hash == version2.file_hash,
+                    "size_difference": version2.file_size - version1.file_size,
+                    "changed_fields": [
+                        field for field in ("filename", "file_type", "file_hash", "file_size")
+                        if getattr(version1, field) != getattr(version2, field)
+                    ]
+                }
+            }
+            
+        except Exception as e:
+            logger.error(f"Erreur lors de la comparaison des versions: {e}")
+            raise
+    
+    async def restore_version_async(self, version_id: int, user_id: int) -> DocumentVersion:
+        """Restaure une version précédente en créant une nouvelle version du même fichier (asynchrone)"""
+        try:
+            version_to_restore = await self.get_version_async(version_id, user_id)
+            if not version_to_restore:
+                raise PermissionError("Version non trouvée ou accès non autorisé")
+            
+            metadata = json.loads(version_to_restore.metadata_json) if version_to_restore.metadata_json else {}
+            metadata["restored_from"] = version_to_restore.version_number
+            
+            version_number = await self.get_next_version_number_async(version_to_restore.document_id)
+            new_version = DocumentVersion(
+                document_id=version_to_restore.document_id,
+                version_number=version_number,
+                filename=version_to_restore.filename,
+                file_type=version_to_restore.file_type,
+                file_hash=version_to_restore.file_hash,
+                file_size=version_to_restore.file_size,
+                uploaded_by=user_id,
+                metadata_json=json.dumps(metadata)
+            )
+            
+            self.db.add(new_version)
+            await self.db.commit()
+            await self.db.refresh(new_version)
+            
+            logger.info(f"Version {version_to_restore.version_number} restaurée pour le document {version_to_restore.document_id}")
+            return new_version
+            
+        except Exception as e:
+            logger.error(f"Erreur lors de la restauration de la version: {e}")
+            await self.db.rollback()
+            raise
+    
+    async def delete_version_async(self, version_id: int, user_id: int) -> bool:
+        """Supprime (logiquement) une version, sauf la dernière (asynchrone)"""
+        try:
+            version = await self.get_version_async(version_id, user_id)
+            if not version:
+                raise PermissionError("Version non trouvée ou accès non autorisé")
+            
+            latest_version = await self.get_latest_version_async(version.document_id)
+            if latest_version and latest_version.id == version_id:
+                raise ValueError("Impossible de supprimer la dernière version")
+            
+            version.deleted_at = datetime.utcnow()
+            version.deleted_by = user_id
+            await self.db.commit()
+            
+            logger.info(f"Version {version.version_number} supprimée pour le document {version.document_id}")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Erreur lors de la suppression de la version: {e}")
+            await self.db.rollback()
+            raise
+    
+    @staticmethod
+    def summarize_versions(versions: List[DocumentVersion]) -> Dict[str, Any]:
+        """Statistiques calculées à partir des versions déjà chargées (plus récente d'abord)"""
+        if not versions:
+            return {
+                "total_versions": 0,
+                "latest_version": None,
+                "first_version": None,
+                "version_history": []
+            }
+        
+        return {
+            "total_versions": len(versions),
+            "latest_version": {
+                "number": versions[0].version_number,
+                "created_at": versions[0].created_at.isoformat(),
+                "filename": versions[0].filename
+            },
+            "first_version": {
+                "number": versions[-1].version_number,
+                "created_at": versions[-1].created_at.isoformat(),
+                "filename": versions[-1].filename
+            },
+            "version_history": [
+                {
+                    "id": v.id,
+                    "version_number": v.version_number,
+                    "created_at": v.created_at.isoformat(),
+                    "filename": v.filename,
+                    "file_size": v.file_size
+                }
+                for v in versions
+            ]
+        }
+    
+    async def get_version_statistics_async(self, document_id: int, user_id: int) -> Dict[str, Any]:
+        """Récupère les statistiques des versions d'un document (asynchrone)"""
+        try:
+            versions = await self.get_versions_async(document_id, user_id)
+            return self.summarize_versions(versions)
+            
+        except Exception as e:
+            logger.error(f"Erreur lors de la récupération des statistiques: {e}")
+            raise
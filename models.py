@@ -1,15 +1,51 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, Text, ForeignKey
+from sqlalchemy import create_engine, event, DDL, Column, Integer, SmallInteger, Float, String, DateTime, Boolean, Text, ForeignKey, Index, inspect
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
 from datetime import datetime
+import logging
 import os
 
+from config import settings
+
+logger = logging.getLogger(__name__)
+
 # Configuration de la base de données
 DATABASE_URL = "sqlite:///./docsearch.db"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+# Pool LIFO : les connexions récemment utilisées sont reprises en priorité, les autres
+# vieillissent et sont recyclées
+_POOL_OPTIONS = dict(
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    pool_use_lifo=True,
+)
+engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False}, **_POOL_OPTIONS)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Moteur asynchrone (aiosqlite) pour les routes qui ne doivent pas bloquer la boucle d'événements
+ASYNC_DATABASE_URL = DATABASE_URL.replace("sqlite://", "sqlite+aiosqlite://", 1)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, pool_pre_ping=True, **_POOL_OPTIONS)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
+
+class utcnow(FunctionElement):
+    """Horodatage UTC calculé par la base (défauts serveur et UPDATE)"""
+    type = DateTime()
+    inherit_cache = True
+
+@compiles(utcnow)
+def _compile_utcnow(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"
+
+@compiles(utcnow, "sqlite")
+def _compile_utcnow_sqlite(element, compiler, **kw):
+    # Même format texte que les DateTime écrits par SQLAlchemy (microsecondes) :
+    # CURRENT_TIMESTAMP s'arrête à la seconde et se compare mal aux valeurs liées
+    return "(STRFTIME('%Y-%m-%d %H:%M:%f000', 'now'))"
+
 class User(Base):
     """Modèle utilisateur"""
     __tablename__ = "users"
@@ -51,6 +87,11 @@ class Document(Base):
     
     # Relation many-to-many avec les tags
     tags = relationship("DocumentTag", secondary="document_tags_association", back_populates="documents")
+    
+    __table_args__ = (
+        # Filtre par propriétaire (jointure des recherches d'annotations)
+        Index("ix_documents_user_id", "user_id"),
+    )
 
 class UserSession(Base):
     """Modèle session utilisateur"""
@@ -115,13 +156,27 @@ class DocumentAnnotation(Base):
     content = Column(Text, nullable=False)
     annotation_type = Column(String, default="note")  # note, highlight, comment
     position = Column(Text, nullable=True)  # JSON string pour position
+    # Champs de position les plus lus, extraits du JSON pour être filtrés et indexés
+    position_page = Column(Integer, nullable=True)
+    position_x = Column(Float, nullable=True)
+    position_y = Column(Float, nullable=True)
+    tags = Column(Text, nullable=True)  # JSON string ["tag1", "tag2"] (copie affichée, voir AnnotationTag)
     metadata_json = Column(Text, nullable=True)  # JSON string
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    is_active = Column(Boolean, default=True)
+    created_at = Column(DateTime, server_default=utcnow())
+    updated_at = Column(DateTime, server_default=utcnow(), onupdate=utcnow())
+    deleted_at = Column(DateTime, nullable=True)
     
     # Relations
     document = relationship("Document", back_populates="annotations")
     user = relationship("User")
+    
+    __table_args__ = (
+        # Annotations actives d'un document, déjà triées par date décroissante
+        Index("ix_annot_doc_active_created", "document_id", "is_active", created_at.desc()),
+        # Annotations d'une page d'un document
+        Index("ix_annot_doc_page", "document_id", "position_page"),
+    )
 
 class DocumentTag(Base):
     """Modèle tag de document"""
@@ -131,8 +186,10 @@ class DocumentTag(Base):
     name = Column(String, unique=True, nullable=False)
     color = Column(String, default="#3B82F6")  # Couleur hexadécimale
     description = Column(Text, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    is_active = Column(Boolean, default=True)
+    created_at = Column(DateTime, server_default=utcnow())
+    updated_at = Column(DateTime, server_default=utcnow(), onupdate=utcnow())
+    deleted_at = Column(DateTime, nullable=True)
     
     # Relations
     documents = relationship("Document", secondary="document_tags_association", back_populates="tags")
@@ -145,6 +202,17 @@ class DocumentTagAssociation(Base):
     document_id = Column(Integer, ForeignKey("documents.id"), primary_key=True)
     tag_id = Column(Integer, ForeignKey("document_tags.id"), primary_key=True)
 
+class AnnotationTag(Base):
+    """Table d'association annotation-tag (filtres et statistiques par jointure)"""
+    __tablename__ = "annotation_tags"
+    
+    annotation_id = Column(Integer, ForeignKey("document_annotations.id"), primary_key=True)
+    tag_id = Column(Integer, ForeignKey("document_tags.id"), primary_key=True)
+    
+    __table_args__ = (
+        Index("ix_annotation_tags_tag_annotation", "tag_id", "annotation_id"),
+    )
+
 class DocumentShare(Base):
     """Modèle partage de document"""
     __tablename__ = "document_shares"
@@ -154,22 +222,215 @@ class DocumentShare(Base):
     owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     shared_with = Column(Integer, ForeignKey("users.id"), nullable=False)
     permissions = Column(Text, nullable=False)  # JSON string ["read", "write", "comment"]
+    # Mêmes permissions en masque de bits (SHARE_PERMISSION_BITS), testé par check_permission
+    permissions_mask = Column(SmallInteger, nullable=False, default=1)
     expires_at = Column(DateTime, nullable=True)
     message = Column(Text, nullable=True)
     is_active = Column(Boolean, default=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, server_default=utcnow())
+    updated_at = Column(DateTime, server_default=utcnow(), onupdate=utcnow())
     revoked_at = Column(DateTime, nullable=True)
     
+    # Horodatages fournis par la base, relus par RETURNING lors du flush (pas de SELECT)
+    __mapper_args__ = {"eager_defaults": True}
+    
+    __table_args__ = (
+        # Un seul partage actif par (document, destinataire) : cible de l'UPSERT de share_document
+        Index(
+            "uq_share_doc_recipient_active", "document_id", "shared_with",
+            unique=True,
+            sqlite_where=is_active == True,
+            postgresql_where=is_active == True
+        ),
+        # Partages actifs reçus et créés : pages de get_shared_documents (ordre created_at,
+        # puis id implicite en fin d'index) et statistiques ; index partiels limités aux
+        # lignes actives
+        Index(
+            "ix_share_recipient_active_created", "shared_with", "created_at",
+            sqlite_where=is_active == True,
+            postgresql_where=is_active == True
+        ),
+        Index(
+            "ix_share_owner_active_created", "owner_id", "created_at",
+            sqlite_where=is_active == True,
+            postgresql_where=is_active == True
+        ),
+    )
+    
     # Relations
     document = relationship("Document", back_populates="shares")
     owner = relationship("User", foreign_keys=[owner_id])
     shared_user = relationship("User", foreign_keys=[shared_with])
 
+# Index plein texte des annotations (SQLite FTS5, tokenizer trigram) :
+# table externe synchronisée par triggers, interrogée par search_annotations
+ANNOTATION_FTS_TABLE = "document_annotations_fts"
+ANNOTATION_FTS_DDL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {ANNOTATION_FTS_TABLE} USING fts5("
+    f"content, content='document_annotations', content_rowid='id', tokenize='trigram')",
+    f"CREATE TRIGGER IF NOT EXISTS {ANNOTATION_FTS_TABLE}_ai AFTER INSERT ON document_annotations BEGIN "
+    f"INSERT INTO {ANNOTATION_FTS_TABLE}(rowid, content) VALUES (new.id, new.content); END",
+    f"CREATE TRIGGER IF NOT EXISTS {ANNOTATION_FTS_TABLE}_ad AFTER DELETE ON document_annotations BEGIN "
+    f"INSERT INTO {ANNOTATION_FTS_TABLE}({ANNOTATION_FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content); END",
+    f"CREATE TRIGGER IF NOT EXISTS {ANNOTATION_FTS_TABLE}_au AFTER UPDATE OF content ON document_annotations BEGIN "
+    f"INSERT INTO {ANNOTATION_FTS_TABLE}({ANNOTATION_FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content); "
+    f"INSERT INTO {ANNOTATION_FTS_TABLE}(rowid, content) VALUES (new.id, new.content); END",
+)
+
+for _statement in ANNOTATION_FTS_DDL:
+    event.listen(
+        DocumentAnnotation.__table__,
+        "after_create",
+        DDL(_statement).execute_if(dialect="sqlite")
+    )
+
+def create_annotation_fts(bind=engine):
+    """Crée l'index plein texte sur une base existante et l'alimente s'il est nouveau"""
+    if bind.dialect.name != "sqlite":
+        return
+    with bind.begin() as connection:
+        exists = connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE name = ?", (ANNOTATION_FTS_TABLE,)
+        ).first()
+        for statement in ANNOTATION_FTS_DDL:
+            connection.exec_driver_sql(statement)
+        if not exists:
+            connection.exec_driver_sql(
+                f"INSERT INTO {ANNOTATION_FTS_TABLE}({ANNOTATION_FTS_TABLE}) VALUES ('rebuild')"
+            )
+
+# Colonnes ajoutées après coup (tags dénormalisés et suppression logique) ; les lignes
+# existantes sont considérées actives
+ADDED_COLUMNS = {
+    "document_annotations": (
+        ("tags", "TEXT"),
+        ("is_active", "BOOLEAN DEFAULT 1"),
+        ("deleted_at", "DATETIME"),
+    ),
+    "document_tags": (
+        ("is_active", "BOOLEAN DEFAULT 1"),
+        ("deleted_at", "DATETIME"),
+    ),
+}
+
+def add_missing_columns(bind=engine):
+    """Ajoute sur une base existante les colonnes d'ADDED_COLUMNS qui lui manquent"""
+    if bind.dialect.name != "sqlite":
+        return
+    with bind.begin() as connection:
+        for table_name, columns in ADDED_COLUMNS.items():
+            existing = {
+                row[1] for row in connection.exec_driver_sql(f"PRAGMA table_info({table_name})")
+            }
+            for name, sql_type in columns:
+                if name not in existing:
+                    connection.exec_driver_sql(f"ALTER TABLE {table_name} ADD COLUMN {name} {sql_type}")
+
+# Colonnes de position ajoutées après coup à document_annotations
+ANNOTATION_POSITION_COLUMNS = (
+    ("position_page", "INTEGER", "$.page"),
+    ("position_x", "FLOAT", "$.x"),
+    ("position_y", "FLOAT", "$.y"),
+)
+
+def add_annotation_position_columns(bind=engine):
+    """Ajoute les colonnes de position sur une base existante et les remplit depuis le JSON"""
+    if bind.dialect.name != "sqlite":
+        return
+    with bind.begin() as connection:
+        existing = {
+            row[1] for row in connection.exec_driver_sql("PRAGMA table_info(document_annotations)")
+        }
+        for name, sql_type, path in ANNOTATION_POSITION_COLUMNS:
+            if name in existing:
+                continue
+            connection.exec_driver_sql(f"ALTER TABLE document_annotations ADD COLUMN {name} {sql_type}")
+            connection.exec_driver_sql(
+                f"UPDATE document_annotations SET {name} = json_extract(position, '{path}') "
+                "WHERE position IS NOT NULL AND json_valid(position)"
+            )
+
+# Permissions de partage -> bit de DocumentShare.permissions_mask ; la liste JSON
+# (permissions) reste la représentation exposée par l'API
+SHARE_PERMISSION_BITS = {"read": 1, "write": 2, "comment": 4, "share": 8}
+
+def permissions_to_mask(permissions) -> int:
+    """Liste de permissions -> masque de bits (les noms inconnus sont ignorés)"""
+    mask = 0
+    for name in permissions:
+        mask |= SHARE_PERMISSION_BITS.get(name, 0)
+    return mask
+
+def add_share_permissions_mask(bind=engine):
+    """Ajoute permissions_mask sur une base existante et le calcule depuis la liste JSON"""
+    if bind.dialect.name != "sqlite":
+        return
+    with bind.begin() as connection:
+        existing = {
+            row[1] for row in connection.exec_driver_sql("PRAGMA table_info(document_shares)")
+        }
+        if "permissions_mask" in existing:
+            return
+        connection.exec_driver_sql(
+            "ALTER TABLE document_shares ADD COLUMN permissions_mask SMALLINT NOT NULL DEFAULT 0"
+        )
+        bits = " ".join(f"WHEN '{name}' THEN {bit}" for name, bit in SHARE_PERMISSION_BITS.items())
+        connection.exec_driver_sql(
+            "UPDATE document_shares SET permissions_mask = ("
+            f"SELECT COALESCE(SUM(DISTINCT CASE value {bits} ELSE 0 END), 0) FROM json_each(permissions)"
+            ") WHERE json_valid(permissions)"
+        )
+
+def deactivate_duplicate_active_shares(bind=engine):
+    """
+    Avant la création de uq_share_doc_recipient_active sur une base existante : ne garde
+    actif que le partage le plus récent de chaque (document, destinataire). L'ancien
+    share_document (SELECT puis INSERT, sans verrou) a pu en créer plusieurs ; les autres
+    sont désactivés et marqués révoqués.
+    """
+    if bind.dialect.name != "sqlite":
+        return
+    with bind.begin() as connection:
+        index_exists = connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'uq_share_doc_recipient_active'"
+        ).first()
+        if index_exists:
+            return
+        result = connection.exec_driver_sql(
+            "UPDATE document_shares SET is_active = 0, revoked_at = CURRENT_TIMESTAMP "
+            "WHERE id IN (SELECT id FROM ("
+            "SELECT id, ROW_NUMBER() OVER ("
+            "PARTITION BY document_id, shared_with ORDER BY created_at DESC, id DESC"
+            ") AS rank FROM document_shares WHERE is_active = 1"
+            ") WHERE rank > 1)"
+        )
+        if result.rowcount:
+            logger.warning(f"{result.rowcount} partages actifs en double désactivés")
+
 # Créer les tables
 def create_tables():
     """Crée toutes les tables de la base de données"""
     Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine)
+    add_annotation_position_columns(engine)
+    add_share_permissions_mask(engine)
+    deactivate_duplicate_active_shares(engine)
+    # create_all ne crée les index qu'avec les nouvelles tables : ajouter ceux
+    # qui manquent sur une base existante (sauf si une de leurs colonnes manque encore)
+    schema = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"] for column in schema.get_columns(table.name)}
+        for index in table.indexes:
+            missing = [column.name for column in index.columns if column.name not in existing]
+            if missing:
+                logger.warning(f"Index {index.name} non créé, colonnes absentes: {missing}")
+                continue
+            index.create(bind=engine, checkfirst=True)
+    create_annotation_fts(engine)
+    # Statistiques du planificateur à jour pour les nouveaux index (ANALYZE si utile)
+    if engine.dialect.name == "sqlite":
+        with engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA optimize")
 
 # Fonction pour obtenir la session DB
 def get_db():
@@ -180,6 +441,11 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    """Obtient une session de base de données asynchrone"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
 # Créer les tables au démarrage
 if __name__ == "__main__":
     create_tables()
@@ -11,7 +11,7 @@ from pathlib import Path
 # Ajouter le répertoire courant au path
 sys.path.append(str(Path(__file__).parent))
 
-from config import Config
+from config import settings
 from document_loader import DocumentLoader
 from text_splitter import TextSplitter
 from vector_store import VectorStore
@@ -55,8 +55,8 @@ def check_ollama():
 
 def setup_directories():
     """Crée les répertoires nécessaires"""
-    Path(Config.SOURCE_DIR).mkdir(exist_ok=True)
-    Path(Config.VECTOR_DB_PATH).mkdir(exist_ok=True)
+    Path(settings.SOURCE_DIR).mkdir(exist_ok=True)
+    Path(settings.VECTOR_DB_PATH).mkdir(exist_ok=True)
 
 def load_documents():
     """Charge et indexe les documents"""
@@ -64,7 +64,7 @@ def load_documents():
     
     # Charger les documents
     loader = DocumentLoader()
-    documents = loader.load_documents(Config.SOURCE_DIR)
+    documents = loader.load_documents(settings.SOURCE_DIR)
     
     if not documents:
         print("⚠️ Aucun document trouvé dans le dossier 'source/'")
@@ -75,13 +75,13 @@ def load_documents():
     
     # Découper en chunks
     splitter = TextSplitter(
-        chunk_size=Config.CHUNK_SIZE,
-        chunk_overlap=Config.CHUNK_OVERLAP
+        chunk_size=settings.CHUNK_SIZE,
+        chunk_overlap=settings.CHUNK_OVERLAP
     )
     chunks = splitter.split_documents(documents)
     
     # Indexer dans la base vectorielle
-    vector_store = VectorStore(Config.VECTOR_DB_PATH)
+    vector_store = VectorStore(settings.VECTOR_DB_PATH)
     vector_store.add_chunks(chunks)
     
     return vector_store, chunks
@@ -95,9 +95,6 @@ def main():
     if not check_dependencies():
         return
     
-    # Charger la configuration
-    Config.load_config()
-    
     # Vérifier Ollama
     if not check_ollama():
         print("⚠️ L'application peut fonctionner sans Ollama, mais certaines fonctionnalités seront limitées")